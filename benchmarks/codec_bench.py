@@ -0,0 +1,101 @@
+"""Микробенчмарк кодеков: скорость кодирования/декодирования и размер сообщения
+
+Сравнивает текущий путь JSON (json.dumps/json.loads плюс разбор ISO времени
+через datetime.fromisoformat, как в handle_message) с двоичным кодеком bin1.
+
+Пример:
+    python benchmarks/codec_bench.py --iterations 200000 --json codec.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network_messenger import CODECS, encode_frame
+
+
+SAMPLES = {
+    "короткое": {
+        "type": "message",
+        "text": "привет",
+        "sender": "192.168.1.10:8888",
+        "timestamp": "2025-12-15T00:52:12.758000",
+        "message_id": "3f9c1a2b7d4e5f60-1024"
+    },
+    "1 КБ текста": {
+        "type": "message",
+        "text": "Сообщение средней длины. " * 40,
+        "sender": "192.168.1.10:8888",
+        "timestamp": "2025-12-15T00:52:12.758000",
+        "message_id": "3f9c1a2b7d4e5f60-1025"
+    },
+    "gossip": {
+        "type": "message",
+        "text": "hello",
+        "sender": "10.0.0.5:8890",
+        "timestamp": "2025-12-15T00:52:12.758000",
+        "message_id": "3f9c1a2b7d4e5f60-1026",
+        "ttl": 5,
+        "via": "10.0.0.7:8888"
+    }
+}
+
+
+def parse_timestamp(message):
+    """Приведение времени к epoch секундам, как при приеме сообщения"""
+    timestamp = message.get('timestamp')
+    if isinstance(timestamp, (int, float)):
+        return float(timestamp)
+    return datetime.fromisoformat(timestamp).timestamp()
+
+
+def measure(func, iterations):
+    """Число операций в секунду"""
+    started = time.perf_counter()
+    for _ in range(iterations):
+        func()
+    return iterations / (time.perf_counter() - started)
+
+
+def bench(sample, codec, iterations):
+    encoded = codec.encode(sample)
+    view = memoryview(encoded)
+
+    def decode():
+        parse_timestamp(codec.decode(view))
+
+    return {
+        "codec": codec.name,
+        "bytes": len(encoded),
+        "frame_bytes": len(encode_frame(encoded)),
+        "encode_per_sec": measure(lambda: codec.encode(sample), iterations),
+        "decode_per_sec": measure(decode, iterations)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сравнение кодеков сообщений")
+    parser.add_argument('--iterations', type=int, default=100000)
+    parser.add_argument('--json', help="файл для результатов в формате JSON")
+    args = parser.parse_args()
+
+    results = []
+    print(f"{'сообщение':<12} {'кодек':<6} {'байт':>6} {'кодир/с':>10} {'декод/с':>10}")
+    for name, sample in SAMPLES.items():
+        for codec in CODECS.values():
+            result = {"sample": name, **bench(sample, codec, args.iterations)}
+            results.append(result)
+            print(f"{name:<12} {codec.name:<6} {result['bytes']:>6} "
+                  f"{result['encode_per_sec']:>10.0f} {result['decode_per_sec']:>10.0f}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+"""Симулятор распространения сообщений: покрытие и задержка на N локальных узлах
+
+Запускает N узлов NetworkMessenger в одном процессе на loopback (без UDP
+discovery - таблицы узлов заполняются напрямую), рассылает сообщения со
+случайного узла и измеряет долю узлов, получивших сообщение, задержку
+доставки и число лишних копий (дубликатов).
+
+Пример:
+    python benchmarks/gossip_sim.py --nodes 10 50 100 200 --mode gossip mesh
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network_messenger import NetworkMessenger
+
+
+def percentile(values, p):
+    """Перцентиль по отсортированному списку"""
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+def start_nodes(count, mode, fanout, ttl, base_port):
+    """Запуск узлов и заполнение полной таблицы узлов"""
+    nodes = []
+    for i in range(count):
+        config_file = f"node_{base_port + i}.json"
+        with open(config_file, 'w', encoding='utf-8') as f:
+            json.dump({
+                "host": "127.0.0.1",
+                "port": base_port + i,
+                "server_mode": "asyncio",
+                "discovery_enabled": False,
+                "dissemination": mode,
+                "gossip_fanout": fanout,
+                "gossip_ttl": ttl
+            }, f)
+        with contextlib.redirect_stdout(io.StringIO()):
+            node = NetworkMessenger(config_file)
+            node.console_output = False
+            if not node.start():
+                raise RuntimeError(f"не удалось запустить узел на порту {base_port + i}")
+        nodes.append(node)
+
+    addresses = [(node.config['host'], node.config['port']) for node in nodes]
+    capabilities = {'codecs': nodes[0].config['codecs']}
+    now = time.time()
+    for node in nodes:
+        own = (node.config['host'], node.config['port'])
+        for addr in addresses:
+            if addr != own:
+                node.peer_table.touch(addr, protocol=1, capabilities=capabilities, now=now)
+    return nodes
+
+
+def stop_nodes(nodes):
+    """Параллельная остановка узлов"""
+    threads = [threading.Thread(target=node.stop) for node in nodes]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def run(count, mode, fanout, ttl, messages, wait, base_port):
+    """Один прогон: count узлов, messages рассылок в режиме mode"""
+    nodes = start_nodes(count, mode, fanout, ttl, base_port)
+    received = [dict() for _ in nodes]
+
+    for i, node in enumerate(nodes):
+        def on_message(message_data, address, inbox=received[i]):
+            inbox.setdefault(message_data.get('text'), time.monotonic())
+        node.on_message(on_message)
+
+    coverage = []
+    latencies = []
+    try:
+        for m in range(messages):
+            origin = random.randrange(count)
+            text = f"sim-{mode}-{count}-{m}"
+            started = time.monotonic()
+            nodes[origin].send(text)
+
+            # Ждем, пока сообщение дойдет до всех или истечет время
+            deadline = started + wait
+            while time.monotonic() < deadline:
+                if sum(1 for inbox in received if text in inbox) >= count - 1:
+                    break
+                time.sleep(0.005)
+
+            got = [inbox[text] for i, inbox in enumerate(received) if i != origin and text in inbox]
+            coverage.append(len(got) / (count - 1))
+            latencies.extend((t - started) * 1000 for t in got)
+    finally:
+        duplicates = sum(node.dedup.hits for node in nodes)
+        stop_nodes(nodes)
+
+    return {
+        "nodes": count,
+        "mode": mode,
+        "fanout": fanout if mode == 'gossip' else count - 1,
+        "ttl": ttl if mode == 'gossip' else None,
+        "messages": messages,
+        "coverage_avg": sum(coverage) / len(coverage),
+        "coverage_min": min(coverage),
+        "latency_p50_ms": percentile(latencies, 50),
+        "latency_p99_ms": percentile(latencies, 99),
+        "latency_max_ms": max(latencies) if latencies else None,
+        "duplicates_per_message": duplicates / messages
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Симулятор gossip-рассылки")
+    parser.add_argument('--nodes', type=int, nargs='+', default=[10, 50, 100, 200])
+    parser.add_argument('--mode', nargs='+', default=['gossip', 'mesh'], choices=['gossip', 'mesh'])
+    parser.add_argument('--fanout', type=int, default=4)
+    parser.add_argument('--ttl', type=int, default=6)
+    parser.add_argument('--messages', type=int, default=5)
+    parser.add_argument('--wait', type=float, default=3.0, help="ожидание доставки одного сообщения, сек")
+    parser.add_argument('--base-port', type=int, default=21000)
+    parser.add_argument('--json', help="файл для результатов в формате JSON")
+    args = parser.parse_args()
+
+    # Логи и конфигурации узлов - во временном каталоге
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    workdir = tempfile.mkdtemp(prefix='gossip_sim_')
+    os.chdir(workdir)
+
+    results = []
+    print(f"{'узлов':>6} {'режим':>7} {'покрытие':>9} {'мин':>6} {'p50 мс':>8} {'p99 мс':>8} {'дубл/сообщ':>11}")
+    for count in args.nodes:
+        for mode in args.mode:
+            result = run(count, mode, args.fanout, args.ttl, args.messages, args.wait, args.base_port)
+            results.append(result)
+            print(f"{count:>6} {mode:>7} {result['coverage_avg']:>9.1%} {result['coverage_min']:>6.0%} "
+                  f"{result['latency_p50_ms'] or 0:>8.1f} {result['latency_p99_ms'] or 0:>8.1f} "
+                  f"{result['duplicates_per_message']:>11.1f}")
+            # Порты предыдущего прогона могут быть в TIME_WAIT
+            args.base_port += count + 20
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    print(f"Логи узлов: {workdir}")
+
+
+if __name__ == "__main__":
+    main()
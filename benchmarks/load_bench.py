@@ -0,0 +1,335 @@
+"""Нагрузочный стенд: N узлов на loopback, пропускная способность и задержки
+
+Каждый узел NetworkMessenger запускается в отдельном процессе (без
+интерактивного меню, со своим портом и рабочим каталогом). Стенд измеряет:
+
+  - время схождения discovery (все узлы видят друг друга);
+  - пропускную способность при заданной частоте и размере сообщений;
+  - p50/p99 задержки от отправки до получения;
+  - процессорное время и RSS каждого узла.
+
+Результаты пишутся в JSON для сравнения версий между собой.
+
+Пример:
+    python benchmarks/load_bench.py --nodes 5 --senders 2 --rate 500 --size 256 \\
+        --duration 10 --json results.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from network_messenger import NetworkMessenger
+
+
+def percentile(values, p):
+    """Перцентиль по отсортированному списку"""
+    if not values:
+        return None
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+def read_rss():
+    """Текущий и пиковый RSS процесса, КБ (Linux /proc)"""
+    rss = {}
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith(('VmRSS:', 'VmHWM:')):
+                    key, value = line.split(':')
+                    rss[key] = int(value.split()[0])
+    except OSError:
+        pass
+    return rss.get('VmRSS'), rss.get('VmHWM')
+
+
+def cpu_seconds():
+    times = os.times()
+    return times.user + times.system
+
+
+class BenchNode:
+    """Узел в процессе-исполнителе: прием команд стенда и учет полученных сообщений"""
+
+    def __init__(self, config):
+        self.workdir = tempfile.mkdtemp(prefix=f"node_{config['port']}_")
+        os.chdir(self.workdir)
+        with open('config.json', 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.node = NetworkMessenger('config.json')
+            self.node.console_output = False
+            self.started = self.node.start()
+
+        self.lock = threading.Lock()
+        self.latencies = []
+        self.received = 0
+        self.received_bytes = 0
+        self.node.on_message(self.on_message)
+
+    def on_message(self, message_data, address):
+        # Текст сообщения стенда: "<время отправки в нс>:<заполнение>"
+        text = message_data.get('text', '')
+        sent_ns, _, _ = text.partition(':')
+        now = time.time_ns()
+        with self.lock:
+            self.received += 1
+            self.received_bytes += len(text)
+            if sent_ns.isdigit():
+                self.latencies.append((now - int(sent_ns)) / 1e6)
+
+    def load(self, rate, size, duration):
+        """Отправка сообщений с частотой rate в течение duration секунд"""
+        padding = 'x' * max(0, size - 20)
+        interval = 1.0 / rate
+        started = time.monotonic()
+        next_at = started
+        sent = 0
+        while True:
+            now = time.monotonic()
+            if now - started >= duration:
+                break
+            if now < next_at:
+                time.sleep(next_at - now)
+            self.node.send(f"{time.time_ns()}:{padding}")
+            sent += 1
+            # Расписание от начала, а не от предыдущей отправки: без накопления дрейфа
+            next_at = started + sent * interval
+        return {"sent": sent, "elapsed": time.monotonic() - started}
+
+    def stats(self):
+        rss, rss_peak = read_rss()
+        with self.lock:
+            latencies, self.latencies = self.latencies, []
+            received, received_bytes = self.received, self.received_bytes
+            self.received = self.received_bytes = 0
+        return {
+            "port": self.node.config['port'],
+            "received": received,
+            "received_bytes": received_bytes,
+            "latencies_ms": latencies,
+            "cpu_seconds": cpu_seconds(),
+            "rss_kb": rss,
+            "rss_peak_kb": rss_peak,
+            "metrics": self.node.metrics_snapshot()["counters"]
+        }
+
+
+def worker(config, conn):
+    """Процесс-исполнитель: один узел, команды стенда через pipe"""
+    bench = BenchNode(config)
+    conn.send({"started": bench.started, "port": bench.node.config['port']})
+    while True:
+        command, *args = conn.recv()
+        if command == 'peers':
+            conn.send(len(bench.node.peers()))
+        elif command == 'seed':
+            capabilities = {'codecs': bench.node.config['codecs'], 'features': args[1]}
+            own = ('127.0.0.1', bench.node.config['port'])
+            for addr in args[0]:
+                if tuple(addr) != own:
+                    bench.node.peer_table.touch(tuple(addr), protocol=1, capabilities=capabilities)
+            conn.send(True)
+        elif command == 'load':
+            conn.send(bench.load(*args))
+        elif command == 'stats':
+            conn.send(bench.stats())
+        elif command == 'stop':
+            bench.node.stop()
+            conn.send(True)
+            return
+
+
+class Cluster:
+    """Группа процессов-узлов стенда"""
+
+    def __init__(self, args):
+        self.args = args
+        self.nodes = []
+        context = multiprocessing.get_context('spawn')
+        for i in range(args.nodes):
+            config = {
+                "host": "127.0.0.1",
+                "port": args.base_port + i,
+                "discovery_port": args.discovery_port,
+                "discovery_enabled": args.discovery,
+                "server_mode": args.server_mode,
+                "dissemination": args.dissemination,
+                "batching": args.batching,
+                "log_sample_every": args.log_sample_every
+            }
+            parent, child = context.Pipe()
+            process = context.Process(target=worker, args=(config, child), daemon=True)
+            process.start()
+            self.nodes.append((process, parent))
+        self.ports = []
+        for process, conn in self.nodes:
+            reply = conn.recv()
+            if not reply["started"]:
+                raise RuntimeError("узел не запустился")
+            self.ports.append(reply["port"])
+
+    def call(self, command, *args, nodes=None):
+        """Команда выбранным узлам (по умолчанию всем) и сбор ответов"""
+        targets = self.nodes if nodes is None else [self.nodes[i] for i in nodes]
+        for _, conn in targets:
+            conn.send((command, *args))
+        return [conn.recv() for _, conn in targets]
+
+    def stop(self):
+        try:
+            self.call('stop')
+        finally:
+            for process, _ in self.nodes:
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+
+
+def measure_convergence(cluster, timeout):
+    """Время, за которое каждый узел обнаружит все остальные (None - не сошлось)"""
+    started = time.monotonic()
+    expected = len(cluster.nodes) - 1
+    while time.monotonic() - started < timeout:
+        if min(cluster.call('peers')) >= expected:
+            return time.monotonic() - started
+        time.sleep(0.05)
+    return None
+
+
+def run(args):
+    cluster = Cluster(args)
+    try:
+        convergence = measure_convergence(cluster, args.discovery_timeout) if args.discovery else None
+        peers_found = cluster.call('peers')
+
+        # Нагрузочную часть проводим на полной таблице узлов независимо от discovery
+        features = ["batch", "zlib", "lzma"] if args.batching else []
+        cluster.call('seed', [("127.0.0.1", port) for port in cluster.ports], features)
+
+        before = cluster.call('stats')
+        senders = list(range(min(args.senders, args.nodes)))
+        load_started = time.monotonic()
+        sent = cluster.call('load', args.rate, args.size, args.duration, nodes=senders)
+        time.sleep(args.drain)
+        after = cluster.call('stats')
+        elapsed = time.monotonic() - load_started
+    finally:
+        cluster.stop()
+
+    latencies = sorted(l for stats in after for l in stats["latencies_ms"])
+    total_sent = sum(r["sent"] for r in sent)
+    send_elapsed = max(r["elapsed"] for r in sent)
+    total_received = sum(stats["received"] for stats in after)
+    expected = total_sent * (args.nodes - 1)
+
+    nodes = []
+    for b, a in zip(before, after):
+        nodes.append({
+            "port": a["port"],
+            "received": a["received"],
+            "cpu_seconds": a["cpu_seconds"] - b["cpu_seconds"],
+            "cpu_percent": (a["cpu_seconds"] - b["cpu_seconds"]) / elapsed * 100,
+            "rss_kb": a["rss_kb"],
+            "rss_peak_kb": a["rss_peak_kb"],
+            "counters": a["metrics"]
+        })
+
+    return {
+        "nodes": args.nodes,
+        "senders": len(senders),
+        "target_rate_per_sender": args.rate,
+        "size": args.size,
+        "duration": args.duration,
+        "server_mode": args.server_mode,
+        "dissemination": args.dissemination,
+        "batching": args.batching,
+        "discovery_convergence_s": convergence,
+        "peers_found": peers_found,
+        "sent": total_sent,
+        "send_rate": total_sent / send_elapsed if send_elapsed else None,
+        "received": total_received,
+        "delivery_ratio": total_received / expected if expected else None,
+        "receive_throughput": total_received / send_elapsed if send_elapsed else None,
+        "latency_p50_ms": percentile(latencies, 50),
+        "latency_p99_ms": percentile(latencies, 99),
+        "latency_max_ms": latencies[-1] if latencies else None,
+        "cpu_seconds_total": sum(n["cpu_seconds"] for n in nodes),
+        "rss_peak_kb_max": max((n["rss_peak_kb"] or 0) for n in nodes),
+        "per_node": nodes
+    }
+
+
+def environment():
+    """Версии и коммит - чтобы результаты разных прогонов можно было сопоставить"""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True,
+                                text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "commit": commit,
+        "timestamp": time.time()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный стенд сетевого мессенджера")
+    parser.add_argument('--nodes', type=int, default=5)
+    parser.add_argument('--senders', type=int, default=1, help="сколько узлов генерируют нагрузку")
+    parser.add_argument('--rate', type=float, default=200.0, help="сообщений в секунду на отправителя")
+    parser.add_argument('--size', type=int, default=128, help="размер текста сообщения, байт")
+    parser.add_argument('--duration', type=float, default=5.0, help="длительность нагрузки, сек")
+    parser.add_argument('--drain', type=float, default=2.0, help="ожидание доставки после нагрузки, сек")
+    parser.add_argument('--server-mode', default='asyncio', choices=['threads', 'asyncio'])
+    parser.add_argument('--dissemination', default='mesh', choices=['mesh', 'gossip'])
+    parser.add_argument('--batching', action='store_true')
+    parser.add_argument('--discovery', action='store_true', help="измерять схождение UDP discovery")
+    parser.add_argument('--discovery-timeout', type=float, default=30.0)
+    parser.add_argument('--discovery-port', type=int, default=18889)
+    parser.add_argument('--base-port', type=int, default=22000)
+    parser.add_argument('--log-sample-every', type=int, default=1)
+    parser.add_argument('--json', help="файл для результатов в формате JSON")
+    args = parser.parse_args()
+
+    result = run(args)
+
+    print(f"узлов: {result['nodes']}, отправителей: {result['senders']}, "
+          f"режим: {result['server_mode']}/{result['dissemination']}"
+          f"{', пакеты' if result['batching'] else ''}")
+    if args.discovery:
+        convergence = result['discovery_convergence_s']
+        print(f"схождение discovery: "
+              f"{f'{convergence:.2f} с' if convergence is not None else 'не сошлось'} "
+              f"(найдено узлов: {result['peers_found']})")
+    print(f"отправлено: {result['sent']} ({result['send_rate']:.0f}/с), "
+          f"получено: {result['received']} ({result['receive_throughput']:.0f}/с), "
+          f"доставка: {result['delivery_ratio']:.1%}")
+    if result['latency_p50_ms'] is not None:
+        print(f"задержка p50: {result['latency_p50_ms']:.2f} мс, p99: {result['latency_p99_ms']:.2f} мс, "
+              f"макс: {result['latency_max_ms']:.2f} мс")
+    print(f"CPU: {result['cpu_seconds_total']:.2f} с на все узлы, пиковый RSS: {result['rss_peak_kb_max']} КБ")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump({"environment": environment(), "args": vars(args), "result": result},
+                      f, indent=2, ensure_ascii=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+"""Стоимость TLS: рукопожатия (полные и с возобновлением) и поток сообщений
+
+Использует тестовые сертификаты из tests/certs (CA кластера, узлы node-a,
+node-b и посторонний intruder), запускает узлы NetworkMessenger на loopback
+и измеряет:
+
+  - время полного рукопожатия TLS и рукопожатия с возобновлением сессии;
+  - пропускную способность и процессорное время потока сообщений через
+    постоянное соединение без TLS и с TLS;
+  - что узел с сертификатом не от CA кластера не может подключиться.
+
+Пример:
+    python benchmarks/tls_bench.py --handshakes 200 --messages 20000 --json tls.json
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import socket
+import ssl
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+CERTS = os.path.join(ROOT, 'tests', 'certs')
+
+from network_messenger import NetworkMessenger, OutgoingMessage
+
+
+def percentile(values, p):
+    """Перцентиль по отсортированному списку"""
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, int(round(p / 100 * (len(values) - 1)))))
+    return values[k]
+
+
+def certificate(name):
+    return os.path.join(CERTS, f'{name}.pem'), os.path.join(CERTS, f'{name}.key')
+
+
+def client_context(cert, key, ca):
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.load_cert_chain(cert, key)
+    context.load_verify_locations(ca)
+    context.check_hostname = False
+    return context
+
+
+def start_node(port, mode, tls=None):
+    config = {
+        "host": "127.0.0.1",
+        "port": port,
+        "server_mode": mode,
+        "discovery_enabled": False,
+        "local_registry": False,
+        "log_sample_every": 1000
+    }
+    if tls is not None:
+        config.update(tls)
+    config_file = f"node_{port}.json"
+    with open(config_file, 'w', encoding='utf-8') as f:
+        json.dump(config, f)
+    with contextlib.redirect_stdout(io.StringIO()):
+        node = NetworkMessenger(config_file)
+        node.console_output = False
+        if not node.start():
+            raise RuntimeError(f"не удалось запустить узел на порту {port}")
+    return node
+
+
+def read_ticket(sock):
+    """Прием билетов сессии TLS 1.3, которые сервер шлет после рукопожатия"""
+    sock.settimeout(0.05)
+    try:
+        sock.recv(1)
+    except (ssl.SSLWantReadError, socket.timeout):
+        pass
+
+
+def measure_handshakes(addr, context, count):
+    """Время полного рукопожатия и рукопожатия с возобновлением сессии, мс"""
+    full, resumed_times = [], []
+    session = None
+    resumed = 0
+    version = None
+    for i in range(count * 2):
+        reuse = i % 2 == 1 and session is not None
+        sock = socket.create_connection(addr)
+        started = time.perf_counter()
+        tls_sock = context.wrap_socket(sock, session=session if reuse else None)
+        elapsed = (time.perf_counter() - started) * 1000
+        if reuse:
+            resumed_times.append(elapsed)
+            resumed += tls_sock.session_reused
+        else:
+            full.append(elapsed)
+            read_ticket(tls_sock)
+            session = tls_sock.session
+            version = tls_sock.version()
+        tls_sock.close()
+    return {
+        "full_p50_ms": percentile(full, 50),
+        "full_p99_ms": percentile(full, 99),
+        "resumed_p50_ms": percentile(resumed_times, 50),
+        "resumed_p99_ms": percentile(resumed_times, 99),
+        "resumed_ratio": resumed / len(resumed_times) if resumed_times else None,
+        "tls_version": version
+    }
+
+
+def measure_stream(sender, receiver, messages, size, timeout):
+    """Поток сообщений через постоянное соединение пула: сообщений/с и CPU на сообщение"""
+    addr = ('127.0.0.1', receiver.config['port'])
+    received = threading.Semaphore(0)
+    receiver.on_message(lambda message_data, address: received.release())
+    sender.peer_table.touch(addr, protocol=1, capabilities={'codecs': sender.config['codecs']})
+    padding = 'x' * size
+    frames = [OutgoingMessage({"type": "message", "text": padding, "sender": sender.node_address(),
+                               "message_id": f"bench-{i}"}).frame(sender.codec_for(addr))
+              for i in range(messages)]
+
+    # Первое сообщение устанавливает соединение (и рукопожатие) вне замера
+    sender.pool.send(addr, frames[0])
+    received.acquire(timeout=timeout)
+
+    cpu_started = time.process_time()
+    started = time.perf_counter()
+    for frame in frames[1:]:
+        sender.pool.send(addr, frame)
+    deadline = time.monotonic() + timeout
+    got = 0
+    while got < messages - 1 and received.acquire(timeout=max(0.0, deadline - time.monotonic())):
+        got += 1
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu_started
+    return {
+        "messages": got,
+        "messages_per_sec": got / elapsed if elapsed else None,
+        "cpu_us_per_message": cpu / got * 1e6 if got else None,
+        "bytes": sum(len(frame) for frame in frames)
+    }
+
+
+def check_intruder(addr, cert, key, ca):
+    """Подключение с сертификатом не от CA кластера должно быть отклонено"""
+    context = client_context(cert, key, ca)
+    try:
+        sock = context.wrap_socket(socket.create_connection(addr, timeout=2.0))
+        # В TLS 1.3 отказ сервера в проверке сертификата клиента приходит при чтении
+        sock.settimeout(1.0)
+        return sock.recv(1) != b''
+    except socket.timeout:
+        return True  # соединение принято и ждет данных
+    except (ssl.SSLError, OSError):
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Накладные расходы TLS")
+    parser.add_argument('--handshakes', type=int, default=100, help="рукопожатий каждого вида")
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--size', type=int, default=128, help="размер текста сообщения, байт")
+    parser.add_argument('--server-mode', default='asyncio', choices=['threads', 'asyncio'])
+    parser.add_argument('--timeout', type=float, default=30.0)
+    parser.add_argument('--base-port', type=int, default=25000)
+    parser.add_argument('--json', help="файл для результатов в формате JSON")
+    args = parser.parse_args()
+
+    if args.json:
+        args.json = os.path.abspath(args.json)
+    workdir = tempfile.mkdtemp(prefix='tls_bench_')
+    os.chdir(workdir)
+    ca = os.path.join(CERTS, 'ca.pem')
+
+    def tls_config(name):
+        cert, key = certificate(name)
+        return {"tls": True, "tls_cert": cert, "tls_key": key, "tls_ca": ca}
+
+    port = args.base_port
+    results = {"server_mode": args.server_mode, "size": args.size}
+
+    # Без TLS
+    nodes = [start_node(port, args.server_mode), start_node(port + 1, args.server_mode)]
+    try:
+        results["plaintext"] = measure_stream(nodes[0], nodes[1], args.messages, args.size, args.timeout)
+    finally:
+        for node in nodes:
+            node.stop()
+
+    # С TLS: те же узлы с сертификатами кластера
+    nodes = [start_node(port + 2, args.server_mode, tls_config('node-a')),
+             start_node(port + 3, args.server_mode, tls_config('node-b'))]
+    try:
+        addr = ('127.0.0.1', port + 3)
+        results["tls"] = measure_stream(nodes[0], nodes[1], args.messages, args.size, args.timeout)
+        results["handshakes"] = measure_handshakes(addr, client_context(*certificate('node-a'), ca),
+                                                   args.handshakes)
+        results["intruder_accepted"] = check_intruder(addr, *certificate('intruder'), ca)
+    finally:
+        for node in nodes:
+            node.stop()
+
+    plain, tls, handshakes = results["plaintext"], results["tls"], results["handshakes"]
+    print(f"режим сервера: {args.server_mode}, сообщение: {args.size} байт")
+    print(f"{'':<10} {'сообщ/с':>10} {'CPU мкс/сообщ':>14}")
+    for name, stream in (("без TLS", plain), ("TLS", tls)):
+        print(f"{name:<10} {stream['messages_per_sec'] or 0:>10.0f} {stream['cpu_us_per_message'] or 0:>14.1f}")
+    if plain["messages_per_sec"] and tls["messages_per_sec"]:
+        print(f"потеря пропускной способности: {1 - tls['messages_per_sec'] / plain['messages_per_sec']:.1%}")
+    print(f"рукопожатие {handshakes['tls_version']}: полное p50 {handshakes['full_p50_ms']:.2f} мс, "
+          f"возобновленное p50 {handshakes['resumed_p50_ms']:.2f} мс "
+          f"(возобновлено {handshakes['resumed_ratio']:.0%})")
+    print(f"узел с чужим сертификатом: {'ПРИНЯТ' if results['intruder_accepted'] else 'отклонен'}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    print(f"Конфигурации и логи узлов: {workdir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,50 +1,2767 @@
 import socket
 import threading
+import asyncio
 import json
 import time
 import sys
 import os
+import stat
 import logging
+import logging.handlers
+import atexit
+import signal
+import struct
+import select
+import zlib
+import lzma
+import mmap
+import bisect
+import itertools
+import uuid
+import random
+import tempfile
+import heapq
+import concurrent.futures
+import multiprocessing
+import queue
+import ssl
+import hashlib
+import http.server
+import http.client
+from collections import OrderedDict, deque
 from datetime import datetime
 
+# Версия протокола кадров и формат заголовка: магия, версия, флаги, длина
+PROTOCOL_VERSION = 1
+FRAME_MAGIC = b'\x00M'
+FRAME_HEADER = struct.Struct('!2sBBI')
+
+
+# Младшие биты флагов кадра - идентификатор кодека полезной нагрузки
+FRAME_CODEC_MASK = 0x0F
+# Сжатие полезной нагрузки и пакет из нескольких сообщений
+FLAG_ZLIB = 0x10
+FLAG_LZMA = 0x20
+FRAME_COMPRESSION_MASK = FLAG_ZLIB | FLAG_LZMA
+FLAG_BATCH = 0x40
+
+# Возможности протокола, объявляемые в discovery
+FEATURES = ["batch", "zlib", "lzma"]
+
+# Ограничение размера discovery-ответа со списком узлов (одна UDP датаграмма)
+DISCOVERY_RESPONSE_MAX_BYTES = 60000
+# Ответ на probe не больше запроса в N раз: адрес отправителя UDP не проверен,
+# и ответ не должен усиливать отраженный трафик. Probe дополняется до
+# PROBE_MIN_BYTES, чтобы новый узел получал достаточно длинный список
+PROBE_REPLY_AMPLIFICATION = 3
+PROBE_MIN_BYTES = 1200
+
+
+class FrameError(Exception):
+    """Нарушение формата кадра во входящем потоке"""
+
+
+def encode_frame(payload, flags=0):
+    """Упаковка полезной нагрузки в кадр с заголовком длины"""
+    return FRAME_HEADER.pack(FRAME_MAGIC, PROTOCOL_VERSION, flags, len(payload)) + payload
+
+
+def write_varint(buf, value):
+    """Запись беззнакового целого в формате varint (LEB128)"""
+    while value >= 0x80:
+        buf.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buf.append(value)
+
+
+def read_varint(data, pos):
+    """Чтение varint, возвращает (значение, новая позиция)"""
+    result = 0
+    shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, pos
+        shift += 7
+        if shift > 63:
+            raise ValueError("слишком длинный varint")
+
+
+class JsonCodec:
+    """JSON представление сообщения (понимают все узлы, в том числе старые)"""
+    name = 'json'
+    codec_id = 0
+    
+    def encode(self, message_data):
+        return json.dumps(message_data, ensure_ascii=False).encode('utf-8')
+    
+    def decode(self, payload):
+        message = json.loads(str(payload, 'utf-8'))
+        if not isinstance(message, dict):
+            raise ValueError("сообщение должно быть JSON объектом")
+        return message
+
+
+def field_tags(tags):
+    """Имя поля -> [(тег, вид)]: одно поле может кодироваться несколькими тегами"""
+    fields = {}
+    for tag, (name, kind) in tags.items():
+        if name is not None:
+            fields.setdefault(name, []).append((tag, kind))
+    return fields
+
+
+class BinaryCodec:
+    """Компактное двоичное представление сообщения
+    
+    Заголовок struct: код типа сообщения и время отправителя в наносекундах
+    от эпохи. Далее поля "тег + значение": строки и числа с длиной/значением
+    в varint. Поля, которых нет в таблице, передаются одним JSON блоком.
+    После декодирования timestamp - число секунд от эпохи, а не ISO строка.
+    """
+    name = 'bin1'
+    codec_id = 1
+    
+    HEADER = struct.Struct('!BQ')
+    # Коды типов только дописываются в конец - это часть формата
+    TYPES = ['message', 'discovery', 'ack']
+    TYPE_CODES = {name: code for code, name in enumerate(TYPES, 1)}
+    
+    STR, UINT, JSON = 'str', 'uint', 'json'
+    TAGS = {
+        1: ('text', STR),
+        2: ('sender', STR),
+        3: ('message_id', STR),
+        4: ('message_id', UINT),
+        5: ('ttl', UINT),
+        6: ('via', STR),
+        7: ('type', STR),
+        15: (None, JSON),
+    }
+    FIELDS = field_tags(TAGS)
+    EXTRA_TAG = 15
+    
+    def encode(self, message_data):
+        buf = bytearray(self.HEADER.size)
+        type_code = 0
+        timestamp_ns = 0
+        extra = {}
+        
+        for key, value in message_data.items():
+            if key == 'type' and value in self.TYPE_CODES:
+                type_code = self.TYPE_CODES[value]
+                continue
+            if key == 'timestamp':
+                timestamp_ns = self._timestamp_ns(value)
+                if timestamp_ns is None:
+                    timestamp_ns = 0
+                    extra[key] = value
+                continue
+            for tag, kind in self.FIELDS.get(key, ()):
+                if kind == self.STR and isinstance(value, str):
+                    encoded = value.encode('utf-8')
+                    buf.append(tag)
+                    write_varint(buf, len(encoded))
+                    buf += encoded
+                    break
+                if kind == self.UINT and type(value) is int and value >= 0:
+                    buf.append(tag)
+                    write_varint(buf, value)
+                    break
+            else:
+                extra[key] = value
+        
+        if extra:
+            encoded = json.dumps(extra, ensure_ascii=False).encode('utf-8')
+            buf.append(self.EXTRA_TAG)
+            write_varint(buf, len(encoded))
+            buf += encoded
+        
+        self.HEADER.pack_into(buf, 0, type_code, timestamp_ns)
+        return bytes(buf)
+    
+    @staticmethod
+    def _timestamp_ns(value):
+        if isinstance(value, str):
+            try:
+                return int(datetime.fromisoformat(value).timestamp() * 1_000_000_000)
+            except ValueError:
+                return None
+        if isinstance(value, (int, float)) and not isinstance(value, bool) and value > 0:
+            return int(value * 1_000_000_000)
+        return None
+    
+    def decode(self, payload):
+        type_code, timestamp_ns = self.HEADER.unpack_from(payload, 0)
+        message = {}
+        if type_code:
+            if type_code > len(self.TYPES):
+                raise ValueError(f"неизвестный код типа {type_code}")
+            message['type'] = self.TYPES[type_code - 1]
+        if timestamp_ns:
+            message['timestamp'] = timestamp_ns / 1_000_000_000
+        
+        pos = self.HEADER.size
+        end = len(payload)
+        while pos < end:
+            tag = payload[pos]
+            field = self.TAGS.get(tag)
+            if field is None:
+                raise ValueError(f"неизвестный тег поля {tag}")
+            name, kind = field
+            value, pos = read_varint(payload, pos + 1)
+            if kind != self.UINT:
+                if pos + value > end:
+                    raise ValueError("поле выходит за границу сообщения")
+                raw = payload[pos:pos + value]
+                pos += value
+                if kind == self.STR:
+                    value = str(raw, 'utf-8')
+                else:
+                    extra = json.loads(str(raw, 'utf-8'))
+                    if not isinstance(extra, dict):
+                        raise ValueError("блок дополнительных полей должен быть JSON объектом")
+                    message.update(extra)
+                    continue
+            message[name] = value
+        return message
+
+
+JSON_CODEC = JsonCodec()
+CODECS = {codec.name: codec for codec in (JSON_CODEC, BinaryCodec())}
+CODECS_BY_ID = {codec.codec_id: codec for codec in CODECS.values()}
+
+
+class OutgoingMessage:
+    """Сообщение для рассылки с кэшем закодированных кадров по кодекам"""
+    
+    def __init__(self, data):
+        self.data = data
+        self.encoded = {}
+    
+    def payload(self, codec):
+        """Сообщение, закодированное указанным кодеком (без заголовка кадра)"""
+        key = ('payload', codec.name)
+        payload = self.encoded.get(key)
+        if payload is None:
+            payload = self.encoded[key] = codec.encode(self.data)
+        return payload
+    
+    def frame(self, codec):
+        """Кадр протокола с сообщением в указанном кодеке"""
+        frame = self.encoded.get(codec.name)
+        if frame is None:
+            frame = encode_frame(self.payload(codec), codec.codec_id)
+            self.encoded[codec.name] = frame
+        return frame
+    
+    def legacy(self):
+        """Сообщение старого формата (JSON без кадра)"""
+        data = self.encoded.get(None)
+        if data is None:
+            data = self.encoded[None] = JSON_CODEC.encode(self.data)
+        return data
+
+
+class FrameDecoder:
+    """Потоковая сборка кадров в предвыделенном буфере без лишних копий
+    
+    Данные читаются через recv_into прямо в буфер (get_buffer/buffer_updated),
+    готовые кадры отдаются как memoryview на этот же буфер и действительны
+    только до следующего вызова get_buffer. Поток, начинающийся не с магии
+    кадра, считается старым форматом: одно JSON сообщение до закрытия соединения.
+    """
+    
+    def __init__(self, buffer_size=65536, max_frame_size=16 * 1024 * 1024):
+        self.buffer = bytearray(buffer_size)
+        self.view = memoryview(self.buffer)
+        self.max_frame_size = max_frame_size
+        self.start = 0       # начало необработанных данных
+        self.end = 0         # конец записанных данных
+        self.legacy = None   # None - формат еще не известен
+    
+    def get_buffer(self, sizehint=-1):
+        """Свободная часть буфера для чтения из сокета"""
+        if self.start == self.end:
+            self.start = self.end = 0
+        if self.end == len(self.buffer):
+            pending = self.end - self.start
+            if self.start > 0:
+                # Сдвигаем недочитанный хвост в начало буфера
+                # (при перекрытии областей копируем через временный bytes)
+                tail = self.view[self.start:self.end]
+                self.buffer[:pending] = tail if self.start >= pending else bytes(tail)
+                self.start, self.end = 0, pending
+            else:
+                if len(self.buffer) >= self.max_frame_size + FRAME_HEADER.size:
+                    raise FrameError("превышен максимальный размер сообщения")
+                self._grow(len(self.buffer) * 2)
+        return self.view[self.end:]
+    
+    def _grow(self, size):
+        size = min(size, self.max_frame_size + FRAME_HEADER.size)
+        new_buffer = bytearray(size)
+        new_buffer[:self.end - self.start] = self.view[self.start:self.end]
+        self.end -= self.start
+        self.start = 0
+        self.view.release()
+        self.buffer = new_buffer
+        self.view = memoryview(self.buffer)
+    
+    def buffer_updated(self, nbytes):
+        """Учет прочитанных байт, возвращает список готовых кадров (flags, payload)"""
+        self.end += nbytes
+        frames = []
+        
+        if self.legacy is None and self.end > self.start:
+            self.legacy = self.buffer[self.start] != FRAME_MAGIC[0]
+        if self.legacy:
+            # Старый формат: копим до закрытия соединения
+            return frames
+        
+        while self.end - self.start >= FRAME_HEADER.size:
+            magic, version, flags, length = FRAME_HEADER.unpack_from(self.buffer, self.start)
+            if magic != FRAME_MAGIC:
+                raise FrameError("неверная сигнатура кадра")
+            if version != PROTOCOL_VERSION:
+                raise FrameError(f"неподдерживаемая версия протокола {version}")
+            if length > self.max_frame_size:
+                raise FrameError(f"кадр слишком большой: {length} байт")
+            
+            frame_end = self.start + FRAME_HEADER.size + length
+            if frame_end > self.end:
+                # Кадр не помещается - заранее расширяем буфер
+                if FRAME_HEADER.size + length > len(self.buffer):
+                    self._grow(FRAME_HEADER.size + length)
+                break
+            
+            frames.append((flags, self.view[self.start + FRAME_HEADER.size:frame_end]))
+            self.start = frame_end
+        
+        return frames
+    
+    def finish(self):
+        """Завершение потока: возвращает накопленное сообщение старого формата"""
+        if self.legacy and self.end > self.start:
+            return self.view[self.start:self.end]
+        return None
+
+def encode_batch(codec, payloads, compression=None, compress_min_bytes=1024):
+    """Кадр-пакет: сообщения с varint длинами, при выгоде - сжатый"""
+    buf = bytearray()
+    for payload in payloads:
+        write_varint(buf, len(payload))
+        buf += payload
+    
+    flags = codec.codec_id | FLAG_BATCH
+    if compression and len(buf) >= compress_min_bytes:
+        if compression == 'lzma':
+            compressed = lzma.compress(buf, preset=1)
+            compressed_flag = FLAG_LZMA
+        else:
+            compressed = zlib.compress(buf, 1)
+            compressed_flag = FLAG_ZLIB
+        # Сжимаем только если это уменьшает кадр
+        if len(compressed) < len(buf):
+            return encode_frame(compressed, flags | compressed_flag)
+    return encode_frame(bytes(buf), flags)
+
+
+def decompress_payload(flags, payload, max_size):
+    """Распаковка сжатого кадра с ограничением размера результата"""
+    compression = flags & FRAME_COMPRESSION_MASK
+    if compression == FLAG_ZLIB:
+        decompressor = zlib.decompressobj()
+        data = decompressor.decompress(payload, max_size)
+        if decompressor.unconsumed_tail or not decompressor.eof:
+            raise ValueError("распакованный кадр превышает допустимый размер или поврежден")
+        return data
+    if compression == FLAG_LZMA:
+        decompressor = lzma.LZMADecompressor()
+        data = decompressor.decompress(payload, max_size)
+        if not decompressor.eof:
+            raise ValueError("распакованный кадр превышает допустимый размер или поврежден")
+        return data
+    raise ValueError(f"неизвестный способ сжатия {compression:#x}")
+
+
+def iter_batch(payload):
+    """Разбор пакета на отдельные сообщения (memoryview без копирования)"""
+    view = memoryview(payload)
+    pos = 0
+    end = len(view)
+    while pos < end:
+        length, pos = read_varint(view, pos)
+        if pos + length > end:
+            raise ValueError("сообщение выходит за границу пакета")
+        yield view[pos:pos + length]
+        pos += length
+
+
+class BatchSender:
+    """Очереди отправки по узлам с объединением сообщений в пакеты
+    
+    Сообщения копятся в очереди узла, пока не наберется batch_max_messages
+    или batch_max_bytes, либо пока не пройдет batch_max_delay с момента
+    первого сообщения в очереди. Пока пакет узлу отправляется, новые
+    сообщения копятся в следующий пакет, поэтому под нагрузкой пакеты
+    укрупняются сами, а порядок сообщений для узла сохраняется. Смена
+    кодека узла не отправляет очередь досрочно: она делится на пакеты
+    по кодеку при отправке.
+    """
+    
+    def __init__(self, send_func, executor, max_messages=64, max_bytes=65536, max_delay=0.005,
+                 compression_for=None, compress_min_bytes=1024, logger=None):
+        self.send_func = send_func          # send_func(peer, frame) - отправка кадра
+        self.executor = executor
+        self.max_messages = max_messages
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.compression_for = compression_for or (lambda peer: None)
+        self.compress_min_bytes = compress_min_bytes
+        self.logger = logger or logging.getLogger(__name__)
+        self.queues = {}       # peer -> [список (codec, сообщение), байт, время первого]
+        self.in_flight = set()
+        self.cond = threading.Condition()
+        self.running = True
+        self.flusher = threading.Thread(target=self._run, daemon=True)
+        self.flusher.start()
+    
+    def enqueue(self, peer, codec, payload):
+        """Постановка закодированного сообщения в очередь узла"""
+        with self.cond:
+            queue = self.queues.get(peer)
+            if queue is None:
+                queue = self.queues[peer] = [[], 0, time.monotonic()]
+            queue[0].append((codec, payload))
+            queue[1] += len(payload)
+            # Будим поток отправки: новая очередь - новый срок, полная - пора отправлять
+            if len(queue[0]) == 1 or len(queue[0]) >= self.max_messages or queue[1] >= self.max_bytes:
+                self.cond.notify()
+    
+    def _is_ready(self, queue, now):
+        return (len(queue[0]) >= self.max_messages or queue[1] >= self.max_bytes
+                or now - queue[2] >= self.max_delay)
+    
+    def _run(self):
+        while self.running:
+            with self.cond:
+                now = time.monotonic()
+                ready = [peer for peer, queue in self.queues.items()
+                         if peer not in self.in_flight and self._is_ready(queue, now)]
+                for peer in ready:
+                    self._submit(peer, self.queues.pop(peer))
+                
+                # Ждем ближайшего срока отправки или сигнала о заполнении очереди
+                waiting = [queue[2] for peer, queue in self.queues.items() if peer not in self.in_flight]
+                timeout = max(0.0, min(waiting) + self.max_delay - now) if waiting else None
+                self.cond.wait(timeout)
+    
+    def _submit(self, peer, queue):
+        self.in_flight.add(peer)
+        try:
+            self.executor.submit(self._send, peer, queue)
+        except RuntimeError:
+            # Пул отправки остановлен
+            self.in_flight.discard(peer)
+    
+    def _send(self, peer, queue):
+        payloads = queue[0]
+        try:
+            compression = self.compression_for(peer)
+            for codec, chunk in self._chunks(payloads):
+                frame = encode_batch(codec, chunk, compression, self.compress_min_bytes)
+                self.send_func(peer, frame, len(chunk))
+        except Exception as e:
+            self.logger.error(f"Ошибка отправки пакета из {len(payloads)} сообщений к {peer}: {e}")
+        finally:
+            with self.cond:
+                self.in_flight.discard(peer)
+                self.cond.notify()
+    
+    def _chunks(self, payloads):
+        """Деление накопленной за время отправки очереди на пакеты допустимого размера и одного кодека"""
+        chunk = []
+        chunk_codec = None
+        size = 0
+        for codec, payload in payloads:
+            if chunk and (codec is not chunk_codec or len(chunk) >= self.max_messages
+                          or size + len(payload) > self.max_bytes):
+                yield chunk_codec, chunk
+                chunk = []
+                size = 0
+            chunk_codec = codec
+            chunk.append(payload)
+            size += len(payload)
+        if chunk:
+            yield chunk_codec, chunk
+    
+    def pending(self):
+        """Число сообщений, ожидающих отправки"""
+        with self.cond:
+            return sum(len(queue[0]) for queue in self.queues.values())
+    
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+
+class PeerBackoffError(ConnectionError):
+    """Узел временно исключен из подключений после серии ошибок"""
+
+
+class PeerConnection:
+    """Постоянное исходящее соединение к узлу"""
+    
+    def __init__(self, sock):
+        self.sock = sock
+        self.lock = threading.Lock()
+        self.last_used = time.monotonic()
+    
+    def is_alive(self, wait=0):
+        """Проверка, что удаленная сторона не закрыла соединение (wait - ожидание данных, сек)"""
+        # Соединение занято отправкой - считаем живым: чтение TLS и смена
+        # режима блокировки во время sendall в другом потоке небезопасны
+        if not self.lock.acquire(blocking=False):
+            return True
+        try:
+            return self.probe(wait)
+        finally:
+            self.lock.release()
+    
+    def probe(self, wait=0):
+        """Проверка соединения; вызывается под self.lock"""
+        # Получатель ничего не пишет в исходящие соединения, поэтому
+        # готовность к чтению означает EOF или сброс соединения
+        try:
+            readable, _, _ = select.select([self.sock], [], [], wait)
+        except (OSError, ValueError):
+            return False
+        if not readable:
+            return True
+        if not isinstance(self.sock, ssl.SSLSocket):
+            return False
+        # TLS 1.3: после рукопожатия сервер присылает билеты сессии - читаем их
+        try:
+            self.sock.setblocking(False)
+            self.sock.recv(1)
+        except ssl.SSLWantReadError:
+            return True  # были только служебные записи TLS
+        except OSError:
+            return False
+        return False  # EOF или неожиданные данные
+    
+    def close(self):
+        try:
+            self.sock.close()
+        except:
+            pass
+
+
+class ConnectionPool:
+    """Пул постоянных TCP соединений к узлам с ключом (host, port)
+    
+    Соединения переиспользуются между сообщениями, размер пула ограничен
+    (вытесняется давно не использованное), простаивающие и сломанные
+    соединения закрываются, повторное подключение к упавшему узлу
+    откладывается с экспоненциальной задержкой.
+    """
+    
+    def __init__(self, max_size=64, idle_timeout=30.0, connect_timeout=3.0,
+                 backoff_base=0.5, backoff_max=30.0, ssl_context=None, ticket_wait=0.1, logger=None):
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.connect_timeout = connect_timeout
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.logger = logger or logging.getLogger(__name__)
+        self.connections = OrderedDict()  # addr -> PeerConnection, порядок LRU
+        self.backoff = {}                 # addr -> (число ошибок, время следующей попытки)
+        self.lock = threading.Lock()
+        self.last_idle_check = time.monotonic()
+        # TLS: сессии узлов для возобновления без полного рукопожатия
+        self.ssl_context = ssl_context
+        self.sessions = {}                # addr -> ssl.SSLSession
+        self.ticket_wait = ticket_wait    # ожидание билета сессии после первой отправки, секунд
+        self.handshakes = 0
+        self.resumed = 0
+    
+    def send(self, addr, data, timeout=None):
+        """Отправка данных узлу через постоянное соединение"""
+        conn, reused = self.acquire(addr, timeout)
+        try:
+            self._send_on(conn, data, timeout)
+        except OSError:
+            self.discard(addr, conn)
+            if not reused:
+                self.record_failure(addr)
+                raise
+            # Переиспользованное соединение могло быть закрыто на той стороне -
+            # одна попытка через новое соединение
+            conn, reused = self.acquire(addr, timeout)
+            try:
+                self._send_on(conn, data, timeout)
+            except OSError:
+                self.discard(addr, conn)
+                self.record_failure(addr)
+                raise
+        self.backoff.pop(addr, None)
+        if not reused and self.ssl_context is not None and addr not in self.sessions:
+            # Билет TLS 1.3 приходит вслед за рукопожатием - принимаем его сразу,
+            # иначе соединение, оборванное до повторного использования, не даст возобновления
+            with conn.lock:
+                conn.probe(self.ticket_wait)
+                self._save_session(addr, conn.sock)
+    
+    def _send_on(self, conn, data, timeout=None):
+        with conn.lock:
+            conn.sock.settimeout(timeout or self.connect_timeout)
+            conn.sock.sendall(data)
+            conn.last_used = time.monotonic()
+    
+    def acquire(self, addr, timeout=None):
+        """Получение соединения из пула или установка нового, возвращает (conn, reused)"""
+        self.maybe_evict_idle()
+        
+        with self.lock:
+            conn = self.connections.get(addr)
+            if conn is not None:
+                if conn.is_alive():
+                    self.connections.move_to_end(addr)
+                    if self.ssl_context is not None and addr not in self.sessions:
+                        self._save_session(addr, conn.sock)
+                    return conn, True
+                del self.connections[addr]
+                conn.close()
+            
+            failures, next_attempt = self.backoff.get(addr, (0, 0.0))
+            if time.monotonic() < next_attempt:
+                raise PeerBackoffError(f"повторное подключение через {next_attempt - time.monotonic():.1f} сек")
+        
+        # Подключаемся вне блокировки, чтобы не задерживать остальные узлы
+        try:
+            connect_timeout = min(timeout, self.connect_timeout) if timeout else self.connect_timeout
+            sock = socket.create_connection(addr, timeout=connect_timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            if self.ssl_context is not None:
+                sock = self._tls_handshake(addr, sock)
+        except OSError:
+            self.record_failure(addr)
+            raise
+        conn = PeerConnection(sock)
+        
+        evicted = []
+        with self.lock:
+            existing = self.connections.get(addr)
+            if existing is not None:
+                # Параллельный поток успел подключиться первым
+                evicted.append(conn)
+                conn = existing
+                self.connections.move_to_end(addr)
+            else:
+                self.connections[addr] = conn
+                while len(self.connections) > self.max_size:
+                    _, old = self.connections.popitem(last=False)
+                    evicted.append(old)
+        
+        for old in evicted:
+            old.close()
+        return conn, False
+    
+    def _tls_handshake(self, addr, sock):
+        """Рукопожатие TLS, по возможности с возобновлением прежней сессии узла"""
+        session = self.sessions.get(addr)
+        try:
+            # Узлы адресуются по IP: подлинность проверяется по сертификату CA кластера, а не по имени
+            tls_sock = self.ssl_context.wrap_socket(sock, server_side=False, session=session)
+        except (ssl.SSLError, ValueError) as e:
+            sock.close()
+            self.sessions.pop(addr, None)
+            raise ConnectionError(f"ошибка TLS: {e}") from e
+        except OSError:
+            sock.close()
+            raise
+        self.handshakes += 1
+        if tls_sock.session_reused:
+            self.resumed += 1
+        elif session is not None:
+            self.sessions.pop(addr, None)  # билет отвергнут - получим новый
+        self._save_session(addr, tls_sock)
+        return tls_sock
+    
+    def _save_session(self, addr, sock):
+        # В TLS 1.3 билет приходит после рукопожатия и доступен только после чтения
+        session = sock.session
+        if session is not None and session.has_ticket:
+            self.sessions[addr] = session
+    
+    def discard(self, addr, conn=None):
+        """Удаление соединения из пула (после ошибки или по запросу)"""
+        with self.lock:
+            current = self.connections.get(addr)
+            if current is not None and (conn is None or current is conn):
+                del self.connections[addr]
+        if conn is None:
+            conn = current
+        if conn is not None:
+            conn.close()
+    
+    def record_failure(self, addr):
+        """Учет ошибки подключения и расчет задержки перед следующей попыткой"""
+        with self.lock:
+            failures = self.backoff.get(addr, (0, 0.0))[0] + 1
+            delay = min(self.backoff_max, self.backoff_base * (2 ** (failures - 1)))
+            self.backoff[addr] = (failures, time.monotonic() + delay)
+        self.logger.debug(f"Узел {addr}: ошибок подряд {failures}, пауза {delay:.1f} сек")
+    
+    def maybe_evict_idle(self):
+        """Закрытие простаивающих соединений (не чаще раза в половину таймаута)"""
+        now = time.monotonic()
+        if now - self.last_idle_check < self.idle_timeout / 2:
+            return
+        self.last_idle_check = now
+        
+        with self.lock:
+            idle = [addr for addr, conn in self.connections.items()
+                    if now - conn.last_used > self.idle_timeout]
+            closed = [self.connections.pop(addr) for addr in idle]
+        for conn in closed:
+            conn.close()
+        if closed:
+            self.logger.info(f"Закрыто простаивающих соединений: {len(closed)}")
+    
+    def close_all(self):
+        """Закрытие всех соединений пула"""
+        with self.lock:
+            closed = list(self.connections.values())
+            self.connections.clear()
+        for conn in closed:
+            conn.close()
+    
+    def __len__(self):
+        return len(self.connections)
+
+
+class DeliveryResult:
+    """Результат доставки сообщения одному узлу"""
+    __slots__ = ('peer', 'status', 'latency', 'error')
+    
+    OK = 'ok'
+    REFUSED = 'refused'
+    TIMEOUT = 'timeout'
+    QUEUED = 'queued'     # поставлено в очередь пакетной отправки
+    SKIPPED = 'skipped'   # узел в паузе после ошибок подключения
+    ERROR = 'error'
+    
+    def __init__(self, peer, status, latency, error=None):
+        self.peer = peer
+        self.status = status
+        self.latency = latency
+        self.error = error
+    
+    def to_dict(self):
+        return {
+            "peer": f"{self.peer[0]}:{self.peer[1]}",
+            "status": self.status,
+            "latency_ms": round(self.latency * 1000, 3),
+            "error": self.error
+        }
+
+
+class DeliveryReport:
+    """Отчет о рассылке: результат по каждому узлу"""
+    
+    def __init__(self, message_id=None):
+        self.message_id = message_id
+        self.results = {}  # peer -> DeliveryResult
+        self.elapsed = 0.0
+    
+    def add(self, result):
+        self.results[result.peer] = result
+    
+    @property
+    def delivered(self):
+        return [peer for peer, r in self.results.items() if r.status == DeliveryResult.OK]
+    
+    @property
+    def queued(self):
+        return [peer for peer, r in self.results.items() if r.status == DeliveryResult.QUEUED]
+    
+    @property
+    def failed(self):
+        return [peer for peer, r in self.results.items()
+                if r.status not in (DeliveryResult.OK, DeliveryResult.QUEUED)]
+    
+    def counts(self):
+        """Количество результатов по статусам"""
+        counts = {}
+        for r in self.results.values():
+            counts[r.status] = counts.get(r.status, 0) + 1
+        return counts
+    
+    def to_dict(self):
+        return {
+            "message_id": self.message_id,
+            "elapsed_ms": round(self.elapsed * 1000, 3),
+            "counts": self.counts(),
+            "peers": [r.to_dict() for r in self.results.values()]
+        }
+
+
+class MessageRecord:
+    """Компактная запись сообщения журнала"""
+    __slots__ = ('seq', 'message_id', 'sender', 'text', 'timestamp', 'received_at', 'outgoing')
+    
+    def __init__(self, seq, message_id, sender, text, timestamp, received_at, outgoing=False):
+        self.seq = seq
+        self.message_id = message_id
+        self.sender = sender
+        self.text = text
+        self.timestamp = timestamp        # время отправителя, epoch секунды
+        self.received_at = received_at    # локальное время записи
+        self.outgoing = outgoing
+    
+    def render(self):
+        """Строка для отображения (формируется только по запросу)"""
+        msg_time = datetime.fromtimestamp(self.timestamp).strftime('%Y-%m-%d %H:%M:%S')
+        author = "Вы" if self.outgoing else self.sender
+        return f"[{msg_time}] {author}: {self.text}"
+
+
+class MessageStore:
+    """Журнал сообщений ограниченного размера с индексами
+    
+    Записи хранятся в кольцевом буфере фиксированной емкости: при
+    переполнении вытесняются самые старые. Индексы по message_id и
+    отправителю обновляются при вытеснении, выборка по времени получения
+    идет бинарным поиском по кольцу (записи упорядочены по received_at).
+    """
+    
+    def __init__(self, capacity=10000):
+        self.capacity = capacity
+        self.slots = [None] * capacity
+        self.next_seq = 0       # порядковый номер следующей записи
+        self.by_id = {}         # message_id -> MessageRecord
+        self.by_sender = {}     # sender -> deque порядковых номеров
+        self.lock = threading.Lock()
+    
+    def add(self, sender, text, message_id=None, timestamp=None, outgoing=False, received_at=None):
+        """Добавление записи, возвращает MessageRecord"""
+        now = received_at if received_at is not None else time.time()
+        with self.lock:
+            seq = self.next_seq
+            slot = seq % self.capacity
+            
+            old = self.slots[slot]
+            if old is not None:
+                self._unindex(old)
+            
+            record = MessageRecord(seq, message_id, sender, text,
+                                   timestamp if timestamp is not None else now, now, outgoing)
+            self.slots[slot] = record
+            self.next_seq = seq + 1
+            
+            if message_id is not None:
+                self.by_id[message_id] = record
+            self.by_sender.setdefault(sender, deque()).append(seq)
+        return record
+    
+    def _unindex(self, record):
+        if record.message_id is not None and self.by_id.get(record.message_id) is record:
+            del self.by_id[record.message_id]
+        seqs = self.by_sender.get(record.sender)
+        if seqs:
+            # Вытесняется всегда самая старая запись отправителя
+            seqs.popleft()
+            if not seqs:
+                del self.by_sender[record.sender]
+    
+    @property
+    def first_seq(self):
+        return max(0, self.next_seq - self.capacity)
+    
+    def __len__(self):
+        return self.next_seq - self.first_seq
+    
+    def _record(self, seq):
+        return self.slots[seq % self.capacity]
+    
+    def get(self, message_id):
+        """Поиск записи по message_id"""
+        return self.by_id.get(message_id)
+    
+    def recent(self, count=20):
+        """Последние записи в порядке поступления"""
+        with self.lock:
+            start = max(self.first_seq, self.next_seq - count)
+            return [self._record(seq) for seq in range(start, self.next_seq)]
+    
+    def from_sender(self, sender, limit=None):
+        """Записи отправителя (последние limit, если задано)"""
+        with self.lock:
+            seqs = self.by_sender.get(sender, ())
+            if limit is not None:
+                seqs = list(seqs)[-limit:]
+            return [self._record(seq) for seq in seqs]
+    
+    def between(self, start_time, end_time):
+        """Записи, полученные в интервале [start_time, end_time]"""
+        with self.lock:
+            lo = self._bisect(start_time)
+            hi = self._bisect(end_time, right=True)
+            return [self._record(seq) for seq in range(lo, hi)]
+    
+    def _bisect(self, moment, right=False):
+        lo, hi = self.first_seq, self.next_seq
+        while lo < hi:
+            mid = (lo + hi) // 2
+            received_at = self._record(mid).received_at
+            if received_at < moment or (right and received_at == moment):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+
+class MessageLog:
+    """Журнал сообщений на диске: сегменты только для дозаписи
+    
+    Каждая запись - строка JSON в файле сегмента <base_seq>.log. Сегмент
+    ротируется по размеру, данные сбрасываются на диск (fsync) фоновым потоком
+    раз в fsync_interval. Рядом с сегментом лежит разреженный индекс
+    <base_seq>.idx: каждая index_interval-я запись (seq, время получения,
+    смещение). Чтение идет через mmap от ближайшей точки индекса, поэтому
+    выборки по времени и по номеру записи не загружают журнал в память.
+    """
+    
+    INDEX_ENTRY = struct.Struct('<QdQ')  # seq, received_at, offset
+    
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024, fsync_interval=1.0,
+                 index_interval=64, retention_segments=0, logger=None):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self.index_interval = index_interval
+        self.retention_segments = retention_segments
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        self.segments = []   # базовые seq сегментов по возрастанию
+        self.indexes = {}    # base_seq -> список (seq, received_at, offset)
+        self.next_seq = 0
+        self.dirty = False
+        self.closed = False
+        
+        os.makedirs(directory, exist_ok=True)
+        self._load_segments()
+        self._open_active()
+        
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+    
+    def _path(self, base_seq, suffix):
+        return os.path.join(self.directory, f"{base_seq:020d}{suffix}")
+    
+    def _load_segments(self):
+        """Чтение списка сегментов и их разреженных индексов"""
+        for name in sorted(os.listdir(self.directory)):
+            if name.endswith('.log'):
+                self.segments.append(int(name[:-4]))
+        
+        for base_seq in self.segments:
+            size = os.path.getsize(self._path(base_seq, '.log'))
+            entries = []
+            try:
+                with open(self._path(base_seq, '.idx'), 'rb') as f:
+                    for entry in self.INDEX_ENTRY.iter_unpack(f.read()):
+                        # После сбоя индекс может ссылаться за конец данных
+                        if entry[2] < size:
+                            entries.append(entry)
+            except (FileNotFoundError, struct.error):
+                pass
+            self.indexes[base_seq] = entries
+    
+    def _open_active(self):
+        """Открытие последнего сегмента для дозаписи с восстановлением хвоста"""
+        if not self.segments:
+            self._start_segment(0)
+            return
+        
+        base_seq = self.segments[-1]
+        path = self._path(base_seq, '.log')
+        size = os.path.getsize(path)
+        last_line = None
+        
+        if size:
+            with open(path, 'r+b') as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    # Обрезаем недописанную после сбоя строку
+                    end = mm.rfind(b'\n') + 1
+                    if end:
+                        start = mm.rfind(b'\n', 0, end - 1) + 1
+                        last_line = mm[start:end]
+                if end != size:
+                    f.truncate(end)
+                    self.logger.warning(f"Журнал {path}: отброшено {size - end} байт недописанных данных")
+                    size = end
+        
+        self.next_seq = json.loads(last_line)['seq'] + 1 if last_line else base_seq
+        self.active_file = open(path, 'ab')
+        self.index_file = open(self._path(base_seq, '.idx'), 'ab')
+        self.active_size = size
+        
+        # Переписываем индекс, если после сбоя он ссылался за конец данных
+        entries = self.indexes[base_seq] = [e for e in self.indexes[base_seq] if e[2] < size]
+        if self.index_file.tell() != len(entries) * self.INDEX_ENTRY.size:
+            self.index_file.truncate(0)
+            for entry in entries:
+                self.index_file.write(self.INDEX_ENTRY.pack(*entry))
+    
+    def _start_segment(self, base_seq):
+        self.segments.append(base_seq)
+        self.indexes[base_seq] = []
+        self.active_file = open(self._path(base_seq, '.log'), 'ab')
+        self.index_file = open(self._path(base_seq, '.idx'), 'ab')
+        self.active_size = 0
+        self.next_seq = base_seq
+    
+    def append(self, record):
+        """Дозапись сообщения (dict с полями id, sender, text, ts, rx, out), возвращает seq"""
+        with self.lock:
+            if self.closed:
+                return None
+            if self.active_size >= self.segment_bytes:
+                self._rotate()
+            
+            seq = self.next_seq
+            line = json.dumps({"seq": seq, **record}, ensure_ascii=False,
+                              separators=(',', ':')).encode('utf-8') + b'\n'
+            
+            entries = self.indexes[self.segments[-1]]
+            if not entries or seq % self.index_interval == 0:
+                entry = (seq, record['rx'], self.active_size)
+                entries.append(entry)
+                self.index_file.write(self.INDEX_ENTRY.pack(*entry))
+            
+            self.active_file.write(line)
+            self.active_size += len(line)
+            self.next_seq = seq + 1
+            self.dirty = True
+            return seq
+    
+    def _rotate(self):
+        """Закрытие текущего сегмента и начало нового"""
+        self._sync_locked()
+        self.active_file.close()
+        self.index_file.close()
+        self._start_segment(self.next_seq)
+        
+        if self.retention_segments and len(self.segments) > self.retention_segments:
+            for base_seq in self.segments[:-self.retention_segments]:
+                for suffix in ('.log', '.idx'):
+                    try:
+                        os.remove(self._path(base_seq, suffix))
+                    except OSError:
+                        pass
+                del self.indexes[base_seq]
+            self.segments = self.segments[-self.retention_segments:]
+    
+    def _sync_locked(self):
+        if self.dirty:
+            self.active_file.flush()
+            self.index_file.flush()
+            os.fsync(self.active_file.fileno())
+            self.dirty = False
+    
+    def sync(self):
+        """Сброс буферов и fsync активного сегмента"""
+        with self.lock:
+            if not self.closed:
+                self._sync_locked()
+    
+    def _flush_loop(self):
+        while not self.closed:
+            time.sleep(self.fsync_interval)
+            try:
+                self.sync()
+            except Exception as e:
+                self.logger.error(f"Ошибка fsync журнала: {e}")
+    
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self._sync_locked()
+            self.closed = True
+            self.active_file.close()
+            self.index_file.close()
+    
+    def _scan(self, base_seq, offset):
+        """Чтение записей сегмента через mmap начиная со смещения"""
+        with self.lock:
+            if not self.closed and base_seq == self.segments[-1]:
+                self.active_file.flush()
+        path = self._path(base_seq, '.log')
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return
+        with f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                pos = offset
+                while True:
+                    end = mm.find(b'\n', pos)
+                    if end < 0:
+                        break
+                    yield json.loads(mm[pos:end])
+                    pos = end + 1
+    
+    def _segment_for_seq(self, seq):
+        i = bisect.bisect_right(self.segments, seq) - 1
+        return max(i, 0)
+    
+    def read_seq(self, start_seq, end_seq=None):
+        """Записи с номерами в интервале [start_seq, end_seq)"""
+        with self.lock:
+            segments = list(self.segments)
+        for i in range(self._segment_for_seq(start_seq), len(segments)):
+            base_seq = segments[i]
+            entries = self.indexes.get(base_seq, [])
+            j = bisect.bisect_right(entries, (start_seq, float('inf'), 0)) - 1
+            offset = entries[j][2] if j >= 0 else 0
+            for record in self._scan(base_seq, offset):
+                if end_seq is not None and record['seq'] >= end_seq:
+                    return
+                if record['seq'] >= start_seq:
+                    yield record
+    
+    def read_time(self, start_time, end_time):
+        """Записи, полученные в интервале [start_time, end_time]"""
+        with self.lock:
+            segments = list(self.segments)
+        for i, base_seq in enumerate(segments):
+            entries = self.indexes.get(base_seq, [])
+            if not entries or entries[0][1] > end_time:
+                break
+            # Сегмент целиком раньше интервала - следующий начинается до start_time
+            if i + 1 < len(segments):
+                next_entries = self.indexes.get(segments[i + 1], [])
+                if next_entries and next_entries[0][1] < start_time:
+                    continue
+            times = [entry[1] for entry in entries]
+            j = bisect.bisect_left(times, start_time) - 1
+            offset = entries[max(j, 0)][2]
+            for record in self._scan(base_seq, offset):
+                if record['rx'] > end_time:
+                    return
+                if record['rx'] >= start_time:
+                    yield record
+    
+    def find(self, message_id):
+        """Поиск записи по message_id (поиск байтового шаблона в mmap)"""
+        needle = b'"id":' + json.dumps(message_id).encode('utf-8') + b','
+        with self.lock:
+            segments = list(self.segments)
+            if not self.closed:
+                self.active_file.flush()
+        for base_seq in reversed(segments):
+            try:
+                f = open(self._path(base_seq, '.log'), 'rb')
+            except FileNotFoundError:
+                continue
+            with f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    pos = mm.rfind(needle)
+                    if pos >= 0:
+                        start = mm.rfind(b'\n', 0, pos) + 1
+                        return json.loads(mm[start:mm.find(b'\n', pos)])
+        return None
+    
+    def tail(self, count):
+        """Последние count записей (для восстановления журнала в памяти)"""
+        return self.read_seq(max(0, self.next_seq - count))
+
+
+class DedupCache:
+    """Кэш уже обработанных message_id с ограничением по времени и размеру
+    
+    Идентификаторы хранятся в порядке поступления; устаревшие (старше window
+    секунд) и лишние сверх max_entries вытесняются с начала очереди.
+    """
+    
+    def __init__(self, window=300.0, max_entries=100000):
+        self.window = window
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # message_id -> время первого появления
+        self.lock = threading.Lock()
+        self.hits = 0
+    
+    def check_and_add(self, message_id):
+        """True, если идентификатор уже встречался (дубликат)"""
+        now = time.monotonic()
+        with self.lock:
+            if message_id in self.entries:
+                self.hits += 1
+                return True
+            self.entries[message_id] = now
+            self._evict(now)
+            return False
+    
+    def _evict(self, now):
+        entries = self.entries
+        while entries:
+            message_id, seen_at = next(iter(entries.items()))
+            if now - seen_at <= self.window and len(entries) <= self.max_entries:
+                break
+            entries.popitem(last=False)
+    
+    def __len__(self):
+        return len(self.entries)
+
+
+class RateLimiter:
+    """Ограничение частоты сообщений по ключу (token bucket)
+    
+    Каждому ключу соответствует корзина на burst токенов, пополняемая со
+    скоростью rate токенов в секунду. Корзины хранятся в порядке последнего
+    обращения, число ключей ограничено max_keys.
+    """
+    
+    def __init__(self, rate, burst, max_keys=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self.buckets = OrderedDict()  # ключ -> [токены, время обновления]
+        self.lock = threading.Lock()
+    
+    def allow(self, key, cost=1, now=None):
+        """True, если у ключа хватает токенов (токены списываются)"""
+        if self.rate <= 0:
+            return True
+        now = time.monotonic() if now is None else now
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [float(self.burst), now]
+                if len(self.buckets) > self.max_keys:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+                bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+                bucket[1] = now
+            if bucket[0] >= cost:
+                bucket[0] -= cost
+                return True
+            return False
+
+
+class ShedRecord:
+    """Запись о сброшенной нагрузке"""
+    __slots__ = ('time', 'reason', 'peer', 'message_id')
+    
+    def __init__(self, reason, peer, message_id=None):
+        self.time = time.time()
+        self.reason = reason
+        self.peer = peer
+        self.message_id = message_id
+
+
+class LoadShedder:
+    """Учет сброшенных сообщений и соединений с указанием причины
+    
+    Хранит счетчики по причинам и последние history записей. В лог пишется
+    не чаще раза в log_interval секунд на причину - с числом сбросов за
+    интервал, чтобы поток отказов не превращался в поток записей лога.
+    """
+    QUEUE_FULL = 'queue_full'              # очередь входящих сообщений заполнена
+    RATE_LIMIT = 'rate_limit'              # узел превысил лимит частоты
+    CONNECTION_LIMIT = 'connection_limit'  # превышено число входящих соединений
+    OUTBOX_FULL = 'outbox_full'            # вытеснено из outbox недоступного узла
+    
+    def __init__(self, history=1000, log_interval=1.0, logger=None):
+        self.counts = {}
+        self.recent = deque(maxlen=history)
+        self.log_interval = log_interval
+        self.logger = logger or logging.getLogger(__name__)
+        self.unlogged = {}     # причина -> сбросов с последней записи в лог
+        self.logged_at = {}
+        self.lock = threading.Lock()
+    
+    def record(self, reason, peer, message_id=None):
+        now = time.monotonic()
+        with self.lock:
+            self.counts[reason] = self.counts.get(reason, 0) + 1
+            self.recent.append(ShedRecord(reason, peer, message_id))
+            self.unlogged[reason] = self.unlogged.get(reason, 0) + 1
+            if now - self.logged_at.get(reason, float('-inf')) < self.log_interval:
+                return
+            count = self.unlogged.pop(reason)
+            self.logged_at[reason] = now
+        self.logger.warning(f"Сброс нагрузки ({reason}): {count}, последний от {peer}")
+    
+    def total(self):
+        with self.lock:
+            return sum(self.counts.values())
+    
+    def snapshot(self):
+        """Счетчики сбросов по причинам"""
+        with self.lock:
+            return dict(self.counts)
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин (как histogram в Prometheus)"""
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+    
+    # Границы для задержек, секунд
+    LATENCY_BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+    
+    def __init__(self, bounds=LATENCY_BOUNDS):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # последняя корзина - +Inf
+        self.sum = 0.0
+        self.count = 0
+    
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+    
+    def quantile(self, q):
+        """Оценка квантиля по верхней границе корзины"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.bounds[i] if i < len(self.bounds) else float('inf')
+        return float('inf')
+
+
+class Metrics:
+    """Счетчики, гистограммы и измеряемые по запросу показатели узла
+    
+    Счетчики и гистограммы обновляются под одной блокировкой без выделения
+    памяти на горячем пути (после первого появления набора меток). Показатели
+    вроде глубины очередей не хранятся, а снимаются функциями при snapshot().
+    """
+    
+    def __init__(self, prefix='messenger'):
+        self.prefix = prefix
+        self.counters = {}     # (имя, метки) -> значение
+        self.histograms = {}   # (имя, метки) -> Histogram
+        self.gauges = {}       # имя -> функция, возвращающая число или {метки: число}
+        self.help = {}
+        self.lock = threading.Lock()
+    
+    def inc(self, name, value=1, labels=()):
+        """Увеличение счетчика; labels - кортеж пар (метка, значение)"""
+        key = (name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+    
+    def observe(self, name, value, labels=()):
+        key = (name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+    
+    def total(self, name):
+        """Сумма счетчика по всем наборам меток"""
+        with self.lock:
+            return sum(value for (counter, _), value in self.counters.items() if counter == name)
+    
+    def gauge(self, name, func, help_text=''):
+        """Регистрация показателя, вычисляемого при снятии снимка"""
+        self.gauges[name] = func
+        if help_text:
+            self.help[name] = help_text
+    
+    def describe(self, name, help_text):
+        self.help[name] = help_text
+    
+    def snapshot(self):
+        """Текущие значения всех метрик в виде словаря"""
+        with self.lock:
+            counters = list(self.counters.items())
+            histograms = [(key, list(h.counts), h.sum, h.count, h.quantile(0.5), h.quantile(0.99))
+                          for key, h in self.histograms.items()]
+            bounds = Histogram.LATENCY_BOUNDS
+        
+        result = {"timestamp": time.time(), "counters": {}, "gauges": {}, "histograms": {}}
+        for (name, labels), value in counters:
+            result["counters"].setdefault(name, []).append({"labels": dict(labels), "value": value})
+        for (name, labels), counts, total, count, p50, p99 in histograms:
+            result["histograms"].setdefault(name, []).append({
+                "labels": dict(labels), "bounds": list(bounds), "counts": counts,
+                "sum": total, "count": count, "p50": p50, "p99": p99
+            })
+        for name, func in self.gauges.items():
+            try:
+                value = func()
+            except Exception:
+                continue
+            if isinstance(value, dict):
+                result["gauges"][name] = [{"labels": dict(labels), "value": v} for labels, v in value.items()]
+            else:
+                result["gauges"][name] = [{"labels": {}, "value": value}]
+        return result
+    
+    def render_prometheus(self, snapshot=None):
+        """Снимок метрик в текстовом формате Prometheus"""
+        snapshot = snapshot or self.snapshot()
+        lines = []
+        
+        def header(name, kind):
+            full = f"{self.prefix}_{name}"
+            if name in self.help:
+                help_text = self.help[name].replace('\\', '\\\\').replace('\n', '\\n')
+                lines.append(f"# HELP {full} {help_text}")
+            lines.append(f"# TYPE {full} {kind}")
+            return full
+        
+        def label_text(labels, extra=None):
+            items = list(labels.items()) + ([extra] if extra else [])
+            if not items:
+                return ""
+            # Экранирование по формату Prometheus: обратная косая черта, кавычка, перевод строки
+            escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+                       for _, v in items)
+            return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+        
+        for name, series in sorted(snapshot["counters"].items()):
+            full = header(name, "counter")
+            for item in series:
+                lines.append(f"{full}{label_text(item['labels'])} {item['value']}")
+        for name, series in sorted(snapshot["gauges"].items()):
+            full = header(name, "gauge")
+            for item in series:
+                lines.append(f"{full}{label_text(item['labels'])} {item['value']}")
+        for name, series in sorted(snapshot["histograms"].items()):
+            full = header(name, "histogram")
+            for item in series:
+                cumulative = 0
+                for bound, count in zip(item["bounds"] + ["+Inf"], item["counts"]):
+                    cumulative += count
+                    lines.append(f"{full}_bucket{label_text(item['labels'], ('le', bound))} {cumulative}")
+                lines.append(f"{full}_sum{label_text(item['labels'])} {item['sum']}")
+                lines.append(f"{full}_count{label_text(item['labels'])} {item['count']}")
+        return "\n".join(lines) + "\n"
+
+
+class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+    """HTTP endpoint метрик: /metrics (Prometheus), /metrics.json и /ready (проверка готовности)"""
+    
+    def do_GET(self):
+        metrics = self.server.metrics
+        if self.path == '/ready':
+            ready = self.server.ready.is_set()
+            self.send_response(200 if ready else 503)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if self.path == '/metrics':
+            body = metrics.render_prometheus().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif self.path == '/metrics.json':
+            body = json.dumps(metrics.snapshot(), ensure_ascii=False).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass  # запросы мониторинга не пишем в лог
+
+
+class PeerInfo:
+    """Метаданные известного узла"""
+    __slots__ = ('addr', 'last_seen', 'state', 'due', 'protocol', 'rtt', 'failures', 'capabilities')
+    
+    def __init__(self, addr):
+        self.addr = addr
+        self.last_seen = 0.0
+        self.state = None
+        self.due = None          # время следующей проверки состояния
+        self.protocol = 0        # версия протокола кадров
+        self.rtt = None          # сглаженная задержка отправки, секунд
+        self.failures = 0        # ошибок отправки подряд
+        self.capabilities = {}
+
+
+class PeerTable:
+    """Таблица узлов с очередью истечения вместо полных проходов
+    
+    Узел проходит состояния active -> idle -> stale -> удален по порогам
+    active_timeout, idle_timeout и expire_timeout от момента последней
+    активности. Для каждого узла в куче лежит не больше одной записи со
+    временем следующей проверки, поэтому переход стоит O(log n), а счетчики
+    по состояниям поддерживаются постоянно. Повторная активность уже
+    активного узла и чтение списка активных узлов (снимок, перестраиваемый
+    только при изменении состава) выполняются без блокировки.
+    """
+    
+    ACTIVE = 'active'
+    IDLE = 'idle'
+    STALE = 'stale'
+    
+    def __init__(self, active_timeout=30.0, idle_timeout=60.0, expire_timeout=300.0):
+        self.peers = {}   # addr -> PeerInfo
+        self.heap = []    # (due, порядковый номер, addr)
+        self.counter = itertools.count()
+        self.counts = {self.ACTIVE: 0, self.IDLE: 0, self.STALE: 0}
+        self.active = set()
+        self.lock = threading.Lock()
+        self.version = 0
+        self.snapshot = (-1, ())
+        self.next_due = float('inf')
+        self.configure(active_timeout, idle_timeout, expire_timeout)
+    
+    def configure(self, active_timeout, idle_timeout, expire_timeout):
+        """Изменение порогов состояний (вступают в силу при следующих проверках)"""
+        self.active_timeout = active_timeout
+        self.idle_timeout = max(idle_timeout, active_timeout)
+        self.expire_timeout = max(expire_timeout, self.idle_timeout)
+    
+    def touch(self, addr, protocol=None, capabilities=None, now=None):
+        """Отметка активности узла, возвращает True для нового узла"""
+        now = now if now is not None else time.time()
+        info = self.peers.get(addr)
+        if info is not None and info.state == self.ACTIVE and protocol is None and capabilities is None:
+            # Быстрый путь: узел уже активен, состав таблицы не меняется
+            info.last_seen = now
+            info.failures = 0
+            return False
+        
+        with self.lock:
+            info = self.peers.get(addr)
+            is_new = info is None
+            if is_new:
+                info = PeerInfo(addr)
+                self.peers[addr] = info
+            info.last_seen = now
+            info.failures = 0
+            if protocol is not None:
+                info.protocol = protocol
+            if capabilities:
+                info.capabilities.update(capabilities)
+            if info.state != self.ACTIVE:
+                self._set_state(info, self.ACTIVE)
+                self._schedule(info, now + self.active_timeout)
+            self._advance(now)
+            return is_new
+    
+    def learn(self, addr, protocol, capabilities, now=None):
+        """Узел из чужого списка, возвращает True для нового узла
+        
+        Новый узел добавляется неактивным (idle) и становится активным только
+        при прямой активности (touch). Известный узел не меняется: устаревший
+        или поддельный список не должен продлевать жизнь выбывшим узлам.
+        """
+        now = now if now is not None else time.time()
+        with self.lock:
+            if addr in self.peers:
+                return False
+            info = PeerInfo(addr)
+            self.peers[addr] = info
+            info.last_seen = now - self.active_timeout
+            info.protocol = protocol
+            info.capabilities.update(capabilities)
+            self._set_state(info, self.IDLE)
+            self._schedule(info, info.last_seen + self.idle_timeout)
+            self._advance(now)
+            return True
+    
+    def mark_failed(self, addr):
+        """Учет ошибки отправки: узел исключается из активных до новой активности"""
+        with self.lock:
+            info = self.peers.get(addr)
+            if info is None:
+                return
+            info.failures += 1
+            if info.state != self.STALE:
+                self._set_state(info, self.STALE)
+                self._schedule(info, info.last_seen + self.expire_timeout)
+    
+    def record_rtt(self, addr, rtt):
+        """Сглаженная (EWMA) задержка отправки узлу"""
+        info = self.peers.get(addr)
+        if info is not None:
+            info.rtt = rtt if info.rtt is None else info.rtt * 0.8 + rtt * 0.2
+    
+    def remove(self, addr):
+        with self.lock:
+            info = self.peers.pop(addr, None)
+            if info is not None:
+                self._set_state(info, None)
+    
+    def _set_state(self, info, state):
+        if info.state is not None:
+            self.counts[info.state] -= 1
+        if state is not None:
+            self.counts[state] += 1
+        if info.state == self.ACTIVE:
+            self.active.discard(info.addr)
+        if state == self.ACTIVE:
+            self.active.add(info.addr)
+        info.state = state
+        self.version += 1
+    
+    def _schedule(self, info, due):
+        info.due = due
+        heapq.heappush(self.heap, (due, next(self.counter), info.addr))
+        self.next_due = self.heap[0][0]
+    
+    def _advance(self, now):
+        """Обработка наступивших переходов состояний, возвращает число удаленных"""
+        removed = 0
+        heap = self.heap
+        while heap and heap[0][0] <= now:
+            due, _, addr = heapq.heappop(heap)
+            info = self.peers.get(addr)
+            if info is None or info.due != due:
+                continue  # устаревшая запись
+            
+            if info.state == self.ACTIVE:
+                if now - info.last_seen < self.active_timeout:
+                    # Узел был активен после постановки в очередь - переносим проверку
+                    self._schedule(info, info.last_seen + self.active_timeout)
+                    continue
+                self._set_state(info, self.IDLE)
+                self._schedule(info, info.last_seen + self.idle_timeout)
+            elif info.state == self.IDLE:
+                self._set_state(info, self.STALE)
+                self._schedule(info, info.last_seen + self.expire_timeout)
+            else:
+                del self.peers[addr]
+                self._set_state(info, None)
+                removed += 1
+        self.next_due = heap[0][0] if heap else float('inf')
+        return removed
+    
+    def expire(self, now=None):
+        """Применение просроченных переходов, возвращает число удаленных узлов"""
+        with self.lock:
+            return self._advance(now if now is not None else time.time())
+    
+    def _refresh(self):
+        if self.next_due <= time.time():
+            self.expire()
+    
+    def active_peers(self):
+        """Адреса активных узлов (неизменяемый снимок)"""
+        self._refresh()
+        version, peers = self.snapshot
+        if version == self.version:
+            return peers
+        with self.lock:
+            self.snapshot = (self.version, tuple(self.active))
+            return self.snapshot[1]
+    
+    def visible_peers(self):
+        """Активные и недавно активные узлы: список PeerInfo"""
+        self._refresh()
+        with self.lock:
+            return [info for info in self.peers.values()
+                    if info.state in (self.ACTIVE, self.IDLE)]
+    
+    def stale_peers(self):
+        """Адреса известных, но недоступных узлов"""
+        self._refresh()
+        with self.lock:
+            return [addr for addr, info in self.peers.items() if info.state == self.STALE]
+    
+    def count(self, *states):
+        """Число узлов в указанных состояниях"""
+        self._refresh()
+        return sum(self.counts[state] for state in states)
+    
+    def get(self, addr):
+        return self.peers.get(addr)
+    
+    def protocol(self, addr):
+        info = self.peers.get(addr)
+        return info.protocol if info is not None else 0
+    
+    def __contains__(self, addr):
+        return addr in self.peers
+    
+    def __len__(self):
+        return len(self.peers)
+
+
+TOPIC_MAX_LENGTH = 64
+
+
+def valid_topic(topic):
+    """Имя темы: непустая строка без пробелов длиной до TOPIC_MAX_LENGTH"""
+    return (isinstance(topic, str) and 0 < len(topic) <= TOPIC_MAX_LENGTH
+            and not any(ch.isspace() for ch in topic))
+
+
+class TopicIndex:
+    """Индекс подписок: тема -> узлы, подписанные на нее
+    
+    Узлы объявляют свои подписки в discovery beacon; каждый beacon заменяет
+    прежний набор тем узла. Публикация в тему отправляется только узлам
+    из индекса, а не всем известным.
+    """
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.by_topic = {}   # тема -> frozenset адресов (неизменяемые снимки для чтения без блокировки)
+        self.by_peer = {}    # адрес -> frozenset тем
+    
+    def update(self, addr, topics):
+        """Новый набор тем узла, True - набор изменился"""
+        topics = frozenset(topic for topic in topics if valid_topic(topic))
+        if self.by_peer.get(addr, frozenset()) == topics:
+            return False
+        with self.lock:
+            previous = self.by_peer.get(addr, frozenset())
+            for topic in previous - topics:
+                remaining = self.by_topic[topic] - {addr}
+                if remaining:
+                    self.by_topic[topic] = remaining
+                else:
+                    del self.by_topic[topic]
+            for topic in topics - previous:
+                self.by_topic[topic] = self.by_topic.get(topic, frozenset()) | {addr}
+            if topics:
+                self.by_peer[addr] = topics
+            else:
+                self.by_peer.pop(addr, None)
+        return True
+    
+    def remove(self, addr):
+        self.update(addr, ())
+    
+    def subscribers(self, topic):
+        return self.by_topic.get(topic, frozenset())
+    
+    def topics(self):
+        """Темы и число подписанных узлов"""
+        return {topic: len(peers) for topic, peers in self.by_topic.items()}
+
+
+class ConsoleRenderer:
+    """Вывод сообщений в терминал из фонового потока пачками
+    
+    Сетевые потоки только кладут запись в очередь; строки формируются и
+    пишутся одним вызовом write раз в interval секунд. Если терминал не
+    успевает, новые записи сверх max_pending отбрасываются со сводкой.
+    """
+    
+    def __init__(self, interval=0.05, max_pending=1000):
+        self.interval = interval
+        self.max_pending = max_pending
+        self.pending = deque()
+        self.dropped = 0
+        self.wakeup = threading.Event()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='console', daemon=True)
+        self.thread.start()
+    
+    def show(self, item):
+        """Постановка в очередь строки или записи с методом render()"""
+        if len(self.pending) >= self.max_pending:
+            self.dropped += 1
+            return
+        self.pending.append(item)
+        self.wakeup.set()
+    
+    def _run(self):
+        while self.running:
+            self.wakeup.wait()
+            self.wakeup.clear()
+            self.flush()
+            # Окно накопления следующей пачки
+            time.sleep(self.interval)
+    
+    def flush(self):
+        lines = []
+        while self.pending:
+            item = self.pending.popleft()
+            lines.append(item if isinstance(item, str) else item.render())
+        if self.dropped:
+            lines.append(f"... не показано сообщений: {self.dropped}")
+            self.dropped = 0
+        if lines:
+            try:
+                sys.stdout.write("\n" + "\n".join(lines) + "\n")
+                sys.stdout.flush()
+            except (OSError, ValueError):
+                pass  # терминал закрыт
+    
+    def close(self):
+        self.running = False
+        self.wakeup.set()
+        self.thread.join(timeout=1.0)
+        self.flush()
+
+
+def detect_local_ip():
+    """IP адрес исходящего интерфейса (без отправки пакетов), иначе loopback"""
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    try:
+        # connect для UDP только выбирает маршрут
+        sock.connect(('10.255.255.255', 1))
+        return sock.getsockname()[0]
+    except OSError:
+        return '127.0.0.1'
+    finally:
+        sock.close()
+
+
+def parse_protocol(value):
+    """Версия протокола из discovery-сообщения; некорректная -> 0"""
+    try:
+        return int(value)
+    except (ValueError, TypeError, OverflowError):
+        return 0
+
+
+def parse_endpoint(value, default_port):
+    """Адрес вида "host:port" или "host" -> (host, port)"""
+    host, _, port = str(value).rpartition(':')
+    if not host:
+        return (port, default_port)
+    return (host, int(port))
+
+
+class LocalRegistry:
+    """Каталог узлов этого хоста: по файлу на узел с адресом и UDP портом ответа
+    
+    Узлы на одном хосте делят discovery_port, и unicast beacon на loopback
+    получает только один из них. Через каталог узел сразу узнает соседей и
+    шлет им beacon на их собственные UDP порты. Файл обновляется при каждой
+    рассылке; записи завершившихся процессов и давно не обновлявшиеся
+    записи удаляются при чтении.
+    
+    Каталог доступен только владельцу (0700): чужой каталог, каталог с
+    правами для других пользователей и символические ссылки отвергаются.
+    """
+    
+    # Запись и чтение файлов реестра без перехода по символическим ссылкам
+    OPEN_FLAGS = getattr(os, 'O_NOFOLLOW', 0) | getattr(os, 'O_BINARY', 0)
+    
+    def __init__(self, directory, name, stale_after=60.0):
+        self.directory = directory
+        self.path = os.path.join(directory, f"{name}.json")
+        self.stale_after = stale_after
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        st = os.lstat(directory)
+        if not stat.S_ISDIR(st.st_mode):
+            raise PermissionError(f"{directory} не является каталогом")
+        self.check_owner(st, directory)
+    
+    @staticmethod
+    def default_directory(discovery_port):
+        """Каталог реестра текущего пользователя: XDG_RUNTIME_DIR или временный каталог с uid"""
+        runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+        if runtime_dir and os.path.isdir(runtime_dir):
+            return os.path.join(runtime_dir, f"p2p-messenger-{discovery_port}")
+        user = os.getuid() if hasattr(os, 'getuid') else os.environ.get('USERNAME', 'user')
+        return os.path.join(tempfile.gettempdir(), f"p2p-messenger-{user}-{discovery_port}")
+    
+    @staticmethod
+    def check_owner(st, path):
+        """Файл или каталог принадлежит текущему пользователю и закрыт для остальных"""
+        if not hasattr(os, 'getuid'):
+            return  # Windows: права задает ACL профиля пользователя
+        if st.st_uid != os.getuid():
+            raise PermissionError(f"{path} принадлежит другому пользователю")
+        if st.st_mode & 0o077:
+            raise PermissionError(f"{path} доступен другим пользователям")
+    
+    def register(self, entry):
+        """Запись (или обновление) собственной записи"""
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            os.remove(tmp_path)  # остаток прерванной записи
+        except FileNotFoundError:
+            pass
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | self.OPEN_FLAGS, 0o600)
+        with open(fd, 'w', encoding='utf-8') as f:
+            json.dump({**entry, "pid": os.getpid()}, f)
+        os.replace(tmp_path, self.path)
+    
+    def entries(self):
+        """Записи других живых узлов"""
+        result = []
+        now = time.time()
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return result
+        for name in names:
+            path = os.path.join(self.directory, name)
+            if not name.endswith('.json') or path == self.path:
+                continue
+            try:
+                fd = os.open(path, os.O_RDONLY | self.OPEN_FLAGS)
+            except OSError:
+                continue  # символическая ссылка или файл уже удален
+            try:
+                with open(fd, encoding='utf-8') as f:
+                    st = os.fstat(f.fileno())
+                    if not stat.S_ISREG(st.st_mode):
+                        continue
+                    self.check_owner(st, path)
+                    if now - st.st_mtime > self.stale_after:
+                        os.remove(path)
+                        continue
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not self.process_alive(entry.get('pid')):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                continue
+            result.append(entry)
+        return result
+    
+    @staticmethod
+    def process_alive(pid):
+        if not isinstance(pid, int) or os.name == 'nt':
+            # В Windows os.kill(pid, 0) завершает процесс - полагаемся на время обновления
+            return True
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except OSError:
+            pass  # процесс есть, но принадлежит другому пользователю
+        return True
+    
+    def unregister(self):
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+
+
+class BeaconSchedule:
+    """Интервалы discovery-рассылки: часто при изменениях, реже в стабильной сети
+    
+    Интервал удваивается после каждой рассылки от min_interval до
+    max_interval и сбрасывается к минимуму при изменении состава сети.
+    Случайный разброс jitter не дает узлам рассылать beacon синхронно.
+    """
+    
+    def __init__(self, min_interval=0.5, max_interval=10.0, jitter=0.25):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        self.interval = min_interval
+    
+    def next_delay(self):
+        delay = self.interval * (1 + random.uniform(-self.jitter, self.jitter))
+        self.interval = min(self.interval * 2, self.max_interval)
+        return delay
+    
+    def reset(self):
+        self.interval = self.min_interval
+
+
+class DiscoveryProtocol(asyncio.DatagramProtocol):
+    """UDP протокол приема discovery-сообщений для режима asyncio"""
+    
+    def __init__(self, messenger):
+        self.messenger = messenger
+    
+    def connection_made(self, transport):
+        self.transport = transport
+    
+    def datagram_received(self, data, addr):
+        if data:
+            self.messenger.process_discovery(data, addr)
+    
+    def error_received(self, exc):
+        self.messenger.logger.error(f"Ошибка UDP сокета: {exc}")
+
+
+class FramedServerProtocol(asyncio.BufferedProtocol):
+    """TCP протокол приема кадров для режима asyncio (чтение прямо в буфер декодера)"""
+    
+    def __init__(self, messenger):
+        self.messenger = messenger
+        self.decoder = FrameDecoder(max_frame_size=messenger.config['max_frame_size'])
+        self.idle_timeout = messenger.config['connection_idle_timeout']
+        self.idle_handle = None
+        self.backlog = deque()  # сообщения, отложенные до разгрузки очереди входящих
+    
+    def connection_made(self, transport):
+        self.transport = transport
+        self.address = transport.get_extra_info('peername')[:2]
+        if not self.messenger.connection_opened(self.address):
+            transport.abort()
+            return
+        self.loop = asyncio.get_running_loop()
+        self.last_activity = self.loop.time()
+        self.idle_handle = self.loop.call_later(self.idle_timeout, self.check_idle)
+        ssl_object = transport.get_extra_info('ssl_object')
+        if ssl_object is not None:
+            self.messenger.tls_accepted(ssl_object, self.address)
+    
+    def check_idle(self):
+        """Закрытие соединения, простаивающего дольше таймаута"""
+        idle = self.loop.time() - self.last_activity
+        if idle >= self.idle_timeout:
+            self.transport.close()
+        else:
+            self.idle_handle = self.loop.call_later(self.idle_timeout - idle, self.check_idle)
+    
+    def get_buffer(self, sizehint):
+        return self.decoder.get_buffer(sizehint)
+    
+    def buffer_updated(self, nbytes):
+        self.last_activity = self.loop.time()
+        self.messenger.metrics.inc('received_bytes_total', nbytes)
+        try:
+            for flags, payload in self.decoder.buffer_updated(nbytes):
+                # Декодированные сообщения не ссылаются на буфер декодера - их можно отложить
+                messages = self.messenger.decode_frame(flags, payload, self.address)
+                if self.backlog:
+                    self.backlog.extend(messages)
+                    continue
+                # Очередь проверяется перед каждым сообщением: пакет может быть больше ее запаса
+                for i, message_data in enumerate(messages):
+                    if self.messenger.inbound_congested():
+                        self.backlog.extend(messages[i:])
+                        break
+                    self.messenger.dispatch(message_data, self.address, framed=True)
+            # Очередь почти заполнена - перестаем читать, пока обработчик не догонит
+            if self.backlog:
+                self.messenger.pause_protocol(self)
+        except FrameError as e:
+            self.messenger.logger.error(f"Ошибка протокола от {self.address}: {e}")
+            self.transport.close()
+        except Exception as e:
+            self.messenger.logger.error(f"Ошибка обработки клиента {self.address}: {e}")
+    
+    def eof_received(self):
+        legacy = self.decoder.finish()
+        if legacy is not None:
+            try:
+                self.messenger.process_incoming(legacy, self.address)
+            except Exception as e:
+                self.messenger.logger.error(f"Ошибка обработки клиента {self.address}: {e}")
+        return False
+    
+    def pause(self):
+        if not self.transport.is_closing():
+            self.transport.pause_reading()
+    
+    def resume(self):
+        """Обработка отложенных сообщений; True - можно снова читать соединение"""
+        while self.backlog:
+            if self.messenger.inbound_congested():
+                return False
+            self.messenger.dispatch(self.backlog.popleft(), self.address, framed=True)
+        if not self.transport.is_closing():
+            self.transport.resume_reading()
+        return True
+    
+    def connection_lost(self, exc):
+        if self.idle_handle is None:
+            return  # соединение отклонено в connection_made
+        self.idle_handle.cancel()
+        self.messenger.connection_closed()
+
+
+class PendingDelivery:
+    """Сообщение, ожидающее подтверждения от узла"""
+    __slots__ = ('peer', 'message_id', 'message', 'attempts', 'due')
+    
+    def __init__(self, peer, message_id, message, due):
+        self.peer = peer
+        self.message_id = message_id
+        self.message = message
+        self.attempts = 0
+        self.due = due
+
+
+class ReliableSender:
+    """Надежная доставка: повтор до подтверждения (ACK) и outbox для недоступных узлов
+    
+    Каждая пара (узел, message_id) ждет ACK; без него сообщение отправляется
+    повторно с экспоненциальной паузой от ack_timeout до backoff_max. Если
+    узел недоступен или попытки исчерпаны, сообщение переходит в outbox узла
+    (ограниченный по размеру). Outbox отправляется заново, когда недоступный
+    узел снова обнаружен. Ожидающих ACK сообщений на узел не больше
+    pending_per_peer - сверх лимита вытесняются самые старые. Повторы
+    выполняются отдельным потоком, отправитель не ждет.
+    """
+    
+    def __init__(self, resend, is_online, ack_timeout=2.0, backoff_max=30.0, max_retries=8,
+                 pending_per_peer=1000, outbox_per_peer=1000, outbox_total=10000, on_drop=None, logger=None):
+        self.resend = resend            # resend(peer, message) - повторная отправка
+        self.is_online = is_online      # is_online(peer) - узел считается доступным
+        self.ack_timeout = ack_timeout
+        self.backoff_max = backoff_max
+        self.max_retries = max_retries
+        self.pending_per_peer = pending_per_peer
+        self.outbox_per_peer = outbox_per_peer
+        self.outbox_total = outbox_total
+        self.on_drop = on_drop or (lambda peer, message_id: None)
+        self.logger = logger or logging.getLogger(__name__)
+        self.pending = {}       # узел -> OrderedDict(message_id -> PendingDelivery)
+        self.pending_size = 0
+        self.heap = []          # (срок, номер, ключ) - ленивое удаление по entry.due
+        self.outbox = {}        # узел -> OrderedDict(message_id -> PendingDelivery)
+        self.outbox_size = 0
+        self.offline = set()    # узлы, признанные недоступными: outbox ждет их обнаружения
+        self.sequence = itertools.count()
+        self.cond = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name='reliable', daemon=True)
+        self.thread.start()
+    
+    def track(self, peer, message_id, message):
+        """Ожидание ACK на сообщение, отправляемое узлу"""
+        with self.cond:
+            entry = PendingDelivery(peer, message_id, message, time.monotonic() + self.ack_timeout)
+            queued = self.pending.setdefault(peer, OrderedDict())
+            if queued.pop(message_id, None) is not None:
+                self.pending_size -= 1
+            queued[message_id] = entry
+            self.pending_size += 1
+            # Узел не подтверждает сообщения - не копим их без предела
+            while len(queued) > self.pending_per_peer:
+                dropped, _ = queued.popitem(last=False)
+                self.pending_size -= 1
+                self.on_drop(peer, dropped)
+            self._push(entry)
+    
+    def defer(self, peer, message_id):
+        """Отправка не удалась - сообщение сразу в outbox"""
+        with self.cond:
+            entry = self._pop_pending(peer, message_id)
+            if entry is not None:
+                self.offline.add(peer)
+                self._to_outbox(entry)
+    
+    def store(self, peer, message_id, message):
+        """Сообщение для недоступного узла - в outbox до его обнаружения"""
+        with self.cond:
+            self.offline.add(peer)
+            self._to_outbox(PendingDelivery(peer, message_id, message, 0.0))
+    
+    def acknowledge(self, peer, message_ids):
+        """Получен ACK: сообщения доставлены"""
+        with self.cond:
+            stored = self.outbox.get(peer)
+            for message_id in message_ids:
+                if self._pop_pending(peer, message_id) is None and stored:
+                    # Поздний ACK на сообщение, уже отложенное в outbox
+                    if stored.pop(message_id, None) is not None:
+                        self.outbox_size -= 1
+            if stored is not None and not stored:
+                del self.outbox[peer]
+    
+    def has_backlog(self, peer):
+        """Для узла есть outbox, ожидающий его обнаружения"""
+        return peer in self.offline
+    
+    def peer_online(self, peer):
+        """Недоступный узел снова обнаружен - отправляем его outbox без ожидания паузы
+        
+        Сообщения, уже ожидающие ACK, сохраняют свои попытки и паузу повтора.
+        """
+        if peer not in self.offline:
+            return
+        with self.cond:
+            stored = self.outbox.get(peer) or OrderedDict()
+            queued = self.pending.setdefault(peer, OrderedDict())
+            now = time.monotonic()
+            moved = 0
+            while stored and len(queued) < self.pending_per_peer:
+                message_id, entry = stored.popitem(last=False)
+                self.outbox_size -= 1
+                if message_id in queued:
+                    continue  # уже ожидает ACK
+                entry.attempts = 0
+                entry.due = now
+                queued[message_id] = entry
+                self.pending_size += 1
+                self._push(entry)
+                moved += 1
+            if not stored:
+                # Остаток сверх лимита ожидающих уйдет при следующем обнаружении
+                self.outbox.pop(peer, None)
+                self.offline.discard(peer)
+            if not queued:
+                del self.pending[peer]
+            self.cond.notify()
+        if moved:
+            self.logger.info(f"Отправка {moved} отложенных сообщений узлу {peer}")
+    
+    def _pop_pending(self, peer, message_id):
+        queued = self.pending.get(peer)
+        if not queued:
+            return None
+        entry = queued.pop(message_id, None)
+        if entry is not None:
+            self.pending_size -= 1
+            if not queued:
+                del self.pending[peer]
+        return entry
+    
+    def _push(self, entry):
+        first = not self.heap or entry.due < self.heap[0][0]
+        heapq.heappush(self.heap, (entry.due, next(self.sequence), (entry.peer, entry.message_id)))
+        if first:
+            self.cond.notify()
+    
+    def _to_outbox(self, entry):
+        stored = self.outbox.setdefault(entry.peer, OrderedDict())
+        stored[entry.message_id] = entry
+        self.outbox_size += 1
+        # Ограничения outbox: вытесняем самые старые сообщения
+        while len(stored) > self.outbox_per_peer:
+            dropped, _ = stored.popitem(last=False)
+            self.outbox_size -= 1
+            self.on_drop(entry.peer, dropped)
+        while self.outbox_size > self.outbox_total:
+            peer, oldest = next(iter(self.outbox.items()))
+            dropped, _ = oldest.popitem(last=False)
+            self.outbox_size -= 1
+            if not oldest:
+                del self.outbox[peer]
+            self.on_drop(peer, dropped)
+    
+    def _run(self):
+        while self.running:
+            resend = []
+            with self.cond:
+                now = time.monotonic()
+                while self.heap and self.heap[0][0] <= now:
+                    due, _, (peer, message_id) = heapq.heappop(self.heap)
+                    entry = self.pending.get(peer, {}).get(message_id)
+                    if entry is None or entry.due != due:
+                        continue  # подтверждено или перенесено
+                    online = self.is_online(peer)
+                    if not online or entry.attempts >= self.max_retries:
+                        self._pop_pending(peer, message_id)
+                        if not online:
+                            self.offline.add(peer)
+                        self._to_outbox(entry)
+                        continue
+                    entry.attempts += 1
+                    entry.due = now + min(self.backoff_max, self.ack_timeout * 2 ** entry.attempts)
+                    heapq.heappush(self.heap, (entry.due, next(self.sequence), (peer, message_id)))
+                    resend.append(entry)
+                if not resend:
+                    timeout = self.heap[0][0] - now if self.heap else None
+                    self.cond.wait(timeout)
+                    continue
+            for entry in resend:
+                try:
+                    self.resend(entry.peer, entry.message)
+                except Exception as e:
+                    self.logger.error(f"Ошибка повторной отправки {entry.message_id} к {entry.peer}: {e}")
+    
+    def counts(self):
+        with self.cond:
+            return self.pending_size, self.outbox_size
+    
+    def close(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
+
+
+BLOB_READ_SIZE = 65536
+
+
+def blob_root(chunk_digests):
+    """Идентификатор файла: SHA-256 от списка SHA-256 его частей"""
+    root = hashlib.sha256()
+    for digest in chunk_digests:
+        root.update(bytes.fromhex(digest))
+    return root.hexdigest()
+
+
+class BlobStore:
+    """Файлы, доступные для передачи другим узлам, и незавершенные загрузки
+    
+    Файл делится на части по chunk_size байт; манифест содержит SHA-256
+    каждой части, идентификатор файла - хеш списка этих хешей, поэтому
+    манифест, полученный от любого узла, проверяется по идентификатору.
+    Свои файлы не копируются: индекс хранит путь к исходному файлу.
+    Загрузка пишется в <id>.part, отметки полученных частей - в <id>.state
+    (байт на часть), что позволяет продолжить прерванную загрузку.
+    """
+    
+    def __init__(self, directory, chunk_size=1048576, logger=None):
+        self.directory = directory
+        self.chunk_size = chunk_size
+        self.logger = logger or logging.getLogger(__name__)
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.index_path = os.path.join(directory, 'index.json')
+        self.index = {}   # blob_id -> манифест с полем path
+        try:
+            with open(self.index_path, encoding='utf-8') as f:
+                self.index = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Ошибка чтения индекса файлов {self.index_path}: {e}")
+    
+    def add_file(self, path):
+        """Регистрация своего файла: хеширование частей потоком, возвращает манифест"""
+        path = os.path.abspath(path)
+        digests = []
+        size = 0
+        buffer = bytearray(BLOB_READ_SIZE)
+        view = memoryview(buffer)
+        with open(path, 'rb') as f:
+            while True:
+                digest = hashlib.sha256()
+                remaining = self.chunk_size
+                while remaining:
+                    nbytes = f.readinto(view[:min(BLOB_READ_SIZE, remaining)])
+                    if not nbytes:
+                        break
+                    digest.update(view[:nbytes])
+                    remaining -= nbytes
+                chunk_bytes = self.chunk_size - remaining
+                if not chunk_bytes and digests:
+                    break
+                digests.append(digest.hexdigest())
+                size += chunk_bytes
+                if remaining:
+                    break
+        manifest = {
+            "blob_id": blob_root(digests),
+            "name": os.path.basename(path),
+            "size": size,
+            "chunk_size": self.chunk_size,
+            "chunks": digests
+        }
+        self.complete(manifest, path)
+        return manifest
+    
+    def complete(self, manifest, path):
+        with self.lock:
+            self.index[manifest['blob_id']] = {**manifest, "path": path}
+            self._save()
+    
+    def _save(self):
+        with open(self.index_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(self.index, f, ensure_ascii=False)
+        os.replace(self.index_path + '.tmp', self.index_path)
+    
+    def get(self, blob_id):
+        """Манифест имеющегося целиком файла или None"""
+        entry = self.index.get(blob_id)
+        if entry is not None and not os.path.isfile(entry['path']):
+            return None
+        return entry
+    
+    def partial_paths(self, blob_id):
+        base = os.path.join(self.directory, blob_id)
+        return base + '.part', base + '.state'
+    
+    def entries(self):
+        return list(self.index.values())
+
+
+class BlobRequestHandler(http.server.BaseHTTPRequestHandler):
+    """Раздача файлов: GET /blobs/<id> - манифест, GET /blobs/<id>/<n> - часть n"""
+    protocol_version = 'HTTP/1.1'   # постоянные соединения для серии частей
+    
+    def setup(self):
+        self.rejected = False
+        if isinstance(self.request, ssl.SSLSocket):
+            # Рукопожатие в потоке соединения, а не в общем потоке accept
+            self.request.settimeout(self.server.messenger.config['tls_handshake_timeout'])
+            try:
+                self.request.do_handshake()
+            except OSError as e:
+                self.rejected = True
+                self.server.messenger.logger.warning(f"Отклонено TLS соединение раздачи файлов от {self.client_address}: {e}")
+        self.request.settimeout(self.server.messenger.config['blob_timeout'])
+        super().setup()
+    
+    def handle(self):
+        if self.rejected:
+            return
+        try:
+            super().handle()
+        except OSError:
+            pass  # загружающий узел закрыл соединение
+    
+    def do_GET(self):
+        parts = self.path.strip('/').split('/')
+        manifest = self.server.store.get(parts[1]) if len(parts) in (2, 3) and parts[0] == 'blobs' else None
+        if manifest is None:
+            self.send_error(404)
+            return
+        if len(parts) == 2:
+            body = json.dumps({key: value for key, value in manifest.items() if key != 'path'}).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        
+        try:
+            index = int(parts[2])
+        except ValueError:
+            index = -1
+        if not 0 <= index < len(manifest['chunks']):
+            self.send_error(404)
+            return
+        offset = index * manifest['chunk_size']
+        count = min(manifest['chunk_size'], manifest['size'] - offset)
+        with open(manifest['path'], 'rb') as f:
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/octet-stream')
+            self.send_header('Content-Length', str(count))
+            self.end_headers()
+            # Данные идут из файла в сокет без копирования в память процесса (sendfile)
+            self.connection.sendfile(f, offset, count)
+        self.server.messenger.metrics.inc('blob_bytes_sent_total', count)
+    
+    def log_message(self, format, *args):
+        pass  # части файлов не пишем в лог по одной
+
+
+class WorkerHandle:
+    """Процесс-исполнитель глазами главного процесса: канал команд и его состояние"""
+    
+    def __init__(self, index, process, channel):
+        self.index = index
+        self.process = process
+        self.channel = channel
+        self.lock = threading.Lock()   # send в канал из нескольких потоков
+        self.peers_version = None      # версия таблицы узлов, уже переданная исполнителю
+    
+    def send(self, command):
+        with self.lock:
+            self.channel.send(command)
+
+
+def run_worker(config_file, overrides, channel, listen_socket=None):
+    """Точка входа процесса-исполнителя (режим workers > 1)
+    
+    Исполнитель принимает соединения на общем порту, разбирает кадры и
+    передает новые сообщения главному процессу; рассылку выполняет для
+    узлов своего сегмента по командам главного процесса.
+    """
+    sys.stdout = open(os.devnull, 'w', encoding='utf-8')
+    messenger = NetworkMessenger(config_file, overrides=overrides, worker_channel=channel,
+                                 listen_socket=listen_socket)
+    messenger.console_output = False
+    if not messenger.start():
+        channel.send(('failed',))
+        return
+    channel.send(('ready', os.getpid()))
+    messenger.serve_supervisor()
+
+
 class NetworkMessenger:
-    def __init__(self, config_file="config.json"):
+    # Фоновая запись лога в файл, общая для всех узлов процесса
+    log_listener = None
+    
+    def __init__(self, config_file="config.json", overrides=None, worker_channel=None, listen_socket=None):
+        self.created_at = time.monotonic()
+        self.ready = threading.Event()   # сетевые сервисы запущены, узел принимает сообщения
+        self.startup_seconds = None
         self.setup_logging()  # Настройка логирования
         self.load_config(config_file)
+        self.config_overrides = dict(overrides or {})
+        self.config.update(self.config_overrides)
+        # Параметры перезапуска, как они заданы (self.config хранит фактические, например выбранный порт)
+        self.configured = {key: self.config.get(key) for key in self.RESTART_KEYS}
+        self.reload_requested = threading.Event()
+        # Процесс-исполнитель: канал к главному процессу и унаследованный слушающий сокет
+        self.worker_channel = worker_channel
+        self.worker_channel_lock = threading.Lock()
+        self.listen_socket = listen_socket
+        self.workers = []
+        logging.getLogger().setLevel(self.config['log_level'])
+        self.log_sample_every = max(1, int(self.config['log_sample_every']))
+        self.hot_events = itertools.count()
         self.running = True
-        self.peers = {}
-        self.messages = []
-        self.peers_lock = threading.Lock()
+        self.console_output = True  # в режиме демона терминал не используется
+        self.metrics = Metrics()
+        self.console = ConsoleRenderer(self.config['console_batch_interval'], self.config['console_max_pending'])
+        self.stopped = threading.Event()
+        self.peer_table = PeerTable(
+            self.config['peer_active_timeout'],
+            self.config['peer_idle_timeout'],
+            self.config['peer_expire_timeout']
+        )
+        # Подписки узла и индекс подписок остальных узлов
+        self.topic_index = TopicIndex()
+        self.subscriptions = set(
+            [topic for topic in self.config['subscriptions'] if valid_topic(topic)][:self.config['max_subscriptions']]
+        )
+        self.message_store = MessageStore(self.config['message_store_capacity'])
+        self.message_log = None
+        if self.config['persist_messages']:
+            self.open_message_log()
+        self.message_callbacks = []
         
-    def setup_logging(self):
-        """Настройка системы логирования - только в файл"""
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler('network_messenger.log', encoding='utf-8'),
-                # Убрали StreamHandler чтобы не выводить в консоль
-            ]
+        # Уникальные идентификаторы сообщений: идентификатор узла + счетчик
+        self.node_id = self.config.get('node_id') or uuid.uuid4().hex[:16]
+        
+        # 0.0.0.0 - адрес привязки, другим узлам нужен реальный адрес
+        self.advertise_host = self.config['advertise_host'] or (
+            self.config['host'] if self.config['host'] not in ('', '0.0.0.0') else detect_local_ip()
+        )
+        self.beacon_schedule = BeaconSchedule(
+            self.config['discovery_interval_min'],
+            self.config['discovery_interval_max'],
+            self.config['discovery_jitter']
+        )
+        self.discovery_wakeup = threading.Event()
+        self.async_discovery_wakeup = None
+        self.udp_reply_transport = None
+        self.local_registry = None
+        self.message_counter = itertools.count(1)
+        self.dedup = DedupCache(self.config['dedup_window'], self.config['dedup_max_entries'])
+        
+        # TLS: взаимная аутентификация узлов по сертификатам
+        self.tls_server = self.tls_client = None
+        if self.config['tls']:
+            self.tls_server, self.tls_client = self.create_tls_contexts()
+        
+        # Передача файлов: индекс файлов и источники, известные по уведомлениям
+        self.blob_store = None
+        self.blob_server = None
+        self.blob_port = 0
+        self.blob_holders = OrderedDict()   # blob_id -> [(host, blob_port)]
+        self.blob_holders_lock = threading.Lock()
+        if self.config['file_transfer']:
+            self.blob_store = BlobStore(self.config['blob_dir'], self.config['blob_chunk_size'], logger=self.logger)
+        
+        self.pool = ConnectionPool(
+            max_size=self.config['pool_max_size'],
+            idle_timeout=self.config['pool_idle_timeout'],
+            backoff_max=self.config['reconnect_backoff_max'],
+            ssl_context=self.tls_client,
+            logger=self.logger
+        )
+        self.send_executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.config['send_workers'],
+            thread_name_prefix='sender'
         )
+        self.pending_sends = 0   # отправки в очереди пула и в работе
+        self.pending_sends_lock = threading.Lock()
+        
+        # Входящие сообщения обрабатываются из ограниченной очереди
+        self.inbound = queue.Queue(maxsize=self.config['inbound_queue_size'])
+        self.inbound_high_water = max(1, int(self.config['inbound_queue_size'] * 0.8))
+        self.inbound_low_water = self.config['inbound_queue_size'] // 2
+        self.paused_protocols = set()   # соединения asyncio с приостановленным чтением
+        self.resume_scheduled = False
+        self.rate_limiter = RateLimiter(self.config['peer_rate_limit'], self.config['peer_rate_burst'])
+        self.probe_limiter = RateLimiter(self.config['probe_reply_rate'], self.config['probe_reply_burst'])
+        self.shedder = LoadShedder(logger=self.logger)
+        self.connections = 0
+        self.connections_lock = threading.Lock()
+        self.loop_thread = None
+        
+        # Подтверждения доставки: накопленные ACK по узлам и повторы своих сообщений
+        self.pending_acks = {}
+        self.acks_lock = threading.Lock()
+        self.acks_ready = threading.Event()
+        self.reliable = None
+        if self.config['reliable_delivery']:
+            self.reliable = ReliableSender(
+                self.resend,
+                self.peer_reachable,
+                ack_timeout=self.config['ack_timeout'],
+                backoff_max=self.config['retry_backoff_max'],
+                max_retries=self.config['max_retries'],
+                pending_per_peer=self.config['unacked_max_per_peer'],
+                outbox_per_peer=self.config['outbox_max_per_peer'],
+                outbox_total=self.config['outbox_max_total'],
+                on_drop=lambda peer, message_id: self.shedder.record(LoadShedder.OUTBOX_FULL, peer, message_id),
+                logger=self.logger
+            )
+        self.register_metrics()
+        
+        self.batch_sender = None
+        if self.config['batching']:
+            self.batch_sender = BatchSender(
+                self.send_batch_frame,
+                self.send_executor,
+                max_messages=self.config['batch_max_messages'],
+                max_bytes=self.config['batch_max_bytes'],
+                max_delay=self.config['batch_max_delay'],
+                compression_for=self.compression_for,
+                compress_min_bytes=self.config['compress_min_bytes'],
+                logger=self.logger
+            )
+        
+    def setup_logging(self):
+        """Настройка системы логирования - только в файл, запись в фоновом потоке"""
+        if NetworkMessenger.log_listener is None and not logging.getLogger().handlers:
+            file_handler = logging.FileHandler('network_messenger.log', encoding='utf-8')
+            file_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(message)s'))
+            
+            # Сетевые потоки только кладут запись в очередь, на диск пишет QueueListener
+            log_queue = queue.SimpleQueue()
+            logging.basicConfig(
+                level=logging.INFO,
+                format='%(message)s',  # время и уровень добавляет file_handler
+                handlers=[
+                    logging.handlers.QueueHandler(log_queue),
+                    # Убрали StreamHandler чтобы не выводить в консоль
+                ]
+            )
+            NetworkMessenger.log_listener = logging.handlers.QueueListener(log_queue, file_handler)
+            NetworkMessenger.log_listener.start()
+            atexit.register(NetworkMessenger.stop_log_listener)
         self.logger = logging.getLogger(__name__)
         self.logger.info("Инициализация сетевого мессенджера")
     
+    @staticmethod
+    def stop_log_listener():
+        """Запись оставшихся в очереди записей лога и остановка фонового потока"""
+        listener, NetworkMessenger.log_listener = NetworkMessenger.log_listener, None
+        if listener is not None:
+            listener.stop()
+    
+    def hot_log_enabled(self):
+        """Нужно ли писать частое событие (каждое log_sample_every-е при уровне INFO)"""
+        if not self.logger.isEnabledFor(logging.INFO):
+            return False
+        return self.log_sample_every == 1 or next(self.hot_events) % self.log_sample_every == 0
+    
     def load_config(self, config_file):
         """Загрузка конфигурационных параметров"""
+        self.config_file = config_file
+        self.config_mtime = self.config_stat()
+        self.config = self.read_config(config_file)
+        print(f"Параметры: {self.config}")
+    
+    def read_config(self, config_file, reload=False):
+        """Параметры по умолчанию, дополненные файлом; при перечитывании ошибка - None"""
         default_config = {
             "host": "0.0.0.0",
             "port": 8888,
-            "discovery_port": 8889
+            "discovery_port": 8889,
+            "server_mode": "threads",  # threads | asyncio
+            "max_frame_size": 16 * 1024 * 1024,
+            "connection_idle_timeout": 60.0,  # закрытие входящих соединений без данных
+            "pool_max_size": 64,
+            "pool_idle_timeout": 30.0,
+            "reconnect_backoff_max": 30.0,
+            "send_workers": 16,          # потоков параллельной рассылки
+            "broadcast_deadline": 3.0,   # общий дедлайн рассылки, секунд
+            "message_store_capacity": 10000,
+            "persist_messages": False,   # журнал сообщений на диске
+            "message_log_dir": "message_log",
+            "log_segment_bytes": 16 * 1024 * 1024,
+            "log_fsync_interval": 1.0,
+            "log_retention_segments": 0,  # 0 - хранить все сегменты
+            "dedup_window": 300.0,        # секунд хранения message_id
+            "dedup_max_entries": 100000,
+            "discovery_enabled": True,
+            "dissemination": "mesh",     # mesh - всем узлам, gossip - случайным k узлам
+            "gossip_fanout": 4,
+            "gossip_ttl": 6,
+            "peer_active_timeout": 30.0,   # узел получает сообщения
+            "peer_idle_timeout": 60.0,     # узел отображается в списке
+            "peer_expire_timeout": 300.0,  # узел удаляется из таблицы
+            "codecs": ["bin1", "json"],    # кодеки сообщений в порядке предпочтения
+            "batching": False,             # объединение сообщений в пакеты
+            "batch_max_messages": 64,
+            "batch_max_bytes": 65536,
+            "batch_max_delay": 0.005,      # секунд ожидания до отправки пакета
+            "compression": "zlib",         # zlib | lzma | none - для крупных пакетов
+            "compress_min_bytes": 1024,
+            "accept_backlog": 1024,        # очередь ожидающих accept подключений
+            "max_connections": 1024,       # одновременных входящих соединений
+            "inbound_queue_size": 10000,   # сообщений, ожидающих обработки
+            "inbound_put_timeout": 0.5,    # ожидание места в очереди (режим threads)
+            "inbound_workers": 1,          # потоков обработки (1 - сохраняет порядок)
+            "peer_rate_limit": 0.0,        # сообщений в секунду с одного адреса, 0 - без лимита
+            "peer_rate_burst": 500,
+            "log_level": "INFO",           # DEBUG | INFO | WARNING | ERROR
+            "log_sample_every": 1,         # писать в лог каждое N-е частое событие
+            "console_batch_interval": 0.05,  # секунд накопления вывода в терминал
+            "console_max_pending": 1000,
+            "metrics_file": "",            # файл для периодического снимка метрик (JSON)
+            "metrics_dump_interval": 60.0,
+            "metrics_port": 0,             # HTTP /metrics в формате Prometheus, 0 - выключен
+            "metrics_host": "127.0.0.1",
+            "advertise_host": "",          # адрес для других узлов (по умолчанию - определяется)
+            "discovery_interval_min": 0.5,   # секунд между beacon при изменениях сети
+            "discovery_interval_max": 10.0,  # в стабильной сети
+            "discovery_jitter": 0.25,      # случайный разброс интервала (доля)
+            "discovery_broadcast": True,
+            "discovery_multicast_group": "",  # например 239.255.88.89
+            "discovery_multicast_ttl": 1,
+            "discovery_seeds": [],         # известные узлы "host:port" (порт discovery)
+            "probe_reply_rate": 1.0,       # ответов на probe в секунду одному адресу
+            "probe_reply_burst": 5,
+            "local_registry": True,        # каталог узлов этого хоста для мгновенного обнаружения
+            "local_registry_dir": "",      # по умолчанию - XDG_RUNTIME_DIR или временный каталог пользователя
+            "port_search_range": 20,       # сколько портов подряд пробовать, затем - любой свободный
+            "workers": 1,                  # процессов приема и рассылки (больше 1 - на все ядра)
+            "reliable_delivery": False,    # подтверждения (ACK), повторы и outbox
+            "ack_timeout": 2.0,            # первая пауза до повтора без ACK, секунд
+            "ack_delay": 0.01,             # накопление ACK перед отправкой, секунд
+            "retry_backoff_max": 30.0,
+            "max_retries": 8,              # затем сообщение ждет в outbox нового обнаружения узла
+            "unacked_max_per_peer": 1000,  # сообщений без ACK на узел, сверх - вытесняются старые
+            "outbox_max_per_peer": 1000,
+            "outbox_max_total": 10000,
+            "subscriptions": [],           # темы, на которые подписан узел
+            "max_subscriptions": 64,       # ограничение размера beacon
+            "tls": False,                  # TLS с взаимной проверкой сертификатов для TCP
+            "tls_cert": "",                # сертификат узла (PEM)
+            "tls_key": "",                 # закрытый ключ узла (PEM)
+            "tls_ca": "",                  # CA кластера или доверенные сертификаты узлов (по умолчанию tls_cert)
+            "tls_handshake_timeout": 5.0,
+            "file_transfer": False,        # раздача и загрузка файлов по частям
+            "blob_dir": "blobs",           # индекс своих файлов и незавершенные загрузки
+            "blob_port": 0,                # порт раздачи файлов (0 - любой свободный)
+            "blob_chunk_size": 1048576,
+            "blob_parallel": 4,            # параллельных загрузок частей
+            "blob_timeout": 10.0,
+            "maintenance_interval": 30.0,  # очистка таблицы узлов, секунд
+            "status_log_interval": 60.0,   # периодическая запись статуса в лог
+            "config_watch_interval": 2.0   # проверка изменения файла конфигурации (0 - только SIGHUP)
         }
         
         try:
             if os.path.exists(config_file):
                 with open(config_file, 'r', encoding='utf-8') as f:
                     loaded_config = json.load(f)
-                    self.config = {**default_config, **loaded_config}
+                    config = {**default_config, **loaded_config}
                 self.logger.info(f"Конфигурация загружена из {config_file}")
+            elif reload:
+                self.logger.error(f"Файл конфигурации {config_file} не найден")
+                return None
             else:
-                self.config = default_config
+                config = default_config
                 self.logger.info("Используются значения по умолчанию")
                 
                 # Сохраняем дефолтную конфигурацию
@@ -53,33 +2770,147 @@ class NetworkMessenger:
                     
         except Exception as e:
             self.logger.error(f"Ошибка загрузки конфигурации: {e}")
-            self.config = default_config
-            
-        print(f"Параметры: {self.config}")
+            if reload:
+                return None
+            config = default_config
+        return config
+    
+    # Параметры, которые действуют только с перезапуска: сокеты, процессы, пулы потоков
+    RESTART_KEYS = {
+        "host", "port", "discovery_port", "server_mode", "accept_backlog", "send_workers",
+        "inbound_workers", "workers", "discovery_enabled", "discovery_multicast_group",
+        "local_registry", "local_registry_dir", "port_search_range", "advertise_host", "node_id",
+        "persist_messages", "message_log_dir", "log_segment_bytes", "log_fsync_interval",
+        "log_retention_segments", "message_store_capacity", "metrics_port", "metrics_host",
+        "metrics_file", "batching", "reliable_delivery", "tls", "tls_cert", "tls_key", "tls_ca",
+        "file_transfer", "blob_dir", "blob_port"
+    }
+    
+    def config_stat(self):
+        """Время изменения и размер файла конфигурации (None - файла нет)"""
+        try:
+            stat = os.stat(self.config_file)
+        except OSError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+    
+    def config_watch_loop(self):
+        """Перечитывание конфигурации при изменении файла или по SIGHUP"""
+        while self.running:
+            interval = self.config['config_watch_interval']
+            requested = self.reload_requested.wait(interval if interval > 0 else None)
+            if not self.running:
+                break
+            self.reload_requested.clear()
+            stat = self.config_stat()
+            if requested or stat != self.config_mtime:
+                self.config_mtime = stat
+                self.reload_config()
+    
+    def request_reload(self, signum=None, frame=None):
+        """Обработчик SIGHUP: перечитывание выполняет поток наблюдения, не обработчик сигнала"""
+        self.reload_requested.set()
+    
+    def reload_config(self):
+        """Применение изменений файла конфигурации без перезапуска, возвращает измененные ключи
+        
+        Таблица узлов, соединения и сокеты сохраняются; параметры из
+        RESTART_KEYS остаются прежними до перезапуска.
+        """
+        config = self.read_config(self.config_file, reload=True)
+        if config is None:
+            return set()
+        config.update(self.config_overrides)
+        # Параметры перезапуска сравниваем с заданными при запуске, а не с фактическими
+        deferred = {key for key in self.RESTART_KEYS if config.get(key) != self.configured[key]}
+        for key in self.RESTART_KEYS:
+            if key in self.config:
+                config[key] = self.config[key]
+            else:
+                config.pop(key, None)
+        changed = {key for key, value in config.items() if self.config.get(key) != value}
+        if deferred:
+            self.logger.warning(f"Требуют перезапуска (не применены): {', '.join(sorted(deferred))}")
+        if not changed:
+            return changed
+        # Обновление на месте: компоненты, читающие self.config при каждом использовании, видят новые значения сразу
+        self.config.update(config)
+        try:
+            self.apply_config(changed)
+        except Exception as e:
+            self.logger.error(f"Ошибка применения конфигурации: {e}", exc_info=True)
+        self.logger.info(f"Конфигурация перечитана, изменено: {', '.join(sorted(changed))}")
+        return changed
+    
+    def apply_config(self, changed):
+        """Передача новых значений компонентам, которые хранят свои копии параметров"""
+        config = self.config
+        if changed & {"peer_active_timeout", "peer_idle_timeout", "peer_expire_timeout"}:
+            self.peer_table.configure(config['peer_active_timeout'], config['peer_idle_timeout'],
+                                      config['peer_expire_timeout'])
+        if changed & {"discovery_interval_min", "discovery_interval_max", "discovery_jitter", "discovery_seeds",
+                      "discovery_broadcast"}:
+            self.beacon_schedule.min_interval = config['discovery_interval_min']
+            self.beacon_schedule.max_interval = config['discovery_interval_max']
+            self.beacon_schedule.jitter = config['discovery_jitter']
+            self.topology_changed()
+        if "log_level" in changed:
+            logging.getLogger().setLevel(config['log_level'])
+        if "log_sample_every" in changed:
+            self.log_sample_every = max(1, int(config['log_sample_every']))
+        if changed & {"peer_rate_limit", "peer_rate_burst"}:
+            self.rate_limiter.rate = config['peer_rate_limit']
+            self.rate_limiter.burst = config['peer_rate_burst']
+        if changed & {"probe_reply_rate", "probe_reply_burst"}:
+            self.probe_limiter.rate = config['probe_reply_rate']
+            self.probe_limiter.burst = config['probe_reply_burst']
+        if "inbound_queue_size" in changed:
+            with self.inbound.mutex:
+                self.inbound.maxsize = config['inbound_queue_size']
+                self.inbound.not_full.notify_all()
+            self.inbound_high_water = max(1, int(config['inbound_queue_size'] * 0.8))
+            self.inbound_low_water = config['inbound_queue_size'] // 2
+        if changed & {"pool_max_size", "pool_idle_timeout", "reconnect_backoff_max"}:
+            self.pool.max_size = config['pool_max_size']
+            self.pool.idle_timeout = config['pool_idle_timeout']
+            self.pool.backoff_max = config['reconnect_backoff_max']
+        if changed & {"dedup_window", "dedup_max_entries"}:
+            self.dedup.window = config['dedup_window']
+            self.dedup.max_entries = config['dedup_max_entries']
+        if self.batch_sender is not None:
+            self.batch_sender.max_messages = config['batch_max_messages']
+            self.batch_sender.max_bytes = config['batch_max_bytes']
+            self.batch_sender.max_delay = config['batch_max_delay']
+            self.batch_sender.compress_min_bytes = config['compress_min_bytes']
+        if self.reliable is not None:
+            self.reliable.ack_timeout = config['ack_timeout']
+            self.reliable.backoff_max = config['retry_backoff_max']
+            self.reliable.max_retries = config['max_retries']
+            self.reliable.pending_per_peer = config['unacked_max_per_peer']
+            self.reliable.outbox_per_peer = config['outbox_max_per_peer']
+            self.reliable.outbox_total = config['outbox_max_total']
+        if changed & {"console_batch_interval", "console_max_pending"}:
+            self.console.interval = config['console_batch_interval']
+            self.console.max_pending = config['console_max_pending']
+        if "blob_chunk_size" in changed and self.blob_store is not None:
+            self.blob_store.chunk_size = config['blob_chunk_size']
+        if changed & {"subscriptions", "max_subscriptions"}:
+            topics = {topic for topic in config['subscriptions'] if valid_topic(topic)}
+            for topic in self.subscriptions - topics:
+                self.unsubscribe(topic)
+            for topic in sorted(topics - self.subscriptions):
+                try:
+                    self.subscribe(topic)
+                except ValueError as e:
+                    self.logger.warning(f"Подписка на {topic} не применена: {e}")
     
     def start_tcp_server(self):
         """Инициализация TCP сервера для приема сообщений"""
         try:
-            self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            
-            # Автоподбор порта
-            port = self.config['port']
-            for p in range(port, port + 20):
-                try:
-                    self.tcp_socket.bind((self.config['host'], p))
-                    self.config['port'] = p
-                    self.logger.info(f"TCP сервер на порту {p}")
-                    print(f"TCP сервер на порту {p}")
-                    break
-                except OSError as e:
-                    if p == port + 19:
-                        self.logger.error(f"Не удалось найти свободный порт: {e}")
-                        print(f"Ошибка: не удалось найти свободный порт")
-                        return False
-                    continue
+            if not self.bind_tcp_socket():
+                return False
             
-            self.tcp_socket.listen(5)
+            self.tcp_socket.listen(self.config['accept_backlog'])
             self.tcp_socket.settimeout(1.0)
             
             server_thread = threading.Thread(target=self.accept_connections, daemon=True)
@@ -94,12 +2925,76 @@ class NetworkMessenger:
             print(f"Ошибка инициализации TCP: {e}")
             return False
     
+    def bind_tcp_socket(self):
+        """Создание TCP сокета и привязка к свободному порту"""
+        if self.listen_socket is not None:
+            # Исполнитель без SO_REUSEPORT принимает соединения на сокете главного процесса
+            self.tcp_socket = self.listen_socket
+            return True
+        
+        self.tcp_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if self.reuse_port_supported() and (self.config['workers'] > 1 or self.worker_channel is not None):
+            # Ядро распределяет входящие соединения между процессами узла
+            self.tcp_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+        
+        # Автоподбор порта: сначала заданный диапазон, затем любой свободный от ОС
+        port = self.config['port']
+        candidates = list(range(port, port + self.config['port_search_range'])) + [0]
+        if self.worker_channel is not None:
+            candidates = [port]  # исполнитель работает строго на порту главного процесса
+        for p in candidates:
+            try:
+                self.tcp_socket.bind((self.config['host'], p))
+            except OSError as e:
+                last_error = e
+                continue
+            self.config['port'] = self.tcp_socket.getsockname()[1]
+            if p == 0:
+                self.logger.warning(f"Порты {port}-{candidates[-2]} заняты, выбран порт {self.config['port']}")
+            self.logger.info(f"TCP сервер на порту {self.config['port']}")
+            print(f"TCP сервер на порту {self.config['port']}")
+            return True
+        
+        self.logger.error(f"Не удалось найти свободный порт: {last_error}")
+        print(f"Ошибка: не удалось найти свободный порт")
+        return False
+    
+    def create_tls_contexts(self):
+        """Контексты TLS сервера и клиента с сертификатом узла, возвращает (server, client)"""
+        cert, key = self.config['tls_cert'], self.config['tls_key'] or None
+        ca = self.config['tls_ca'] or cert
+        contexts = []
+        for purpose in (ssl.PROTOCOL_TLS_SERVER, ssl.PROTOCOL_TLS_CLIENT):
+            context = ssl.SSLContext(purpose)
+            context.minimum_version = ssl.TLSVersion.TLSv1_2
+            context.load_cert_chain(cert, key)
+            context.load_verify_locations(ca)
+            # Узлы адресуются по IP, имя в сертификате не сверяем - доверие задает CA кластера
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_REQUIRED
+            contexts.append(context)
+        self.logger.info(f"TLS включен: сертификат {cert}, доверенные {ca}")
+        return tuple(contexts)
+    
+    def tls_accepted(self, ssl_object, address):
+        """Учет входящего рукопожатия TLS"""
+        resumed = ssl_object.session_reused
+        self.metrics.inc('tls_handshakes_total', labels=(('side', 'server'), ('resumed', str(resumed).lower())))
+        if self.hot_log_enabled():
+            subject = dict(item[0] for item in (ssl_object.getpeercert() or {}).get('subject', ()))
+            self.logger.info(f"TLS соединение от {address}: {subject.get('commonName', '?')}, "
+                             f"{ssl_object.version()}{', сессия возобновлена' if resumed else ''}")
+    
     def accept_connections(self):
         """Обработка входящих подключений"""
         self.logger.info("Начало приема подключений")
         while self.running:
             try:
                 client_socket, address = self.tcp_socket.accept()
+                if not self.connection_opened(address):
+                    client_socket.close()
+                    continue
                 client_thread = threading.Thread(
                     target=self.handle_client,
                     args=(client_socket, address),
@@ -116,51 +3011,36 @@ class NetworkMessenger:
     
     def handle_client(self, client_socket, address):
         """Обработка клиентского соединения"""
+        decoder = FrameDecoder(max_frame_size=self.config['max_frame_size'])
         try:
-            client_socket.settimeout(5.0)
-            data = client_socket.recv(4096)
+            if self.tls_server is not None:
+                client_socket.settimeout(self.config['tls_handshake_timeout'])
+                client_socket = self.tls_server.wrap_socket(client_socket, server_side=True)
+                self.tls_accepted(client_socket, address)
+            client_socket.settimeout(self.config['connection_idle_timeout'])
             
-            if data:
+            # Читаем поток кадров прямо в буфер декодера
+            while self.running:
                 try:
-                    message_data = json.loads(data.decode('utf-8'))
-                    text = message_data.get('text', '')
-                    sender = message_data.get('sender', f'{address[0]}:{address[1]}')
-                    timestamp = message_data.get('timestamp', datetime.now().isoformat())
-                    
-                    # Форматируем время
-                    try:
-                        msg_time = datetime.fromisoformat(timestamp).strftime('%Y-%m-%d %H:%M:%S')
-                    except:
-                        msg_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    
-                    display_msg = f"[{msg_time}] {sender}: {text}"
-                    print(f"\n{display_msg}")
-                    self.messages.append(display_msg)
-                    
-                    # Сохраняем как активного пира
-                    with self.peers_lock:
-                        if ':' in sender:
-                            host, port = sender.split(':')
-                            try:
-                                self.peers[(host, int(port))] = time.time()
-                            except:
-                                self.peers[(address[0], address[1])] = time.time()
-                    
-                    self.logger.info(f"Получено сообщение от {sender}")
-                    
-                except json.JSONDecodeError:
-                    # Если не JSON, обрабатываем как plain text
-                    text = data.decode('utf-8', errors='ignore')
-                    timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-                    display_msg = f"[{timestamp}] {address[0]}:{address[1]}: {text}"
-                    print(f"\n{display_msg}")
-                    self.messages.append(display_msg)
-                    
-                    with self.peers_lock:
-                        self.peers[(address[0], address[1])] = time.time()
-                    
-                    self.logger.info(f"Получено plain text от {address}")
+                    nbytes = client_socket.recv_into(decoder.get_buffer())
+                except socket.timeout:
+                    break
+                if not nbytes:
+                    break
+                self.metrics.inc('received_bytes_total', nbytes)
+                for flags, payload in decoder.buffer_updated(nbytes):
+                    self.process_frame(flags, payload, address)
+            
+            # Сообщение старого формата (без кадра) заканчивается закрытием соединения
+            legacy = decoder.finish()
+            if legacy is not None:
+                self.process_incoming(legacy, address)
                     
+        except FrameError as e:
+            self.logger.error(f"Ошибка протокола от {address}: {e}")
+        except ssl.SSLError as e:
+            self.metrics.inc('tls_failures_total')
+            self.logger.warning(f"Отклонено TLS соединение от {address}: {e}")
         except Exception as e:
             self.logger.error(f"Ошибка обработки клиента {address}: {e}")
         finally:
@@ -168,28 +3048,704 @@ class NetworkMessenger:
                 client_socket.close()
             except:
                 pass
+            self.connection_closed()
+    
+    def connection_opened(self, address):
+        """Учет нового входящего соединения; False - превышен лимит"""
+        with self.connections_lock:
+            if self.connections >= self.config['max_connections']:
+                limited = True
+            else:
+                self.connections += 1
+                limited = False
+        if limited:
+            self.shedder.record(LoadShedder.CONNECTION_LIMIT, address)
+        return not limited
+    
+    def connection_closed(self):
+        with self.connections_lock:
+            self.connections -= 1
+    
+    def dispatch(self, message_data, address, framed=False):
+        """Постановка сообщения в очередь обработки с учетом лимитов"""
+        if not self.rate_limiter.allow(address[0]):
+            self.shedder.record(LoadShedder.RATE_LIMIT, address, message_data.get('message_id'))
+            return False
+        try:
+            if threading.current_thread() is self.loop_thread:
+                # Цикл событий блокировать нельзя - от перегрузки защищает pause_reading
+                self.inbound.put_nowait((message_data, address, framed))
+            else:
+                # Поток соединения ждет места: отправитель упирается в окно TCP
+                self.inbound.put((message_data, address, framed), timeout=self.config['inbound_put_timeout'])
+        except queue.Full:
+            self.shedder.record(LoadShedder.QUEUE_FULL, address, message_data.get('message_id'))
+            return False
+        return True
+    
+    def inbound_congested(self):
+        return self.inbound.qsize() >= self.inbound_high_water
+    
+    def pause_protocol(self, protocol):
+        """Приостановка чтения соединения до разгрузки очереди (asyncio)"""
+        if protocol not in self.paused_protocols:
+            protocol.pause()
+            self.paused_protocols.add(protocol)
+    
+    def resume_protocols(self):
+        """Дообработка отложенных сообщений и возобновление чтения (в цикле событий)"""
+        self.resume_scheduled = False
+        if self.inbound.qsize() > self.inbound_low_water:
+            return
+        for protocol in list(self.paused_protocols):
+            if not protocol.resume():
+                break
+            self.paused_protocols.discard(protocol)
+    
+    def process_inbound(self):
+        """Поток обработки входящих сообщений из очереди"""
+        while self.running:
+            try:
+                message_data, address, framed = self.inbound.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            try:
+                if self.worker_channel is not None:
+                    self.forward_message(message_data, address, framed)
+                else:
+                    self.handle_message(message_data, address, framed)
+            except Exception as e:
+                self.logger.error(f"Ошибка обработки сообщения от {address}: {e}", exc_info=True)
+            
+            if (self.paused_protocols and not self.resume_scheduled
+                    and self.inbound.qsize() <= self.inbound_low_water):
+                self.resume_scheduled = True
+                try:
+                    self.loop.call_soon_threadsafe(self.resume_protocols)
+                except RuntimeError:
+                    pass  # цикл событий уже остановлен
+    
+    def process_frame(self, flags, payload, address):
+        """Обработка одного кадра протокола"""
+        for message_data in self.decode_frame(flags, payload, address):
+            self.dispatch(message_data, address, framed=True)
+    
+    def decode_frame(self, flags, payload, address):
+        """Сообщения кадра (пакет - несколько); при ошибке кадр пропускается"""
+        codec = CODECS_BY_ID.get(flags & FRAME_CODEC_MASK)
+        if codec is None:
+            self.logger.warning(f"Кадр с неизвестным кодеком {flags & FRAME_CODEC_MASK} от {address}")
+            return []
+        try:
+            if flags & FRAME_COMPRESSION_MASK:
+                payload = decompress_payload(flags, payload, self.config['max_frame_size'])
+            if flags & FLAG_BATCH:
+                return [codec.decode(item) for item in iter_batch(payload)]
+            return [codec.decode(payload)]
+        except (ValueError, struct.error, IndexError, zlib.error, lzma.LZMAError) as e:
+            # Границы кадров не нарушены - пропускаем только этот кадр
+            self.logger.warning(f"Ошибка декодирования ({codec.name}) от {address}: {e}")
+            return []
+    
+    def process_incoming(self, data, address, framed=False):
+        """Разбор сообщения без кадра: JSON или простой текст"""
+        try:
+            message_data = json.loads(str(data, 'utf-8'))
+        except json.JSONDecodeError:
+            # Если не JSON, обрабатываем как plain text
+            if self.hot_log_enabled():
+                self.logger.info(f"Получено plain text от {address}")
+            message_data = {
+                "type": "message",
+                "text": str(data, 'utf-8', errors='ignore'),
+                "sender": f"{address[0]}:{address[1]}"
+            }
+        
+        self.dispatch(message_data, address, framed)
+    
+    def handle_message(self, message_data, address, framed=False):
+        """Обработка разобранного сообщения (общая для всех форматов)"""
+        if message_data.get('type') == 'ack':
+            self.process_ack(message_data)
+            return
+        
+        text = message_data.get('text', '')
+        sender = message_data.get('sender', f'{address[0]}:{address[1]}')
+        
+        # Подтверждаем и повторы: прежний ACK мог потеряться
+        if message_data.get('ack') and message_data.get('message_id') is not None:
+            self.queue_ack(message_data.get('via') or sender, message_data['message_id'])
+        
+        # Повторы и копии, пришедшие разными путями, отбрасываем
+        if self.is_duplicate(message_data.get('message_id'), sender):
+            self.metrics.inc('duplicates_total')
+            self.logger.debug(f"Дубликат сообщения {message_data.get('message_id')} от {sender}")
+            return
+        timestamp = message_data.get('timestamp')
+        
+        # Время отправителя в epoch секундах (двоичный кодек передает число)
+        if isinstance(timestamp, (int, float)):
+            msg_time = float(timestamp)
+        else:
+            try:
+                msg_time = datetime.fromisoformat(timestamp).timestamp()
+            except:
+                msg_time = time.time()
+        
+        self.metrics.inc('received_messages_total')
+        topic = message_data.get('topic')
+        if topic is not None and topic not in self.subscriptions:
+            # Отправитель судил о подписке по устаревшему beacon: не показываем, но передаем дальше
+            ttl = message_data.get('ttl')
+            if isinstance(ttl, int) and ttl > 1:
+                self.relay_message(message_data)
+            return
+        blob_id = message_data.get('blob_id')
+        if isinstance(blob_id, str) and isinstance(message_data.get('blob_port'), int) and ':' in sender:
+            # Уведомление о файле: отправитель - источник для загрузки
+            self.add_blob_holder(blob_id, (sender.rpartition(':')[0], message_data['blob_port']))
+        record = self.record_message(sender, text, message_data.get('message_id'), msg_time)
+        if self.console_output:
+            if topic is not None:
+                self.console.show(f"#{topic} {record.render()}")
+            elif message_data.get('to'):
+                self.console.show(f"(лично) {record.render()}")
+            else:
+                self.console.show(record)
+        
+        # Сохраняем как активного пира узел, от которого сообщение пришло напрямую:
+        # источник пересланного (gossip) сообщения может быть недостижим
+        peer = message_data.get('via') or sender
+        if isinstance(peer, str) and ':' in peer:
+            host, port = peer.split(':')
+            try:
+                self.peer_table.touch((host, int(port)), PROTOCOL_VERSION if framed else None)
+                self.peer_seen((host, int(port)))
+            except:
+                self.peer_table.touch((address[0], address[1]))
+        
+        if self.hot_log_enabled():
+            self.logger.info(f"Получено сообщение от {sender}")
+        self.notify_message(message_data, address)
+        
+        # Gossip: новое сообщение с оставшимся TTL передаем дальше
+        ttl = message_data.get('ttl')
+        if isinstance(ttl, int) and ttl > 1:
+            self.relay_message(message_data)
+    
+    def queue_ack(self, peer, message_id):
+        """ACK накапливаются и отправляются узлу одним сообщением"""
+        try:
+            peer = parse_endpoint(peer, None)
+        except ValueError:
+            return
+        if peer[1] is None:
+            return
+        with self.acks_lock:
+            self.pending_acks.setdefault(peer, []).append(message_id)
+        self.acks_ready.set()
+    
+    def ack_loop(self):
+        """Поток отправки накопленных ACK"""
+        while self.running:
+            if not self.acks_ready.wait(1.0):
+                continue
+            # Короткое окно накопления: ACK на пачку сообщений - одним кадром
+            time.sleep(self.config['ack_delay'])
+            self.acks_ready.clear()
+            with self.acks_lock:
+                acks, self.pending_acks = self.pending_acks, {}
+            deadline_at = time.monotonic() + self.config['broadcast_deadline']
+            for peer, ids in acks.items():
+                message = OutgoingMessage({"type": "ack", "ids": ids, "sender": self.node_address()})
+                try:
+                    self.submit_delivery(peer, message, deadline_at)
+                except RuntimeError:
+                    return  # пул отправки остановлен
+    
+    def process_ack(self, message_data):
+        """Подтверждение доставки от узла"""
+        if self.reliable is None:
+            return
+        ids = message_data.get('ids')
+        try:
+            peer = parse_endpoint(message_data.get('sender'), None)
+        except ValueError:
+            return
+        if isinstance(ids, list) and peer[1] is not None:
+            self.reliable.acknowledge(peer, ids)
+            self.metrics.inc('acks_received_total', len(ids))
+    
+    def peer_reachable(self, peer):
+        """Узел известен и не помечен недоступным"""
+        info = self.peer_table.get(peer)
+        return info is not None and info.state != PeerTable.STALE
+    
+    def peer_seen(self, peer):
+        """Узел снова доступен - отправляем ему сообщения из outbox"""
+        if self.reliable is not None and self.reliable.has_backlog(peer):
+            # Пауза переподключения после прежних ошибок больше не нужна
+            self.pool.backoff.pop(peer, None)
+            self.reliable.peer_online(peer)
+    
+    def submit_delivery(self, peer, message, deadline_at):
+        """Отправка сообщения узлу в пуле потоков с учетом числа ожидающих отправок"""
+        with self.pending_sends_lock:
+            self.pending_sends += 1
+        try:
+            future = self.send_executor.submit(self.deliver, peer, message, deadline_at)
+        except RuntimeError:
+            self.send_done()
+            raise
+        future.add_done_callback(self.send_done)
+        return future
+    
+    def send_done(self, future=None):
+        with self.pending_sends_lock:
+            self.pending_sends -= 1
+    
+    def resend(self, peer, message):
+        """Повторная отправка сообщения узлу (без ожидания результата)"""
+        self.metrics.inc('retries_total')
+        deadline_at = time.monotonic() + self.config['broadcast_deadline']
+        self.submit_delivery(peer, message, deadline_at).add_done_callback(
+            # SKIPPED - узел в паузе переподключения, повтор будет по таймауту ACK
+            lambda future: future.cancelled()
+            or future.result().status in (DeliveryResult.OK, DeliveryResult.SKIPPED)
+            or self.peer_table.mark_failed(peer)
+        )
+    
+    def register_metrics(self):
+        """Описание метрик и показателей, снимаемых при запросе"""
+        describe = self.metrics.describe
+        describe('received_bytes_total', "Принято байт по TCP")
+        describe('received_messages_total', "Принято новых сообщений")
+        describe('duplicates_total', "Отброшено повторных копий сообщений")
+        describe('sent_messages_total', "Отправлено сообщений")
+        describe('sent_bytes_total', "Отправлено байт по TCP")
+        describe('send_failures_total', "Ошибки отправки по типу")
+        describe('discovery_beacons_total', "Получено discovery-сообщений")
+        describe('probe_replies_limited_total', "Не отправлено ответов на probe сверх лимита")
+        describe('send_latency_seconds', "Время отправки сообщения или пакета узлу")
+        
+        gauge = self.metrics.gauge
+        gauge('peers', lambda: {(('state', state),): self.peer_table.count(state)
+                                for state in (PeerTable.ACTIVE, PeerTable.IDLE, PeerTable.STALE)},
+              "Известные узлы по состоянию")
+        gauge('queue_depth', lambda: {
+            (('queue', 'inbound'),): self.inbound.qsize(),
+            (('queue', 'console'),): len(self.console.pending),
+            (('queue', 'batch'),): self.batch_sender.pending() if self.batch_sender is not None else 0,
+            (('queue', 'send'),): self.pending_sends
+        }, "Глубина внутренних очередей")
+        gauge('inbound_connections', lambda: self.connections, "Открытые входящие соединения")
+        gauge('pooled_connections', lambda: len(self.pool), "Исходящие соединения в пуле")
+        gauge('shed_total', lambda: {(('reason', reason),): count
+                                     for reason, count in self.shedder.snapshot().items()},
+              "Сброшено из-за перегрузки по причине")
+        gauge('threads', threading.active_count, "Число потоков процесса")
+        gauge('asyncio_tasks', self.count_async_tasks, "Задачи цикла событий asyncio")
+        gauge('message_store_size', lambda: len(self.message_store), "Сообщений в журнале в памяти")
+        gauge('ready', lambda: int(self.ready.is_set()), "Узел запущен и принимает сообщения")
+        gauge('startup_seconds', lambda: self.startup_seconds or 0.0, "Время от создания узла до готовности")
+        describe('acks_received_total', "Получено подтверждений доставки")
+        describe('retries_total', "Повторных отправок без подтверждения")
+        describe('blob_bytes_sent_total', "Отдано байт файлов")
+        describe('blob_bytes_received_total', "Загружено байт файлов (проверенные части)")
+        describe('blob_chunk_failures_total', "Неудачных загрузок частей файлов")
+        if self.reliable is not None:
+            gauge('reliable_pending', lambda: self.reliable.counts()[0], "Сообщений, ожидающих ACK")
+            gauge('outbox_size', lambda: self.reliable.counts()[1], "Сообщений в outbox недоступных узлов")
+        if self.tls_client is not None:
+            describe('tls_handshakes_total', "Входящих рукопожатий TLS")
+            describe('tls_failures_total', "Отклоненных входящих соединений TLS")
+            gauge('tls_client_handshakes', lambda: self.pool.handshakes, "Исходящих рукопожатий TLS")
+            gauge('tls_client_resumed', lambda: self.pool.resumed, "Исходящих рукопожатий с возобновлением сессии")
+    
+    def count_async_tasks(self):
+        if self.loop_thread is None or self.loop.is_closed():
+            return 0
+        return len(asyncio.all_tasks(self.loop))
+    
+    def metrics_snapshot(self):
+        """Снимок метрик узла (счетчики, гистограммы, текущие показатели)"""
+        return self.metrics.snapshot()
+    
+    def start_metrics_services(self):
+        """Периодический снимок метрик в файл и HTTP endpoint, если включены"""
+        if self.config['metrics_file']:
+            threading.Thread(target=self.metrics_dump_loop, name='metrics-dump', daemon=True).start()
+        if self.config['metrics_port']:
+            try:
+                self.metrics_server = http.server.ThreadingHTTPServer(
+                    (self.config['metrics_host'], self.config['metrics_port']),
+                    MetricsRequestHandler
+                )
+                self.metrics_server.daemon_threads = True
+                self.metrics_server.metrics = self.metrics
+                self.metrics_server.ready = self.ready
+                threading.Thread(target=self.metrics_server.serve_forever, name='metrics-http', daemon=True).start()
+                self.logger.info(f"Метрики доступны на http://{self.config['metrics_host']}:{self.config['metrics_port']}/metrics")
+            except OSError as e:
+                self.logger.error(f"Не удалось запустить HTTP сервер метрик: {e}")
+    
+    def metrics_dump_loop(self):
+        """Запись снимка метрик в файл каждые metrics_dump_interval секунд"""
+        while not self.stopped.wait(self.config['metrics_dump_interval']):
+            self.dump_metrics()
+        self.dump_metrics()
+    
+    def dump_metrics(self):
+        path = self.config['metrics_file']
+        try:
+            # Запись через временный файл, чтобы читатель не увидел половину снимка
+            with open(path + '.tmp', 'w', encoding='utf-8') as f:
+                json.dump(self.metrics_snapshot(), f, ensure_ascii=False, indent=2)
+            os.replace(path + '.tmp', path)
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Ошибка записи метрик в {path}: {e}")
+    
+    def start_blob_service(self):
+        """HTTP сервер раздачи файлов (части отдаются через sendfile)"""
+        try:
+            self.blob_server = http.server.ThreadingHTTPServer(
+                (self.config['host'], self.config['blob_port']),
+                BlobRequestHandler,
+                bind_and_activate=False
+            )
+            self.blob_server.allow_reuse_address = True
+            self.blob_server.server_bind()
+            self.blob_server.server_activate()
+        except OSError as e:
+            self.logger.error(f"Не удалось запустить раздачу файлов: {e}")
+            self.blob_server = None
+            return
+        if self.tls_server is not None:
+            self.blob_server.socket = self.tls_server.wrap_socket(
+                self.blob_server.socket, server_side=True, do_handshake_on_connect=False
+            )
+        self.blob_server.daemon_threads = True
+        self.blob_server.store = self.blob_store
+        self.blob_server.messenger = self
+        self.blob_port = self.blob_server.server_address[1]
+        threading.Thread(target=self.blob_server.serve_forever, name='blob-http', daemon=True).start()
+        self.logger.info(f"Раздача файлов на порту {self.blob_port}")
+    
+    def share_file(self, path):
+        """Публикация файла: узлы получают уведомление и могут загрузить его, возвращает blob_id"""
+        if self.blob_server is None:
+            raise RuntimeError("передача файлов выключена (file_transfer)")
+        manifest = self.blob_store.add_file(path)
+        self.announce_blob(manifest)
+        return manifest['blob_id']
+    
+    def announce_blob(self, manifest):
+        """Уведомление о файле: отправитель становится одним из источников для загрузки"""
+        self.broadcast({
+            "type": "message",
+            "text": f"Файл {manifest['name']} ({manifest['size']} байт), id {manifest['blob_id']}",
+            "blob_id": manifest['blob_id'],
+            "blob_port": self.blob_port
+        })
+    
+    def add_blob_holder(self, blob_id, holder):
+        with self.blob_holders_lock:
+            holders = self.blob_holders.pop(blob_id, None) or []
+            if holder not in holders:
+                holders.append(holder)
+            self.blob_holders[blob_id] = holders
+            while len(self.blob_holders) > 1000:
+                self.blob_holders.popitem(last=False)
+    
+    def blob_connection(self, holder):
+        timeout = self.config['blob_timeout']
+        if self.tls_client is not None:
+            return http.client.HTTPSConnection(holder[0], holder[1], timeout=timeout, context=self.tls_client)
+        return http.client.HTTPConnection(holder[0], holder[1], timeout=timeout)
+    
+    def fetch_manifest(self, blob_id, holders):
+        """Манифест от первого ответившего узла, проверенный по идентификатору"""
+        for holder in holders:
+            conn = self.blob_connection(holder)
+            try:
+                conn.request('GET', f'/blobs/{blob_id}')
+                response = conn.getresponse()
+                body = response.read(16 * 1024 * 1024)
+                if response.status != 200:
+                    continue
+                manifest = json.loads(body)
+                chunks, chunk_size, size = manifest['chunks'], manifest['chunk_size'], manifest['size']
+                if (blob_root(chunks) == blob_id and chunk_size > 0
+                        and len(chunks) == max(1, -(-size // chunk_size))):
+                    return manifest
+                self.logger.warning(f"Узел {holder} прислал неверный манифест {blob_id}")
+            except (OSError, http.client.HTTPException, ValueError, KeyError, TypeError) as e:
+                self.logger.warning(f"Манифест {blob_id} от {holder} недоступен: {e}")
+            finally:
+                conn.close()
+        return None
+    
+    def fetch_blob(self, blob_id, path=None, holders=None):
+        """Загрузка файла параллельно с узлов, у которых он есть, возвращает путь
+        
+        Части пишутся прямо в файл (память не зависит от размера файла) и
+        проверяются по SHA-256 из манифеста. Прерванная загрузка при повторном
+        вызове продолжается с недостающих частей.
+        """
+        local = self.blob_store.get(blob_id)
+        if local is not None:
+            return local['path']
+        holders = list(holders or self.blob_holders.get(blob_id, ()))
+        manifest = self.fetch_manifest(blob_id, holders)
+        if manifest is None:
+            raise ConnectionError(f"файл {blob_id} недоступен ни на одном узле")
+        
+        part_path, state_path = self.blob_store.partial_paths(blob_id)
+        chunk_count = len(manifest['chunks'])
+        state = self.open_partial(manifest, part_path, state_path)
+        missing = queue.SimpleQueue()
+        for index in range(chunk_count):
+            if not state[index]:
+                missing.put(index)
+        if missing.qsize():
+            self.logger.info(f"Загрузка {manifest['name']}: частей {missing.qsize()} из {chunk_count}, "
+                             f"источников {len(holders)}")
+        
+        failures = {holder: 0 for holder in holders}
+        lock = threading.Lock()
+        
+        def worker(offset):
+            connections = {}
+            buffer = memoryview(bytearray(BLOB_READ_SIZE))
+            with open(part_path, 'r+b') as data_file, open(state_path, 'r+b') as state_file:
+                attempt = offset
+                while True:
+                    try:
+                        index = missing.get_nowait()
+                    except queue.Empty:
+                        break
+                    with lock:
+                        alive = [holder for holder, count in failures.items() if count < 3]
+                    if not alive:
+                        missing.put(index)
+                        break
+                    # Разные потоки и части - с разных узлов
+                    holder = alive[(index + attempt) % len(alive)]
+                    attempt += 1
+                    conn = connections.get(holder) or connections.setdefault(holder, self.blob_connection(holder))
+                    try:
+                        self.fetch_chunk(conn, manifest, index, data_file, buffer)
+                    except (OSError, http.client.HTTPException, ValueError) as e:
+                        connections.pop(holder).close()
+                        with lock:
+                            failures[holder] += 1
+                        self.metrics.inc('blob_chunk_failures_total')
+                        self.logger.warning(f"Часть {index} файла {blob_id} от {holder}: {e}")
+                        missing.put(index)
+                        continue
+                    # Отметка о части - после записи данных
+                    data_file.flush()
+                    state_file.seek(index)
+                    state_file.write(b'\x01')
+                    state_file.flush()
+                    state[index] = 1
+            for conn in connections.values():
+                conn.close()
+        
+        # Часть, возвращенная в очередь после ошибки, могла остаться без потока - новый проход
+        while missing.qsize() and any(count < 3 for count in failures.values()):
+            threads = [threading.Thread(target=worker, args=(i,), name=f'blob-fetch-{i}', daemon=True)
+                       for i in range(min(self.config['blob_parallel'], missing.qsize()))]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        
+        if not all(state):
+            raise ConnectionError(f"загрузка {blob_id} прервана: получено {sum(state)} из {chunk_count} частей")
+        
+        if path is None:
+            path = os.path.join(self.blob_store.directory, os.path.basename(manifest['name']) or blob_id)
+            if os.path.exists(path):
+                path = os.path.join(self.blob_store.directory, f"{blob_id[:16]}-{os.path.basename(path)}")
+        os.replace(part_path, path)
+        os.remove(state_path)
+        self.blob_store.complete(manifest, os.path.abspath(path))
+        self.logger.info(f"Файл {manifest['name']} загружен: {path}")
+        # Теперь этот узел - еще один источник файла
+        if self.blob_server is not None:
+            self.announce_blob(manifest)
+        return path
+    
+    def open_partial(self, manifest, part_path, state_path):
+        """Файлы незавершенной загрузки; отмеченные части перепроверяются по хешам"""
+        chunk_count = len(manifest['chunks'])
+        try:
+            with open(state_path, 'rb') as f:
+                state = bytearray(f.read(chunk_count))
+        except FileNotFoundError:
+            state = bytearray()
+        if len(state) != chunk_count or not os.path.exists(part_path):
+            state = bytearray(chunk_count)
+        
+        with open(part_path, 'a+b') as data_file:
+            data_file.truncate(manifest['size'])
+            # Отметка могла опередить запись данных на диск при сбое
+            for index in range(chunk_count):
+                if state[index]:
+                    data_file.seek(index * manifest['chunk_size'])
+                    data = data_file.read(min(manifest['chunk_size'], manifest['size'] - index * manifest['chunk_size']))
+                    if hashlib.sha256(data).hexdigest() != manifest['chunks'][index]:
+                        state[index] = 0
+        with open(state_path, 'wb') as f:
+            f.write(state)
+        return state
+    
+    def fetch_chunk(self, conn, manifest, index, data_file, buffer):
+        """Загрузка одной части потоком в файл с проверкой SHA-256"""
+        conn.request('GET', f"/blobs/{manifest['blob_id']}/{index}")
+        response = conn.getresponse()
+        if response.status != 200:
+            response.read()
+            raise ConnectionError(f"HTTP {response.status}")
+        offset = index * manifest['chunk_size']
+        length = remaining = min(manifest['chunk_size'], manifest['size'] - offset)
+        digest = hashlib.sha256()
+        data_file.seek(offset)
+        while remaining:
+            nbytes = response.readinto(buffer[:min(len(buffer), remaining)])
+            if not nbytes:
+                raise ConnectionError("соединение закрыто до конца части")
+            digest.update(buffer[:nbytes])
+            data_file.write(buffer[:nbytes])
+            remaining -= nbytes
+        if digest.hexdigest() != manifest['chunks'][index]:
+            raise ValueError("контрольная сумма части не совпадает")
+        self.metrics.inc('blob_bytes_received_total', length)
+    
+    def record_message(self, sender, text, message_id=None, timestamp=None, outgoing=False):
+        """Сохранение сообщения в журнале (в памяти и, если включено, на диске)"""
+        record = self.message_store.add(sender, text, message_id, timestamp, outgoing)
+        if self.message_log is not None:
+            try:
+                self.message_log.append({
+                    "id": record.message_id,
+                    "sender": record.sender,
+                    "text": record.text,
+                    "ts": record.timestamp,
+                    "rx": record.received_at,
+                    "out": record.outgoing
+                })
+            except Exception as e:
+                self.logger.error(f"Ошибка записи журнала на диск: {e}")
+        return record
+    
+    def open_message_log(self):
+        """Открытие журнала на диске и восстановление последних сообщений"""
+        try:
+            self.message_log = MessageLog(
+                self.config['message_log_dir'],
+                segment_bytes=self.config['log_segment_bytes'],
+                fsync_interval=self.config['log_fsync_interval'],
+                retention_segments=self.config['log_retention_segments'],
+                logger=self.logger
+            )
+            restored = 0
+            for entry in self.message_log.tail(self.message_store.capacity):
+                self.message_store.add(entry['sender'], entry['text'], entry['id'],
+                                       entry['ts'], entry['out'], entry['rx'])
+                restored += 1
+            self.logger.info(f"Восстановлено сообщений из журнала: {restored}")
+        except Exception as e:
+            self.logger.error(f"Ошибка открытия журнала сообщений: {e}", exc_info=True)
+            self.message_log = None
+    
+    def history(self, start_time=None, end_time=None):
+        """История сообщений за интервал времени (с диска, если журнал включен)"""
+        start_time = start_time if start_time is not None else 0.0
+        end_time = end_time if end_time is not None else time.time()
+        if self.message_log is not None:
+            return list(self.message_log.read_time(start_time, end_time))
+        return [
+            {"id": r.message_id, "sender": r.sender, "text": r.text,
+             "ts": r.timestamp, "rx": r.received_at, "out": r.outgoing}
+            for r in self.message_store.between(start_time, end_time)
+        ]
+    
+    def next_message_id(self):
+        """Глобально уникальный идентификатор сообщения"""
+        return f"{self.node_id}-{next(self.message_counter)}"
+    
+    def is_duplicate(self, message_id, sender):
+        """Проверка message_id по кэшу дедупликации"""
+        if message_id is None:
+            return False
+        # Старые узлы присылают числовой id (миллисекунды) - уточняем отправителем
+        key = message_id if isinstance(message_id, str) else (sender, message_id)
+        return self.dedup.check_and_add(key)
+    
+    def select_gossip_targets(self, peers):
+        """Случайное подмножество из gossip_fanout узлов"""
+        fanout = self.config['gossip_fanout']
+        if len(peers) <= fanout:
+            return list(peers)
+        return random.sample(peers, fanout)
+    
+    def relay_message(self, message_data):
+        """Пересылка сообщения случайным узлам с уменьшением TTL (gossip)"""
+        own_addr = self.node_address()
+        exclude = {message_data.get('sender'), message_data.get('via'), own_addr}
+        candidates = self.peers()
+        topic = message_data.get('topic')
+        if topic is not None:
+            # Сообщение темы распространяется только среди ее подписчиков
+            subscribers = self.topic_index.subscribers(topic)
+            candidates = [peer for peer in candidates if peer in subscribers]
+        candidates = [peer for peer in candidates if f"{peer[0]}:{peer[1]}" not in exclude]
+        targets = self.select_gossip_targets(candidates)
+        if not targets:
+            return
+        
+        relayed = {**message_data, "ttl": message_data['ttl'] - 1, "via": own_addr}
+        relayed.pop('ack', None)  # подтверждение запрашивает только отправитель на своем шаге
+        relayed = OutgoingMessage(relayed)
+        deadline_at = time.monotonic() + self.config['broadcast_deadline']
+        if self.workers:
+            targets, _ = self.delegate_to_workers(targets, relayed, deadline_at)
+        
+        # Пересылка не блокирует поток приема
+        try:
+            for peer in targets:
+                self.submit_delivery(peer, relayed, deadline_at)
+        except RuntimeError:
+            # Пул отправки уже остановлен
+            return
+        self.logger.debug(f"Сообщение {message_data.get('message_id')} переслано {len(targets)} узлам")
+    
+    def notify_message(self, message_data, address):
+        """Передача полученного сообщения подписчикам on_message"""
+        for callback in self.message_callbacks:
+            try:
+                callback(message_data, address)
+            except Exception as e:
+                self.logger.error(f"Ошибка в обработчике сообщений: {e}", exc_info=True)
     
     def start_discovery_service(self):
         """Служба обнаружения сетевых узлов"""
         try:
-            self.udp_send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.udp_send_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
-            
-            self.udp_recv_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
-            self.udp_recv_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            
-            self.udp_recv_socket.bind(('', self.config['discovery_port']))
+            self.create_discovery_sockets()
             self.udp_recv_socket.settimeout(1.0)
             
-            self.logger.info(f"UDP discovery на порту {self.config['discovery_port']}")
-            print(f"UDP discovery на порту {self.config['discovery_port']}")
-            
             broadcast_thread = threading.Thread(target=self.broadcast_presence, daemon=True)
             broadcast_thread.start()
             
             listen_thread = threading.Thread(target=self.listen_for_peers, daemon=True)
             listen_thread.start()
             
+            # Ответы на probe приходят на сокет отправки
+            reply_thread = threading.Thread(target=self.listen_for_peers, args=(self.udp_send_socket,), daemon=True)
+            reply_thread.start()
+            
             return True
             
         except Exception as e:
@@ -197,75 +3753,178 @@ class NetworkMessenger:
             print(f"Ошибка инициализации UDP: {e}")
             return False
     
-    def broadcast_presence(self):
-        """Рассылка информации о текущем узле"""
+    def node_address(self):
+        """Адрес узла "host:port", по которому его находят другие узлы"""
+        return f"{self.advertise_host}:{self.config['port']}"
+    
+    def build_discovery_message(self, probe=False, peers=None):
+        """Формирование discovery-сообщения текущего узла
+        
+        probe - просьба ко всем получателям ответить списком известных узлов,
+        peers - такой список (в ответе на probe).
+        """
         discovery_msg = {
             "type": "discovery",
-            "host": self.config['host'],
+            "host": self.advertise_host,
             "port": self.config['port'],
+            "node_id": self.node_id,
+            "proto": PROTOCOL_VERSION,
+            "codecs": self.config['codecs'],
+            "features": FEATURES,
             "timestamp": time.time()
         }
-        message = json.dumps(discovery_msg).encode('utf-8')
+        if self.subscriptions:
+            discovery_msg["topics"] = sorted(self.subscriptions)
+        if peers is not None:
+            discovery_msg["peers"] = peers
+        if probe:
+            discovery_msg["probe"] = True
+            data = json.dumps(discovery_msg).encode('utf-8')
+            if len(data) < PROBE_MIN_BYTES:
+                discovery_msg["pad"] = ' ' * (PROBE_MIN_BYTES - len(data))
+        return json.dumps(discovery_msg).encode('utf-8')
+    
+    def build_peer_list(self, max_bytes=DISCOVERY_RESPONSE_MAX_BYTES):
+        """Активные узлы с их возможностями для ответа на probe (не больше max_bytes)"""
+        entries = []
+        size = 0
+        for addr in self.peer_table.active_peers():
+            info = self.peer_table.get(addr)
+            if info is None:
+                continue
+            entry = [addr[0], addr[1], info.protocol, info.capabilities.get('codecs', ['json']),
+                     info.capabilities.get('features', [])]
+            size += len(json.dumps(entry)) + 2  # с разделителем ", "
+            if size > max_bytes:
+                break
+            entries.append(entry)
+        return entries
+    
+    def discovery_targets(self):
+        """Адреса рассылки discovery: broadcast, loopback, multicast и seed-узлы"""
+        port = self.config['discovery_port']
+        targets = [('127.0.0.1', port)]
+        if self.config['discovery_broadcast']:
+            targets.append(('255.255.255.255', port))
+        if self.config['discovery_multicast_group']:
+            targets.append((self.config['discovery_multicast_group'], port))
+        for seed in self.config['discovery_seeds']:
+            try:
+                targets.append(parse_endpoint(seed, port))
+            except ValueError:
+                self.logger.warning(f"Некорректный seed-узел: {seed}")
+        return targets
+    
+    def send_discovery(self, message, targets):
+        """Отправка discovery-датаграммы по списку адресов"""
+        for target in targets:
+            try:
+                if self.udp_reply_transport is not None:
+                    self.udp_reply_transport.sendto(message, target)
+                else:
+                    self.udp_send_socket.sendto(message, target)
+            except OSError as e:
+                self.logger.error(f"Ошибка broadcast на {target}: {e}")
+    
+    def next_beacon(self):
+        """Очередной beacon; пока узлы не найдены - probe со списком в ответ"""
+        return self.build_discovery_message(probe=len(self.peer_table) == 0)
+    
+    def local_targets(self):
+        """Обновление своей записи в реестре хоста и UDP порты соседних узлов"""
+        if self.local_registry is None:
+            return []
+        try:
+            self.local_registry.register({
+                "host": self.advertise_host,
+                "port": self.config['port'],
+                "node_id": self.node_id,
+                "udp_port": self.udp_send_socket.getsockname()[1]
+            })
+        except OSError as e:
+            self.logger.error(f"Ошибка записи в локальный реестр узлов: {e}")
+        return [('127.0.0.1', entry['udp_port']) for entry in self.local_registry.entries()
+                if isinstance(entry.get('udp_port'), int)]
+    
+    def topology_changed(self):
+        """Состав сети изменился - возвращаемся к частым beacon"""
+        self.beacon_schedule.reset()
+        if self.loop_thread is not None:
+            if self.async_discovery_wakeup is not None:
+                try:
+                    self.loop.call_soon_threadsafe(self.async_discovery_wakeup.set)
+                except RuntimeError:
+                    pass  # цикл событий уже остановлен
+        else:
+            self.discovery_wakeup.set()
+    
+    def create_discovery_sockets(self):
+        """Создание UDP сокетов для рассылки и приема discovery"""
+        self.udp_send_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_send_socket.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        # Явная привязка: на этот порт приходят ответы на probe
+        self.udp_send_socket.bind(('', 0))
+        
+        self.udp_recv_socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.udp_recv_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        if hasattr(socket, 'SO_REUSEPORT'):
+            # Несколько узлов на хосте делят порт discovery и все получают broadcast/multicast
+            try:
+                self.udp_recv_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            except OSError:
+                pass
+        
+        self.udp_recv_socket.bind(('', self.config['discovery_port']))
+        
+        group = self.config['discovery_multicast_group']
+        if group:
+            # Multicast для сетей, где широковещательная рассылка недоступна
+            membership = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton('0.0.0.0'))
+            self.udp_recv_socket.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            self.udp_send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL,
+                                            self.config['discovery_multicast_ttl'])
+            # Свои multicast датаграммы доставляются и узлам на этом же хосте
+            self.udp_send_socket.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        
+        if self.config['local_registry']:
+            directory = (self.config['local_registry_dir']
+                         or LocalRegistry.default_directory(self.config['discovery_port']))
+            try:
+                self.local_registry = LocalRegistry(
+                    directory, f"{self.config['port']}-{self.node_id}",
+                    stale_after=self.config['discovery_interval_max'] * 3
+                )
+            except OSError as e:
+                self.logger.warning(f"Локальный реестр узлов недоступен: {e}")
         
-        interval = 10  # секунд
+        self.logger.info(f"UDP discovery на порту {self.config['discovery_port']}")
+        print(f"UDP discovery на порту {self.config['discovery_port']}")
+    
+    def broadcast_presence(self):
+        """Рассылка информации о текущем узле"""
         while self.running:
-            try:
-                # Широковещательная рассылка
-                self.udp_send_socket.sendto(message, ('255.255.255.255', self.config['discovery_port']))
-                self.udp_send_socket.sendto(message, ('127.0.0.1', self.config['discovery_port']))
-                
-            except Exception as e:
-                self.logger.error(f"Ошибка broadcast: {e}")
+            # Адреса рассылки - на каждом шаге: seed-узлы меняются перечитыванием конфигурации
+            self.send_discovery(self.next_beacon(), self.discovery_targets() + self.local_targets())
             
-            # Ожидание с проверкой running
-            for _ in range(interval * 10):
-                if not self.running:
-                    break
-                time.sleep(0.1)
+            # Ожидание до следующей рассылки; изменение состава сети сокращает интервал
+            send_at = time.monotonic() + self.beacon_schedule.next_delay()
+            while self.running and self.discovery_wakeup.wait(max(0.0, send_at - time.monotonic())):
+                self.discovery_wakeup.clear()
+                send_at = min(send_at, time.monotonic() + self.beacon_schedule.next_delay())
     
-    def listen_for_peers(self):
+    def listen_for_peers(self, sock=None):
         """Прослушивание информации от других узлов"""
+        sock = sock or self.udp_recv_socket
         self.logger.info("Начало прослушивания discovery сообщений")
         
         while self.running:
             try:
-                data, addr = self.udp_recv_socket.recvfrom(4096)
+                data, addr = sock.recvfrom(65535)
                 
                 if not data:
                     continue
-                    
-                try:
-                    message = json.loads(data.decode('utf-8'))
-                    
-                    if message.get('type') == 'discovery':
-                        peer_host = message.get('host', addr[0])
-                        peer_port = message.get('port')
-                        
-                        if not peer_port:
-                            continue
-                            
-                        try:
-                            peer_port = int(peer_port)
-                        except (ValueError, TypeError):
-                            continue
-                        
-                        # Пропускаем свой собственный узел
-                        if (peer_host == self.config['host'] and 
-                            peer_port == self.config['port']):
-                            continue
-                        
-                        peer_addr = (peer_host, peer_port)
-                        
-                        with self.peers_lock:
-                            was_known = peer_addr in self.peers
-                            self.peers[peer_addr] = time.time()
-                        
-                        if not was_known:
-                            print(f"\nОбнаружен узел: {peer_host}:{peer_port}")
-                            self.logger.info(f"Обнаружен новый узел: {peer_addr}")
-                            
-                except json.JSONDecodeError:
-                    continue
+                
+                self.process_discovery(data, addr)
                     
             except socket.timeout:
                 continue
@@ -276,25 +3935,212 @@ class NetworkMessenger:
             except Exception as e:
                 self.logger.error(f"Ошибка listen_for_peers: {e}")
     
+    def process_discovery(self, data, addr):
+        """Обработка discovery-датаграммы от другого узла"""
+        try:
+            message = json.loads(data.decode('utf-8'))
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            return
+        
+        if not isinstance(message, dict) or message.get('type') != 'discovery':
+            return
+        self.metrics.inc('discovery_beacons_total')
+        
+        # Пропускаем свой собственный узел
+        if message.get('node_id') == self.node_id:
+            return
+        
+        peer_host = message.get('host')
+        if not peer_host or peer_host == '0.0.0.0':
+            # Старые узлы объявляют адрес привязки - берем адрес отправителя
+            peer_host = addr[0]
+        peer_port = message.get('port')
+        
+        if not peer_port:
+            return
+            
+        try:
+            peer_port = int(peer_port)
+        except (ValueError, TypeError):
+            return
+        
+        if peer_host == self.advertise_host and peer_port == self.config['port']:
+            return
+        
+        peer_addr = (peer_host, peer_port)
+        codecs = message.get('codecs')
+        features = message.get('features')
+        is_new = self.peer_table.touch(
+            peer_addr,
+            parse_protocol(message.get('proto', 0)),
+            {
+                'codecs': codecs if isinstance(codecs, list) else ['json'],
+                'features': features if isinstance(features, list) else []
+            }
+        )
+        changed = is_new
+        if is_new:
+            self.report_new_peer(peer_addr)
+        self.peer_seen(peer_addr)
+        topics = message.get('topics')
+        if self.topic_index.update(peer_addr, topics if isinstance(topics, list) else ()):
+            self.logger.debug(f"Подписки узла {peer_addr}: {topics}")
+        
+        # Новый узел просит список - отвечаем ему напрямую, не чаще лимита
+        # и не больше запроса в PROBE_REPLY_AMPLIFICATION раз
+        if message.get('probe'):
+            if self.probe_limiter.allow(addr[0]):
+                budget = min(DISCOVERY_RESPONSE_MAX_BYTES, len(data) * PROBE_REPLY_AMPLIFICATION)
+                budget -= len(self.build_discovery_message(peers=[]))
+                self.send_discovery(self.build_discovery_message(peers=self.build_peer_list(budget)), [addr])
+            else:
+                self.metrics.inc('probe_replies_limited_total')
+        
+        # Ответ на probe: узнаем всю сеть за один обмен
+        peers = message.get('peers')
+        if isinstance(peers, list):
+            for entry in peers:
+                if self.learn_peer(entry):
+                    changed = True
+        
+        if changed:
+            self.topology_changed()
+    
+    def learn_peer(self, entry):
+        """Добавление узла из списка в ответе на probe, True - узел новый
+        
+        Такой узел остается неактивным, пока не пришлет beacon или сообщение сам.
+        """
+        try:
+            host, port, proto, codecs, features = entry
+            peer_addr = (str(host), int(port))
+        except (ValueError, TypeError):
+            return False
+        if peer_addr == (self.advertise_host, self.config['port']):
+            return False
+        is_new = self.peer_table.learn(
+            peer_addr,
+            parse_protocol(proto),
+            {
+                'codecs': codecs if isinstance(codecs, list) else ['json'],
+                'features': features if isinstance(features, list) else []
+            }
+        )
+        if is_new:
+            self.report_new_peer(peer_addr)
+        return is_new
+    
+    def report_new_peer(self, peer_addr):
+        if self.console_output:
+            self.console.show(f"Обнаружен узел: {peer_addr[0]}:{peer_addr[1]}")
+        self.logger.info(f"Обнаружен новый узел: {peer_addr}")
+    
+    def start_async_services(self):
+        """Запуск TCP сервера и discovery на едином цикле событий asyncio"""
+        try:
+            if not self.bind_tcp_socket():
+                return False
+            if self.config['discovery_enabled']:
+                self.create_discovery_sockets()
+            
+            self.loop = asyncio.new_event_loop()
+            self.loop_thread = threading.Thread(target=self.run_event_loop, daemon=True)
+            self.loop_thread.start()
+            
+            # Дожидаемся регистрации сервера и discovery в цикле событий
+            asyncio.run_coroutine_threadsafe(self.async_start(), self.loop).result(timeout=5.0)
+            
+            self.logger.info("Сетевые сервисы запущены в режиме asyncio")
+            print("TCP сервер запущен (asyncio)")
+            return True
+            
+        except Exception as e:
+            self.logger.error(f"Ошибка инициализации asyncio: {e}", exc_info=True)
+            print(f"Ошибка инициализации asyncio: {e}")
+            return False
+    
+    def run_event_loop(self):
+        """Поток, в котором крутится цикл событий asyncio"""
+        asyncio.set_event_loop(self.loop)
+        try:
+            self.loop.run_forever()
+        finally:
+            self.loop.close()
+    
+    async def async_start(self):
+        """Регистрация TCP сервера, UDP endpoint и фоновых задач в цикле событий"""
+        self.tcp_socket.setblocking(False)
+        self.async_server = await self.loop.create_server(
+            lambda: FramedServerProtocol(self),
+            sock=self.tcp_socket,
+            backlog=self.config['accept_backlog'],
+            ssl=self.tls_server,
+            ssl_handshake_timeout=self.config['tls_handshake_timeout'] if self.tls_server else None
+        )
+        
+        self.async_tasks = []
+        if self.config['discovery_enabled']:
+            self.udp_recv_socket.setblocking(False)
+            self.udp_send_socket.setblocking(False)
+            await self.loop.create_datagram_endpoint(
+                lambda: DiscoveryProtocol(self),
+                sock=self.udp_recv_socket
+            )
+            # Сокет отправки тоже слушаем: на него приходят ответы на probe
+            self.udp_reply_transport, _ = await self.loop.create_datagram_endpoint(
+                lambda: DiscoveryProtocol(self),
+                sock=self.udp_send_socket
+            )
+            self.async_discovery_wakeup = asyncio.Event()
+            self.async_tasks.append(self.loop.create_task(self.async_broadcast_presence()))
+        
+        self.logger.info("Начало приема подключений (asyncio)")
+    
+    async def async_stop(self):
+        """Остановка сервера и фоновых задач цикла событий"""
+        tasks = getattr(self, 'async_tasks', [])
+        for task in tasks:
+            task.cancel()
+        # Дожидаемся завершения отмененных задач до остановки цикла
+        await asyncio.gather(*tasks, return_exceptions=True)
+        if hasattr(self, 'async_server'):
+            self.async_server.close()
+    
+    async def async_broadcast_presence(self):
+        """Рассылка информации о текущем узле (корутина)"""
+        while self.running:
+            # Реестр хоста - файлы на диске: читаем вне цикла событий
+            local = await self.loop.run_in_executor(None, self.local_targets)
+            self.send_discovery(self.next_beacon(), self.discovery_targets() + local)
+            
+            # Ожидание до следующей рассылки; изменение состава сети сокращает интервал
+            send_at = time.monotonic() + self.beacon_schedule.next_delay()
+            while self.running:
+                try:
+                    await asyncio.wait_for(self.async_discovery_wakeup.wait(), max(0.0, send_at - time.monotonic()))
+                except asyncio.TimeoutError:
+                    break
+                self.async_discovery_wakeup.clear()
+                send_at = min(send_at, time.monotonic() + self.beacon_schedule.next_delay())
+    
     def send_message_to_peers(self):
-        """Отправка сообщения всем доступным узлам"""
+        """Отправка сообщения всем доступным узлам (интерактивный ввод)"""
         print("ОТПРАВКА СООБЩЕНИЯ")
         
-        # Получаем активных пиров
-        with self.peers_lock:
-            current_time = time.time()
-            active_peers = [
-                addr for addr, last_seen in self.peers.items()
-                if current_time - last_seen < 30
-            ]
+        active_peers = self.peers()
         
         if not active_peers:
             print("Нет активных узлов для отправки")
             print("Ожидайте обнаружения других узлов")
-            return
-        
-        print(f"Найдено активных узлов: {len(active_peers)}")
+        else:
+            print(f"Найдено активных узлов: {len(active_peers)}")
+        if self.subscriptions:
+            print(f"Подписки: {', '.join('#' + topic for topic in sorted(self.subscriptions))}")
         print("Введите сообщение (или 'отмена' для возврата):")
+        print("  @host:port текст - личное сообщение, #тема текст - сообщение в тему")
+        print("  +#тема / -#тема - подписка на тему / отписка")
+        if self.blob_server is not None:
+            print("  /file путь - отправить файл, /get id [путь] - загрузить файл")
         
         text = input("> ").strip()
         
@@ -306,97 +4152,589 @@ class NetworkMessenger:
             print("Сообщение не может быть пустым")
             return
         
-        # Создаем структурированное сообщение
-        message_data = {
-            "type": "message",
-            "text": text,
-            "sender": f"{self.config['host']}:{self.config['port']}",
-            "timestamp": datetime.now().isoformat(),
-            "message_id": int(time.time() * 1000)
-        }
-        
+        # Адресация: первое слово с префиксом @, #, +# или -#
+        target, _, body = text.partition(' ')
+        if target in ('/file', '/get') and self.blob_server is not None and body:
+            self.transfer_command(target, body.strip())
+            return
         try:
-            json_message = json.dumps(message_data, ensure_ascii=False).encode('utf-8')
-        except Exception as e:
-            self.logger.error(f"Ошибка кодирования JSON: {e}")
-            print("Ошибка подготовки сообщения")
+            if target.startswith(('+#', '-#')) and not body:
+                if target[0] == '+':
+                    self.subscribe(target[2:])
+                    print(f"Подписка на #{target[2:]} оформлена")
+                else:
+                    self.unsubscribe(target[2:])
+                    print(f"Подписка на #{target[2:]} отменена")
+                return
+            if target.startswith('@') and body:
+                report = self.send_to(target[1:], body)
+                text = f"{target}: {body}"
+            elif target.startswith('#') and body:
+                report = self.publish(target[1:], body)
+                text = f"{target}: {body}"
+            elif not active_peers:
+                return
+            else:
+                report = self.send(text)
+        except ValueError as e:
+            print(f"Ошибка подготовки сообщения: {e}")
             return
         
         # Отображаем у себя
         display_time = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
         print(f"\n[{display_time}] Вы: {text}")
-        self.messages.append(f"[{display_time}] Вы: {text}")
-        
-        # Отправка всем активным пирам
-        sent_count = 0
-        failed_peers = []
-        
-        for peer in active_peers:
-            try:
-                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                sock.settimeout(3.0)
-                sock.connect(peer)
-                sock.send(json_message)
-                sock.close()
-                sent_count += 1
-                
-                # Обновляем время активности
-                with self.peers_lock:
-                    self.peers[peer] = time.time()
-                    
-                self.logger.info(f"Сообщение отправлено к {peer}")
-                
-            except ConnectionRefusedError:
-                failed_peers.append(peer)
-                self.logger.warning(f"Соединение отклонено: {peer}")
-            except socket.timeout:
-                failed_peers.append(peer)
-                self.logger.warning(f"Таймаут соединения: {peer}")
-            except Exception as e:
-                failed_peers.append(peer)
-                self.logger.error(f"Ошибка отправки к {peer}: {e}")
         
-        # Удаляем недоступные узлы
+        failed_peers = report.failed
         if failed_peers:
-            with self.peers_lock:
-                for peer in failed_peers:
-                    if peer in self.peers:
-                        del self.peers[peer]
-            
             if len(failed_peers) == 1:
                 print(f"Узел {failed_peers[0]} недоступен")
             else:
                 print(f"{len(failed_peers)} узлов недоступны")
         
         # Результат отправки
-        if sent_count == 0:
+        sent_count = len(report.delivered)
+        queued_count = len(report.queued)
+        if sent_count == 0 and queued_count == 0:
             print("Сообщение не доставлено ни одному узлу")
         else:
-            print(f"Сообщение доставлено {sent_count} узлам")
+            if sent_count:
+                print(f"Сообщение доставлено {sent_count} узлам")
+            if queued_count:
+                print(f"Сообщение поставлено в очередь отправки к {queued_count} узлам")
+        
+        return report
+    
+    def transfer_command(self, command, argument):
+        """Команды передачи файлов из интерактивного ввода"""
+        try:
+            if command == '/file':
+                blob_id = self.share_file(argument)
+                print(f"Файл опубликован, id {blob_id}")
+            else:
+                blob_id, _, path = argument.partition(' ')
+                started = time.monotonic()
+                path = self.fetch_blob(blob_id, path.strip() or None)
+                print(f"Файл загружен за {time.monotonic() - started:.1f} сек: {path}")
+        except (OSError, RuntimeError, ValueError) as e:
+            print(f"Ошибка передачи файла: {e}")
+    
+    # ----- Программный интерфейс -----
+    
+    def send(self, text):
+        """Отправка текстового сообщения всем активным узлам, возвращает DeliveryReport"""
+        return self.broadcast({"type": "message", "text": text})
+    
+    def send_to(self, peer, text):
+        """Личное сообщение одному узлу (адрес "host:port" или кортеж)"""
+        if isinstance(peer, str):
+            peer = parse_endpoint(peer, self.config['port'])
+        peer = (peer[0], int(peer[1]))
+        return self.broadcast({"type": "message", "text": text, "to": f"{peer[0]}:{peer[1]}"}, [peer])
+    
+    def publish(self, topic, text):
+        """Сообщение в тему: только узлам, подписанным на нее"""
+        if not valid_topic(topic):
+            raise ValueError(f"недопустимое имя темы: {topic!r}")
+        recipients = []
+        for peer in self.topic_index.subscribers(topic):
+            if peer in self.peer_table:
+                recipients.append(peer)
+            else:
+                self.topic_index.remove(peer)  # узел удален из таблицы по истечении срока
+        return self.broadcast({"type": "message", "text": text, "topic": topic}, recipients)
+    
+    def subscribe(self, topic):
+        """Подписка на тему; остальные узлы узнают о ней из ближайшего beacon"""
+        if not valid_topic(topic):
+            raise ValueError(f"недопустимое имя темы: {topic!r}")
+        if topic in self.subscriptions:
+            return
+        if len(self.subscriptions) >= self.config['max_subscriptions']:
+            raise ValueError(f"превышено число подписок: {self.config['max_subscriptions']}")
+        self.subscriptions.add(topic)
+        self.logger.info(f"Подписка на тему {topic}")
+        # Внеочередной beacon с новым набором тем
+        self.topology_changed()
+    
+    def unsubscribe(self, topic):
+        if topic in self.subscriptions:
+            self.subscriptions.discard(topic)
+            self.logger.info(f"Отписка от темы {topic}")
+            self.topology_changed()
+    
+    def broadcast(self, payload, recipients=None):
+        """Рассылка произвольного сообщения (dict)
+        
+        recipients - адресаты; по умолчанию все активные узлы. Недоступные
+        адресаты при надежной доставке получат сообщение из outbox.
+        """
+        message_data = {
+            "type": "message",
+            "sender": self.node_address(),
+            "timestamp": datetime.now().isoformat(),
+            "message_id": self.next_message_id(),
+            **payload
+        }
+        # Собственное сообщение, вернувшееся через другие узлы, не показываем повторно
+        self.is_duplicate(message_data['message_id'], message_data['sender'])
+        
+        if recipients is None:
+            targets = self.peers()
+            offline = self.peer_table.stale_peers()
+        else:
+            targets, offline = [], []
+            for peer in recipients:
+                info = self.peer_table.get(peer)
+                (offline if info is not None and info.state == PeerTable.STALE else targets).append(peer)
+        if self.config['dissemination'] == 'gossip' and 'to' not in message_data:
+            # Вместо полной рассылки - случайные k узлов, дальше распространят они
+            message_data.setdefault('ttl', self.config['gossip_ttl'])
+            targets = self.select_gossip_targets(targets)
+        
+        if self.reliable is not None:
+            message_data['ack'] = True
+        
+        message = OutgoingMessage(message_data)
+        try:
+            # Проверяем сериализуемость заранее; кадры остальных кодеков - по запросу
+            message.legacy()
+        except Exception as e:
+            self.logger.error(f"Ошибка кодирования JSON: {e}")
+            raise ValueError(f"сообщение не сериализуется в JSON: {e}")
+        
+        if 'text' in message_data:
+            self.record_message(message_data['sender'], message_data['text'],
+                                message_data['message_id'], outgoing=True)
+        
+        # Ожидание ACK регистрируем до отправки: подтверждение может опередить отчет
+        if self.reliable is not None:
+            for peer in targets:
+                self.reliable.track(peer, message_data['message_id'], message)
+            for peer in offline:
+                self.reliable.store(peer, message_data['message_id'], message)
+        
+        # Параллельная отправка всем активным пирам
+        report = self.fan_out(targets, message, message_id=message_data['message_id'])
+        
+        # Недоступные узлы исключаются из активных до следующего обнаружения;
+        # узлы в паузе переподключения (SKIPPED) получат сообщение повтором
+        for peer in report.failed:
+            if report.results[peer].status == DeliveryResult.SKIPPED:
+                continue
+            self.peer_table.mark_failed(peer)
+            if self.reliable is not None:
+                # Сообщение дождется узла в outbox
+                self.reliable.defer(peer, message_data['message_id'])
+        
+        if self.hot_log_enabled():
+            self.logger.info(f"Отправка завершена за {report.elapsed * 1000:.1f} мс: {report.counts()}")
+        return report
+    
+    def on_message(self, callback):
+        """Подписка на входящие сообщения: callback(message_data, address)"""
+        self.message_callbacks.append(callback)
+        return callback
+    
+    def peers(self):
+        """Список адресов активных узлов"""
+        return list(self.peer_table.active_peers())
+    
+    @staticmethod
+    def reuse_port_supported():
+        """SO_REUSEPORT с балансировкой TCP соединений между процессами (Linux)"""
+        return hasattr(socket, 'SO_REUSEPORT') and sys.platform.startswith('linux')
+    
+    def start_workers(self):
+        """Запуск дополнительных процессов, разделяющих порт узла"""
+        count = self.config['workers'] - 1
+        if count <= 0:
+            return True
+        context = multiprocessing.get_context('spawn')
+        # Исполнители не ведут discovery, журнал и метрики - это делает главный процесс
+        # Остальные параметры исполнители читают из того же файла и перечитывают при его изменении
+        overrides = {
+            **self.config_overrides,
+            "host": self.config['host'],
+            "port": self.config['port'],
+            "discovery_enabled": False,
+            "persist_messages": False,
+            "metrics_port": 0,
+            "metrics_file": "",
+            "file_transfer": False,
+            "peer_rate_limit": 0.0,   # лимит частоты общий - в главном процессе
+            "workers": 1,
+            "node_id": self.node_id,
+            "advertise_host": self.advertise_host
+        }
+        listen_socket = None if self.reuse_port_supported() else self.tcp_socket
+        for index in range(1, count + 1):
+            parent_channel, child_channel = context.Pipe()
+            process = context.Process(
+                target=run_worker,
+                args=(self.config_file, overrides, child_channel, listen_socket),
+                name=f'worker-{index}',
+                daemon=True
+            )
+            process.start()
+            child_channel.close()
+            worker = WorkerHandle(index, process, parent_channel)
+            
+            reply = parent_channel.recv() if parent_channel.poll(30.0) else ('failed',)
+            if reply[0] != 'ready':
+                self.logger.error(f"Исполнитель {index} не запустился")
+                process.terminate()
+                continue
+            self.workers.append(worker)
+            threading.Thread(target=self.read_worker, args=(worker,), name=f'worker-{index}-reader', daemon=True).start()
+            self.logger.info(f"Исполнитель {index} запущен (pid {reply[1]})")
+        return True
+    
+    def read_worker(self, worker):
+        """Поток приема сообщений и результатов отправки от исполнителя"""
+        while self.running:
+            try:
+                event = worker.channel.recv()
+            except (EOFError, OSError):
+                if self.running:
+                    self.logger.error(f"Исполнитель {worker.index} завершился")
+                break
+            kind = event[0]
+            if kind == 'message':
+                # Окончательная проверка дубликатов - в общем кэше главного процесса
+                self.dispatch(event[1], event[2], event[3])
+            elif kind == 'delivered':
+                peer = event[1]
+                self.peer_table.touch(peer)
+                self.peer_table.record_rtt(peer, event[2])
+            elif kind == 'failed':
+                self.peer_table.mark_failed(event[1])
+        if worker in self.workers:
+            self.workers.remove(worker)
+    
+    def delegate_to_workers(self, peers, message, deadline_at):
+        """Передача узлов чужих сегментов исполнителям: (свои узлы, переданные)"""
+        workers = list(self.workers)
+        local = []
+        shards = {}
+        for peer in peers:
+            shard = zlib.crc32(f"{peer[0]}:{peer[1]}".encode()) % (len(workers) + 1)
+            if shard == 0:
+                local.append(peer)
+            else:
+                shards.setdefault(shard, []).append(peer)
+        
+        delegated = []
+        for shard, shard_peers in shards.items():
+            if self.send_via_worker(workers[shard - 1], shard_peers, message, deadline_at):
+                delegated.extend(shard_peers)
+            else:
+                local.extend(shard_peers)
+        return local, delegated
+    
+    def send_via_worker(self, worker, peers, message, deadline_at):
+        """Передача рассылки исполнителю вместе с изменениями таблицы узлов"""
+        try:
+            version = self.peer_table.version
+            if worker.peers_version != version:
+                known = []
+                for info in self.peer_table.visible_peers():
+                    known.append((info.addr, info.protocol, dict(info.capabilities)))
+                worker.send(('peers', known))
+                worker.peers_version = version
+            worker.send(('send', message.data, peers, deadline_at - time.monotonic()))
+            return True
+        except (OSError, ValueError) as e:
+            self.logger.error(f"Ошибка передачи рассылки исполнителю {worker.index}: {e}")
+            return False
+    
+    def serve_supervisor(self):
+        """Цикл исполнителя: команды главного процесса до остановки"""
+        channel = self.worker_channel
+        while self.running:
+            try:
+                command = channel.recv()
+            except (EOFError, OSError):
+                break
+            kind = command[0]
+            if kind == 'peers':
+                for addr, protocol, capabilities in command[1]:
+                    self.peer_table.touch(tuple(addr), protocol, capabilities)
+            elif kind == 'send':
+                message_data, peers, timeout = command[1:]
+                self.submit_sends(peers, OutgoingMessage(message_data), time.monotonic() + timeout)
+            elif kind == 'stop':
+                break
+        self.stop()
+    
+    def submit_sends(self, peers, message, deadline_at):
+        """Отправка без ожидания: результаты сообщаются главному процессу"""
+        for peer in peers:
+            peer = tuple(peer)
+            if self.batch_sender is not None and self.supports(peer, 'batch'):
+                codec = self.codec_for(peer)
+                self.batch_sender.enqueue(peer, codec, message.payload(codec))
+                continue
+            try:
+                future = self.submit_delivery(peer, message, deadline_at)
+            except RuntimeError:
+                return  # пул отправки остановлен
+            future.add_done_callback(self.report_delivery)
+    
+    def report_delivery(self, future):
+        if future.cancelled():
+            return
+        result = future.result()
+        if result.status == DeliveryResult.OK:
+            self.notify_supervisor(('delivered', result.peer, result.latency))
+        else:
+            self.notify_supervisor(('failed', result.peer))
+    
+    def forward_message(self, message_data, address, framed):
+        """Передача нового сообщения главному процессу (в исполнителе)"""
+        # Копии, пришедшие в этот процесс повторно, отсекаем до передачи
+        sender = message_data.get('sender', f'{address[0]}:{address[1]}')
+        # Повтор с запросом ACK передаем: подтверждает главный процесс
+        if not message_data.get('ack') and self.is_duplicate(message_data.get('message_id'), sender):
+            self.metrics.inc('duplicates_total')
+            return
+        self.metrics.inc('received_messages_total')
+        self.notify_supervisor(('message', message_data, address, framed))
+    
+    def notify_supervisor(self, event):
+        try:
+            with self.worker_channel_lock:
+                self.worker_channel.send(event)
+        except (OSError, ValueError):
+            pass  # главный процесс завершается
+    
+    def start(self):
+        """Запуск сетевых сервисов без интерактивного меню"""
+        for i in range(self.config['inbound_workers']):
+            threading.Thread(target=self.process_inbound, name=f'inbound-{i}', daemon=True).start()
+        threading.Thread(target=self.ack_loop, name='acks', daemon=True).start()
+        
+        if self.config['server_mode'] == 'asyncio':
+            tcp_ok = udp_ok = self.start_async_services()
+        else:
+            tcp_ok = self.start_tcp_server()
+            # Без discovery узлы задаются вручную (например, в симуляторе)
+            udp_ok = self.start_discovery_service() if self.config['discovery_enabled'] else True
+        
+        if not tcp_ok or not udp_ok:
+            self.logger.error("Ошибка инициализации сетевых сервисов")
+            return False
+        
+        maintenance_thread = threading.Thread(target=self.maintenance_loop, daemon=True)
+        maintenance_thread.start()
+        self.start_metrics_services()
+        if self.blob_store is not None:
+            self.start_blob_service()
+        threading.Thread(target=self.config_watch_loop, name='config-watch', daemon=True).start()
+        
+        self.startup_seconds = time.monotonic() - self.created_at
+        self.ready.set()
+        self.logger.info(f"Узел готов за {self.startup_seconds * 1000:.1f} мс")
+        # Исполнители запускаются после готовности: до их старта соединения принимает главный процесс
+        if self.worker_channel is None:
+            self.start_workers()
+        return True
+    
+    def wait_ready(self, timeout=None):
+        """Ожидание готовности узла (True - узел запущен)"""
+        return self.ready.wait(timeout)
+    
+    def maintenance_loop(self):
+        """Фоновое обслуживание: очистка узлов и периодический статус"""
+        status_timer = time.time()
+        
+        # Фоновая очистка (интервалы читаются на каждом шаге - меняются при перечитывании конфигурации)
+        while not self.stopped.wait(self.config['maintenance_interval']):
+            self.cleanup_inactive_peers()
+            
+            # Периодический статус
+            current_time = time.time()
+            if current_time - status_timer > self.config['status_log_interval']:
+                self.logger.info("Периодический статус - система работает")
+                status_timer = current_time
+    
+    def run_daemon(self):
+        """Работа в режиме демона: без терминального ввода/вывода до сигнала остановки"""
+        self.console_output = False
+        self.logger.info("Запуск в режиме демона")
+        
+        if not self.start():
+            self.stop()
+            return False
+        
+        def handle_signal(signum, frame):
+            self.logger.info(f"Получен сигнал {signum}, завершение работы")
+            self.running = False
+            self.stopped.set()
+        
+        signal.signal(signal.SIGINT, handle_signal)
+        signal.signal(signal.SIGTERM, handle_signal)
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.request_reload)
+        
+        while not self.stopped.wait(1.0):
+            pass
+        
+        self.stop()
+        return True
+    
+    def fan_out(self, peers, message, deadline=None, message_id=None):
+        """Параллельная отправка сообщения узлам с общим дедлайном"""
+        if deadline is None:
+            deadline = self.config['broadcast_deadline']
+        report = DeliveryReport(message_id)
+        started = time.monotonic()
+        deadline_at = started + deadline
+        
+        # Узлы других сегментов обслуживают процессы-исполнители
+        if self.workers:
+            peers, delegated = self.delegate_to_workers(peers, message, deadline_at)
+            for peer in delegated:
+                report.add(DeliveryResult(peer, DeliveryResult.QUEUED, 0.0))
+        
+        # Узлам с поддержкой пакетов - в очередь без ожидания отправки
+        if self.batch_sender is not None:
+            direct = []
+            for peer in peers:
+                if self.supports(peer, 'batch'):
+                    codec = self.codec_for(peer)
+                    self.batch_sender.enqueue(peer, codec, message.payload(codec))
+                    report.add(DeliveryResult(peer, DeliveryResult.QUEUED, 0.0))
+                else:
+                    direct.append(peer)
+            peers = direct
+        
+        futures = {
+            self.submit_delivery(peer, message, deadline_at): peer
+            for peer in peers
+        }
+        done, not_done = concurrent.futures.wait(futures, timeout=deadline)
+        
+        for future in done:
+            report.add(future.result())
+        for future in not_done:
+            # Не успевшие к дедлайну отправки считаются просроченными
+            future.cancel()
+            peer = futures[future]
+            report.add(DeliveryResult(peer, DeliveryResult.TIMEOUT, deadline, "дедлайн рассылки"))
+            self.metrics.inc('send_failures_total', labels=(('reason', DeliveryResult.TIMEOUT),))
+            self.logger.warning(f"Таймаут соединения: {peer}")
+        
+        report.elapsed = time.monotonic() - started
+        return report
+    
+    def supports(self, peer, feature):
+        """Объявлена ли узлом возможность протокола"""
+        info = self.peer_table.get(peer)
+        return info is not None and feature in info.capabilities.get('features', ())
+    
+    def compression_for(self, peer):
+        """Способ сжатия пакетов для узла (None - без сжатия)"""
+        compression = self.config['compression']
+        if compression in ('zlib', 'lzma') and self.supports(peer, compression):
+            return compression
+        return None
+    
+    def send_batch_frame(self, peer, frame, count):
+        """Отправка готового кадра-пакета через пул соединений"""
+        started = time.monotonic()
+        try:
+            self.pool.send(peer, frame, timeout=self.config['broadcast_deadline'])
+            self.peer_table.touch(peer)
+            self.record_sent(peer, count, len(frame), time.monotonic() - started)
+            self.logger.debug(f"Пакет из {count} сообщений отправлен к {peer}")
+        except Exception as e:
+            self.peer_table.mark_failed(peer)
+            reason = DeliveryResult.TIMEOUT if isinstance(e, socket.timeout) else DeliveryResult.ERROR
+            self.metrics.inc('send_failures_total', labels=(('reason', reason),))
+            raise
+    
+    def record_sent(self, peer, count, nbytes, latency):
+        """Учет успешной отправки в метриках"""
+        self.metrics.inc('sent_messages_total', count)
+        self.metrics.inc('sent_bytes_total', nbytes)
+        self.metrics.observe('send_latency_seconds', latency, (('peer', f"{peer[0]}:{peer[1]}"),))
+    
+    def codec_for(self, peer):
+        """Лучший кодек из поддерживаемых обеими сторонами (иначе JSON)"""
+        info = self.peer_table.get(peer)
+        peer_codecs = info.capabilities.get('codecs', ()) if info is not None else ()
+        for name in self.config['codecs']:
+            if name in peer_codecs and name in CODECS:
+                return CODECS[name]
+        return JSON_CODEC
+    
+    def deliver(self, peer, message, deadline_at):
+        """Отправка сообщения (OutgoingMessage) одному узлу, возвращает DeliveryResult"""
+        started = time.monotonic()
+        remaining = deadline_at - started
+        if remaining <= 0:
+            return DeliveryResult(peer, DeliveryResult.TIMEOUT, 0.0, "дедлайн рассылки")
         
-        self.logger.info(f"Отправка завершена: {sent_count} успешно, {len(failed_peers)} неудачно")
+        try:
+            if self.tls_client is not None or self.peer_table.protocol(peer) >= PROTOCOL_VERSION:
+                # Постоянное соединение из пула - без повторного handshake
+                data = message.frame(self.codec_for(peer))
+                self.pool.send(peer, data, timeout=remaining)
+            else:
+                # Узлы без поддержки кадров получают сообщение в старом формате
+                data = message.legacy()
+                sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+                sock.settimeout(min(remaining, 3.0))
+                try:
+                    sock.connect(peer)
+                    sock.sendall(data)
+                finally:
+                    sock.close()
+            
+            # Обновляем время активности и задержку
+            latency = time.monotonic() - started
+            self.peer_table.touch(peer)
+            self.peer_table.record_rtt(peer, latency)
+            self.record_sent(peer, 1, len(data), latency)
+                
+            if self.hot_log_enabled():
+                self.logger.info(f"Сообщение отправлено к {peer}")
+            return DeliveryResult(peer, DeliveryResult.OK, latency)
+            
+        except ConnectionRefusedError:
+            self.metrics.inc('send_failures_total', labels=(('reason', DeliveryResult.REFUSED),))
+            self.logger.warning(f"Соединение отклонено: {peer}")
+            return DeliveryResult(peer, DeliveryResult.REFUSED, time.monotonic() - started, "соединение отклонено")
+        except socket.timeout:
+            self.metrics.inc('send_failures_total', labels=(('reason', DeliveryResult.TIMEOUT),))
+            self.logger.warning(f"Таймаут соединения: {peer}")
+            return DeliveryResult(peer, DeliveryResult.TIMEOUT, time.monotonic() - started, "таймаут")
+        except PeerBackoffError as e:
+            self.metrics.inc('send_failures_total', labels=(('reason', DeliveryResult.SKIPPED),))
+            self.logger.warning(f"Узел {peer} пропущен: {e}")
+            return DeliveryResult(peer, DeliveryResult.SKIPPED, time.monotonic() - started, str(e))
+        except Exception as e:
+            self.metrics.inc('send_failures_total', labels=(('reason', DeliveryResult.ERROR),))
+            self.logger.error(f"Ошибка отправки к {peer}: {e}")
+            return DeliveryResult(peer, DeliveryResult.ERROR, time.monotonic() - started, str(e))
     
     def display_network_nodes(self):
         """Отображение списка активных сетевых узлов"""
         print("\n" + "="*50)
         print("АКТИВНЫЕ СЕТЕВЫЕ УЗЛЫ")
         
-        with self.peers_lock:
-            current_time = time.time()
-            active_nodes = []
-            
-            for addr, last_seen in self.peers.items():
-                age = current_time - last_seen
-                if age < 60:  # Активны в последнюю минуту
-                    active_nodes.append((addr, age))
-            
-            if not active_nodes:
-                print("  Активные узлы отсутствуют")
-            else:
-                print(f"  Всего узлов: {len(active_nodes)}")
-                for addr, age in active_nodes:
-                    status = "Активен" if age < 10 else "Недавно" if age < 30 else "Давно"
-                    print(f"  {addr[0]}:{addr[1]} - {status} ({age:.1f} сек назад)")
+        current_time = time.time()
+        active_nodes = self.peer_table.visible_peers()
+        
+        if not active_nodes:
+            print("  Активные узлы отсутствуют")
+        else:
+            print(f"  Всего узлов: {len(active_nodes)}")
+            for info in active_nodes:
+                age = current_time - info.last_seen
+                status = "Активен" if age < 10 else "Недавно" if info.state == PeerTable.ACTIVE else "Давно"
+                rtt = f", задержка {info.rtt * 1000:.1f} мс" if info.rtt is not None else ""
+                print(f"  {info.addr[0]}:{info.addr[1]} - {status} ({age:.1f} сек назад{rtt})")
         
     
     def display_message_log(self):
@@ -404,32 +4742,53 @@ class NetworkMessenger:
         print("\n" + "="*50)
         print("ЖУРНАЛ СООБЩЕНИЙ")
         
-        if not self.messages:
+        if not len(self.message_store):
             print("  Журнал пуст")
         else:
-            print(f"  Всего сообщений: {len(self.messages)}")
+            print(f"  Всего сообщений: {len(self.message_store)}")
             print("  Последние 20 сообщений:")
             print("-" * 50)
-            for msg in self.messages[-20:]:
-                print(f"  {msg}")
+            for record in self.message_store.recent(20):
+                print(f"  {record.render()}")
         
 
     
     def display_system_status(self):
         """Отображение текущего состояния системы"""
         
-        print(f"  Текущий узел: {self.config['host']}:{self.config['port']}")
+        print(f"  Текущий узел: {self.node_address()}")
         print(f"  Порт обнаружения: {self.config['discovery_port']}")
         print(f"  Статус: {'работает' if self.running else 'остановлен'}")
         
-        with self.peers_lock:
-            current_time = time.time()
-            active_count = len([p for p in self.peers.values() if current_time - p < 60])
-            total_peers = len(self.peers)
+        active_count = self.peer_table.count(PeerTable.ACTIVE, PeerTable.IDLE)
+        total_peers = len(self.peer_table)
         
         print(f"  Активных узлов: {active_count}")
         print(f"  Всего известных узлов: {total_peers}")
-        print(f"  Сообщений в журнале: {len(self.messages)}")
+        print(f"  Сообщений в журнале: {len(self.message_store)}")
+        print(f"  Отброшено дубликатов: {self.dedup.hits}")
+        total = self.metrics.total
+        print(f"  Принято: {total('received_messages_total')} сообщений, {total('received_bytes_total')} байт")
+        print(f"  Отправлено: {total('sent_messages_total')} сообщений, {total('sent_bytes_total')} байт")
+        print(f"  Ошибок отправки: {total('send_failures_total')}")
+        print(f"  Входящих соединений: {self.connections}")
+        print(f"  Очередь входящих: {self.inbound.qsize()}/{self.config['inbound_queue_size']}")
+        if self.subscriptions:
+            print(f"  Подписки: {', '.join('#' + topic for topic in sorted(self.subscriptions))}")
+        topics = self.topic_index.topics()
+        if topics:
+            print(f"  Темы в сети: " + ", ".join(f"#{topic} ({count})" for topic, count in sorted(topics.items())))
+        if self.blob_server is not None:
+            print(f"  Файлов для раздачи: {len(self.blob_store.entries())}, порт {self.blob_port}, "
+                  f"отдано {total('blob_bytes_sent_total')} байт, загружено {total('blob_bytes_received_total')} байт")
+        if self.tls_client is not None:
+            print(f"  TLS: исходящих рукопожатий {self.pool.handshakes}, из них возобновлено {self.pool.resumed}")
+        if self.reliable is not None:
+            pending, stored = self.reliable.counts()
+            print(f"  Ожидают подтверждения: {pending}, в outbox: {stored}, повторов: {total('retries_total')}")
+        shed = self.shedder.snapshot()
+        if shed:
+            print(f"  Сброшено из-за перегрузки: " + ", ".join(f"{k}: {v}" for k, v in shed.items()))
         
         # Информация о потоках
         print(f"  Потоков активно: {threading.active_count()}")
@@ -437,29 +4796,20 @@ class NetworkMessenger:
     
     def cleanup_inactive_peers(self):
         """Очистка неактивных узлов"""
-        current_time = time.time()
-        with self.peers_lock:
-            to_remove = []
-            for addr, last_seen in self.peers.items():
-                if current_time - last_seen > 300:  # 5 минут неактивности
-                    to_remove.append(addr)
-            
-            removed_count = len(to_remove)
-            for addr in to_remove:
-                del self.peers[addr]
-            
-            if removed_count > 0:
-                self.logger.info(f"Удалено неактивных узлов: {removed_count}")
+        removed_count = self.peer_table.expire()
+        
+        if removed_count > 0:
+            self.topology_changed()
+            self.logger.info(f"Удалено неактивных узлов: {removed_count}")
     
     def show_control_panel(self):
         """Отображение панели управления"""
-        os.system('cls' if os.name == 'nt' else 'clear')
+        # Очистка экрана escape-последовательностью, без запуска процесса
+        print("\033[2J\033[H", end="")
         print("СЕТЕВОЙ МЕССЕНДЖЕР - ПАНЕЛЬ УПРАВЛЕНИЯ")
-        print(f"Узел: {self.config['host']}:{self.config['port']}")
+        print(f"Узел: {self.node_address()}")
         
-        with self.peers_lock:
-            current_time = time.time()
-            active_count = len([p for p in self.peers.values() if current_time - p < 60])
+        active_count = self.peer_table.count(PeerTable.ACTIVE, PeerTable.IDLE)
         
         print(f"Активных узлов в сети: {active_count}")
         print("\nВЫБЕРИТЕ ДЕЙСТВИЕ:")
@@ -475,13 +4825,15 @@ class NetworkMessenger:
         """Основной цикл выполнения программы"""
         self.logger.info("Запуск основного цикла программы")
         
+        # Включение ANSI последовательностей в консоли Windows
+        if os.name == 'nt':
+            os.system('')
+        if hasattr(signal, 'SIGHUP'):
+            signal.signal(signal.SIGHUP, self.request_reload)
+        
         # Инициализация сервисов
         try:
-            tcp_ok = self.start_tcp_server()
-            udp_ok = self.start_discovery_service()
-            
-            if not tcp_ok or not udp_ok:
-                self.logger.error("Ошибка инициализации сетевых сервисов")
+            if not self.start():
                 print("Ошибка запуска сетевых сервисов. Проверьте логи.")
                 input("Нажмите Enter для выхода...")
                 return
@@ -493,28 +4845,12 @@ class NetworkMessenger:
             return
         
         print("\n" + "="*60)
-        print(f"Ваш адрес: {self.config['host']}:{self.config['port']}")
-        print("Ожидайте обнаружения других узлов (10-30 секунд)...")
-        time.sleep(2)
+        print(f"Ваш адрес: {self.node_address()}")
+        print("Поиск других узлов в сети...")
         
-        # Таймер для обслуживания
-        cleanup_timer = time.time()
-        status_timer = time.time()
-        
-        # Главный цикл
+        # Главный цикл (обслуживание узлов выполняется в фоновом потоке)
         while self.running:
             try:
-                # Фоновая очистка (каждые 30 секунд)
-                current_time = time.time()
-                if current_time - cleanup_timer > 30:
-                    self.cleanup_inactive_peers()
-                    cleanup_timer = current_time
-                
-                # Периодический статус (каждые 60 секунд)
-                if current_time - status_timer > 60:
-                    self.logger.info("Периодический статус - система работает")
-                    status_timer = current_time
-                
                 # Отображение меню и обработка ввода
                 self.show_control_panel()
                 choice = input("\nВыберите действие (1-7): ").strip()
@@ -535,13 +4871,7 @@ class NetworkMessenger:
                     print("\nОбновление сетевой информации...")
                     # Принудительная отправка discovery
                     try:
-                        discovery_msg = {
-                            "type": "discovery",
-                            "host": self.config['host'],
-                            "port": self.config['port'],
-                            "timestamp": time.time()
-                        }
-                        message = json.dumps(discovery_msg).encode('utf-8')
+                        message = self.build_discovery_message()
                         temp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
                         temp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
                         temp_sock.sendto(message, ('255.255.255.255', self.config['discovery_port']))
@@ -575,12 +4905,69 @@ class NetworkMessenger:
     
     def terminate(self):
         """Корректное завершение работы системы"""
+        self.stop()
+        
+        # Завершение логирования
+        self.stop_log_listener()
+        logging.shutdown()
+        
+        print("ПРОГРАММА ЗАВЕРШЕНА")
+        print("Все системные ресурсы освобождены")
+        print("Логи сохранены в файле: network_messenger.log")
+        time.sleep(1)
+    
+    def stop(self):
+        """Остановка сетевых сервисов и освобождение ресурсов (без вывода в терминал)"""
         self.logger.info("Начало процедуры завершения работы")
         self.running = False
+        self.ready.clear()
+        self.stopped.set()
+        self.reload_requested.set()
+        
+        # Остановка цикла событий asyncio
+        if getattr(self, 'loop', None) is not None and self.loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(self.async_stop(), self.loop).result(timeout=2.0)
+            except Exception as e:
+                self.logger.error(f"Ошибка остановки asyncio: {e}")
+            self.loop.call_soon_threadsafe(self.loop.stop)
         
         # Даем время потокам завершиться
         time.sleep(0.5)
         
+        # Остановка процессов-исполнителей
+        for worker in list(self.workers):
+            try:
+                worker.send(('stop',))
+            except (OSError, ValueError):
+                pass
+        for worker in list(self.workers):
+            worker.process.join(timeout=3.0)
+            if worker.process.is_alive():
+                worker.process.terminate()
+        
+        if self.reliable is not None:
+            self.reliable.close()
+        
+        # Закрытие постоянных исходящих соединений
+        if self.batch_sender is not None:
+            self.batch_sender.close()
+        self.send_executor.shutdown(wait=False, cancel_futures=True)
+        self.pool.close_all()
+        
+        if self.message_log is not None:
+            self.message_log.close()
+        self.console.close()
+        if getattr(self, 'metrics_server', None) is not None:
+            self.metrics_server.shutdown()
+            self.metrics_server.server_close()
+        if self.blob_server is not None:
+            self.blob_server.shutdown()
+            self.blob_server.server_close()
+        
+        if self.local_registry is not None:
+            self.local_registry.unregister()
+        
         # Закрытие сокетов
         sockets_to_close = ['tcp_socket', 'udp_send_socket', 'udp_recv_socket']
         
@@ -591,27 +4978,28 @@ class NetworkMessenger:
                     self.logger.info(f"Сокет {socket_name} закрыт")
                 except Exception as e:
                     self.logger.error(f"Ошибка закрытия сокета {socket_name}: {e}")
-        
-        # Завершение логирования
-        logging.shutdown()
-        
-        print("ПРОГРАММА ЗАВЕРШЕНА")
-        print("Все системные ресурсы освобождены")
-        print("Логи сохранены в файле: network_messenger.log")
-        time.sleep(1)
 
 if __name__ == "__main__":
+    args = sys.argv[1:]
+    daemon_mode = '--daemon' in args
+    args = [arg for arg in args if arg != '--daemon']
+    
     try:
         config_file = "config.json"
-        if len(sys.argv) > 1:
-            config_file = sys.argv[1]
-            print(f"Используется конфигурационный файл: {config_file}")
+        if args:
+            config_file = args[0]
+            if not daemon_mode:
+                print(f"Используется конфигурационный файл: {config_file}")
         
         app = NetworkMessenger(config_file)
+        if daemon_mode:
+            sys.exit(0 if app.run_daemon() else 1)
         app.execute()
         
     except Exception as e:
         print(f"КРИТИЧЕСКАЯ ОШИБКА: {e}")
         import traceback
         traceback.print_exc()
+        if daemon_mode:
+            sys.exit(1)
         input("Нажмите Enter для выхода...")
\ No newline at end of file
@@ -0,0 +1,69 @@
+import contextlib
+import io
+import json
+import os
+import socket
+import sys
+import time
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from network_messenger import NetworkMessenger
+
+
+def free_port():
+    """Свободный TCP-порт на loopback"""
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(condition, timeout=5.0, interval=0.02):
+    """Ожидание выполнения условия, возвращает его последнее значение"""
+    deadline = time.monotonic() + timeout
+    while True:
+        result = condition()
+        if result or time.monotonic() > deadline:
+            return result
+        time.sleep(interval)
+
+
+def seed_peers(node, *peers):
+    """Добавление узлов (запущенных узлов или адресов) в таблицу node как активных"""
+    for peer in peers:
+        addr = ('127.0.0.1', peer.config['port']) if isinstance(peer, NetworkMessenger) else peer
+        node.peer_table.touch(addr, protocol=1, capabilities={'codecs': node.config['codecs']})
+
+
+@pytest.fixture
+def make_node(tmp_path, monkeypatch):
+    """Запуск узлов на loopback с конфигурацией во временном каталоге"""
+    monkeypatch.chdir(tmp_path)
+    nodes = []
+
+    def make(port=None, **config):
+        port = port or free_port()
+        config = {
+            "host": "127.0.0.1",
+            "port": port,
+            "discovery_enabled": False,
+            "local_registry": False,
+            "config_watch_interval": 0,
+            **config
+        }
+        config_file = tmp_path / f"node_{port}_{len(nodes)}.json"
+        config_file.write_text(json.dumps(config), encoding='utf-8')
+        with contextlib.redirect_stdout(io.StringIO()):
+            node = NetworkMessenger(str(config_file))
+            node.console_output = False
+            assert node.start(), f"узел на порту {port} не запущен"
+        nodes.append(node)
+        return node
+
+    yield make
+    for node in nodes:
+        if node.running:
+            with contextlib.redirect_stdout(io.StringIO()):
+                node.stop()
@@ -0,0 +1,31 @@
+import socket
+import threading
+import time
+
+from conftest import wait_for
+from network_messenger import JSON_CODEC, encode_batch
+
+
+def test_batch_frames_pause_reading_instead_of_shedding(make_node):
+    """Пакеты больше запаса очереди входящих не сбрасываются, а приостанавливают чтение"""
+    node = make_node(server_mode='asyncio', inbound_queue_size=50)
+    received = []
+    done = threading.Event()
+
+    def slow_handler(message_data, address):
+        time.sleep(0.0005)
+        received.append(message_data['message_id'])
+        if len(received) == 3000:
+            done.set()
+
+    node.on_message(slow_handler)
+    payloads = [JSON_CODEC.encode({"type": "message", "text": "x" * 32, "sender": "127.0.0.1:1",
+                                   "message_id": f"bp-{i}"}) for i in range(3000)]
+    with socket.create_connection(('127.0.0.1', node.config['port'])) as sock:
+        for i in range(0, len(payloads), 64):
+            sock.sendall(encode_batch(JSON_CODEC, payloads[i:i + 64]))
+        assert done.wait(20.0), len(received)
+
+    assert node.shedder.snapshot() == {}
+    assert received == [f"bp-{i}" for i in range(3000)]
+    assert wait_for(lambda: not node.paused_protocols)
@@ -0,0 +1,50 @@
+import concurrent.futures
+import threading
+import time
+
+from conftest import wait_for
+from network_messenger import (BatchSender, CODECS, CODECS_BY_ID, FRAME_CODEC_MASK, FRAME_HEADER,
+                               iter_batch)
+
+
+def decode_batch(frame):
+    _, _, flags, _ = FRAME_HEADER.unpack_from(frame)
+    codec = CODECS_BY_ID[flags & FRAME_CODEC_MASK]
+    return codec.name, [codec.decode(item)['n'] for item in iter_batch(frame[FRAME_HEADER.size:])]
+
+
+def test_codec_switch_keeps_one_batch_in_flight():
+    """Смена кодека узла не отправляет второй пакет, пока первый в пути"""
+    peer = ('127.0.0.1', 1)
+    sent = []
+    active = []
+    lock = threading.Lock()
+
+    def send(peer, frame, count):
+        with lock:
+            active.append(peer)
+            assert active.count(peer) == 1, "два пакета одному узлу одновременно"
+        time.sleep(0.05)
+        with lock:
+            active.remove(peer)
+            sent.append(decode_batch(frame))
+
+    executor = concurrent.futures.ThreadPoolExecutor(4)
+    sender = BatchSender(send, executor, max_messages=64, max_delay=0.001)
+    try:
+        def enqueue(codec, numbers):
+            for n in numbers:
+                sender.enqueue(peer, CODECS[codec], CODECS[codec].encode({"type": "message", "n": n}))
+
+        enqueue('bin1', range(0, 10))
+        assert wait_for(lambda: peer in sender.in_flight, timeout=1.0)
+        # Пока первый пакет в пути, кодек узла меняется дважды
+        enqueue('json', range(10, 20))
+        enqueue('bin1', range(20, 30))
+        assert wait_for(lambda: sum(len(numbers) for _, numbers in sent) == 30)
+    finally:
+        sender.close()
+        executor.shutdown()
+
+    assert sent == [('bin1', list(range(0, 10))), ('json', list(range(10, 20))),
+                    ('bin1', list(range(20, 30)))]
@@ -0,0 +1,105 @@
+import hashlib
+import os
+
+import pytest
+
+from network_messenger import BlobStore, blob_root
+
+CHUNK = 4096
+
+
+def make_file(path, size):
+    data = os.urandom(size)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return data
+
+
+@pytest.fixture
+def nodes(make_node, tmp_path):
+    """Узел-источник и загружающий узел с раздельными каталогами файлов"""
+    def start(name):
+        return make_node(file_transfer=True, blob_chunk_size=CHUNK, blob_parallel=2,
+                         blob_timeout=2.0, blob_dir=str(tmp_path / name))
+    return start('source'), start('target')
+
+
+def test_manifest_and_index(tmp_path):
+    """Манифест: хеши частей и идентификатор-хеш от них; индекс переживает перезапуск"""
+    data = make_file(tmp_path / 'file.bin', CHUNK * 2 + 100)
+    store = BlobStore(str(tmp_path / 'blobs'), CHUNK)
+    manifest = store.add_file(tmp_path / 'file.bin')
+
+    chunks = [hashlib.sha256(data[i:i + CHUNK]).hexdigest() for i in range(0, len(data), CHUNK)]
+    assert manifest['chunks'] == chunks
+    assert manifest['blob_id'] == blob_root(chunks)
+    assert manifest['size'] == len(data)
+
+    reopened = BlobStore(str(tmp_path / 'blobs'), CHUNK)
+    assert reopened.get(manifest['blob_id'])['path'] == str(tmp_path / 'file.bin')
+    os.remove(tmp_path / 'file.bin')
+    assert reopened.get(manifest['blob_id']) is None
+
+
+def test_fetch_blob(nodes, tmp_path):
+    """Файл загружается по частям и совпадает с исходным"""
+    source, target = nodes
+    data = make_file(tmp_path / 'file.bin', CHUNK * 5 + 7)
+    blob_id = source.share_file(tmp_path / 'file.bin')
+
+    path = target.fetch_blob(blob_id, tmp_path / 'copy.bin', holders=[('127.0.0.1', source.blob_port)])
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    assert target.metrics.total('blob_bytes_received_total') == len(data)
+    assert target.blob_store.get(blob_id)['path'] == str(tmp_path / 'copy.bin')
+    assert not any(name.endswith(('.part', '.state')) for name in os.listdir(target.blob_store.directory))
+
+
+def test_fetch_blob_resumes(nodes, tmp_path):
+    """Прерванная загрузка продолжается с недостающих частей, испорченная отмеченная часть загружается заново"""
+    source, target = nodes
+    data = make_file(tmp_path / 'file.bin', CHUNK * 4)
+    blob_id = source.share_file(tmp_path / 'file.bin')
+
+    # Части 0 и 1 уже получены, часть 2 отмечена, но данные не дошли до диска
+    part_path, state_path = target.blob_store.partial_paths(blob_id)
+    with open(part_path, 'wb') as f:
+        f.write(data[:CHUNK * 2] + bytes(CHUNK * 2))
+    with open(state_path, 'wb') as f:
+        f.write(b'\x01\x01\x01\x00')
+
+    path = target.fetch_blob(blob_id, tmp_path / 'copy.bin', holders=[('127.0.0.1', source.blob_port)])
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    assert target.metrics.total('blob_bytes_received_total') == CHUNK * 2
+
+
+def test_fetch_blob_checksum_mismatch(nodes, tmp_path):
+    """Часть с неверной контрольной суммой не принимается; загрузка идет с другого узла"""
+    source, target = nodes
+    data = make_file(tmp_path / 'file.bin', CHUNK * 3)
+    blob_id = source.share_file(tmp_path / 'file.bin')
+    # Файл источника изменен после публикации: манифест прежний, данные другие
+    with open(tmp_path / 'file.bin', 'r+b') as f:
+        f.seek(CHUNK + 1)
+        f.write(b'corrupted')
+    holders = [('127.0.0.1', source.blob_port)]
+
+    with pytest.raises(ConnectionError):
+        target.fetch_blob(blob_id, tmp_path / 'copy.bin', holders=holders)
+    assert target.metrics.total('blob_chunk_failures_total') >= 3
+    assert target.blob_store.get(blob_id) is None
+
+    # Исправный источник: проверенные части не загружаются повторно
+    with open(tmp_path / 'good.bin', 'wb') as f:
+        f.write(data)
+    good = target.blob_store.directory + '-good'
+    store = BlobStore(good, CHUNK)
+    assert store.add_file(tmp_path / 'good.bin')['blob_id'] == blob_id
+    source.blob_store.complete(store.get(blob_id), str(tmp_path / 'good.bin'))
+    received = target.metrics.total('blob_bytes_received_total')
+
+    path = target.fetch_blob(blob_id, tmp_path / 'copy.bin', holders=holders)
+    with open(path, 'rb') as f:
+        assert f.read() == data
+    assert target.metrics.total('blob_bytes_received_total') - received == CHUNK
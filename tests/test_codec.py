@@ -0,0 +1,116 @@
+import json
+import zlib
+from datetime import datetime
+
+import pytest
+
+from network_messenger import (CODECS, FLAG_BATCH, FLAG_LZMA, FLAG_ZLIB, FRAME_HEADER, encode_batch,
+                               write_varint)
+
+BINARY = CODECS['bin1']
+
+
+def binary_payload(*fields):
+    """Двоичное сообщение из готовых полей (тег, байты)"""
+    buf = bytearray(BINARY.HEADER.pack(0, 0))
+    for tag, raw in fields:
+        buf.append(tag)
+        write_varint(buf, len(raw))
+        buf += raw
+    return bytes(buf)
+
+
+def test_binary_codec_roundtrip():
+    """Известные поля кодируются тегами, остальные - блоком JSON"""
+    message = {"type": "message", "text": "привет", "sender": "127.0.0.1:8888",
+               "message_id": 42, "ttl": 3, "topic": "news"}
+    assert BINARY.decode(BINARY.encode(message)) == message
+    assert BINARY.decode(BINARY.encode({**message, "message_id": "a-1"}))['message_id'] == "a-1"
+
+
+@pytest.mark.parametrize('field, value', [
+    ('text', ""), ('text', "строка " * 100), ('sender', "10.0.0.1:1"), ('via', "10.0.0.2:2"),
+    ('message_id', "uuid-1"), ('message_id', 0), ('message_id', 2 ** 63), ('ttl', 0), ('ttl', 300),
+])
+def test_binary_codec_fields(field, value):
+    """Каждое поле таблицы кодируется тегом и восстанавливается без потерь"""
+    encoded = BINARY.encode({field: value})
+    assert b'{' not in encoded[BINARY.HEADER.size:]
+    assert BINARY.decode(encoded) == {field: value}
+
+
+@pytest.mark.parametrize('message_type', BINARY.TYPES + ['custom'])
+def test_binary_codec_types(message_type):
+    """Известные типы передаются кодом в заголовке, остальные - строкой"""
+    assert BINARY.decode(BINARY.encode({"type": message_type})) == {"type": message_type}
+
+
+def test_binary_codec_timestamp():
+    """Время передается в заголовке и после декодирования - секунды от эпохи"""
+    now = datetime.now()
+    decoded = BINARY.decode(BINARY.encode({"timestamp": now.isoformat()}))
+    assert decoded['timestamp'] == pytest.approx(now.timestamp(), abs=1e-6)
+    assert BINARY.decode(BINARY.encode({"timestamp": 1700000000.5})) == {"timestamp": 1700000000.5}
+    # Нераспознанное время сохраняется как есть в блоке JSON
+    assert BINARY.decode(BINARY.encode({"timestamp": "вчера"})) == {"timestamp": "вчера"}
+
+
+def test_binary_codec_extra_fallback():
+    """Поля вне таблицы и значения неподходящего вида передаются блоком JSON"""
+    message = {"topic": "news", "ack": True, "blob_port": 8000, "ttl": -1, "message_id": 1.5,
+               "text": None, "nested": {"a": [1, 2]}}
+    assert BINARY.decode(BINARY.encode(message)) == message
+
+
+@pytest.mark.parametrize('payload', [
+    b'',
+    b'\x01',
+    BINARY.HEADER.pack(len(BINARY.TYPES) + 1, 0),
+    binary_payload((1, 'привет'.encode('utf-8')))[:-1],
+    binary_payload((1, b'\xff\xfe')),
+    binary_payload((14, b'x')),
+    binary_payload((15, b'{"a": ')),
+    binary_payload((15, b'[1, 2]')),
+    binary_payload((15, b'null')),
+    BINARY.HEADER.pack(0, 0) + b'\x05\xff\xff',
+])
+def test_binary_decode_frame_garbage(make_node, payload):
+    """Обрезанные и испорченные двоичные сообщения пропускаются без исключения"""
+    node = make_node()
+    assert node.decode_frame(BINARY.codec_id, payload, ('127.0.0.1', 1)) == []
+
+
+@pytest.mark.parametrize('flags, payload', [
+    (CODECS['json'].codec_id, b'{"type": "mess'),
+    (CODECS['json'].codec_id, b'[1, 2]'),
+    (CODECS['json'].codec_id, b'\xff'),
+    (CODECS['json'].codec_id | FLAG_ZLIB, b'not zlib'),
+    (CODECS['json'].codec_id | FLAG_LZMA, b'not lzma'),
+    (CODECS['json'].codec_id | FLAG_BATCH, b'\x10{}'),
+    (CODECS['json'].codec_id | FLAG_ZLIB, zlib.compress(b'{}')[:-3]),
+    (0x0F, b'{}'),
+])
+def test_decode_frame_garbage(make_node, flags, payload):
+    """Кадр с ошибкой кодека, сжатия или разбиения на пакет пропускается целиком"""
+    node = make_node()
+    assert node.decode_frame(flags, payload, ('127.0.0.1', 1)) == []
+
+
+@pytest.mark.parametrize('codec', CODECS)
+@pytest.mark.parametrize('compression', [None, 'zlib', 'lzma'])
+def test_decode_frame_batch(make_node, codec, compression):
+    """Пакет (в том числе сжатый) разбирается на исходные сообщения"""
+    node = make_node()
+    messages = [{"type": "message", "text": f"сообщение {i}", "message_id": i, "topic": "t"}
+                for i in range(50)]
+    frame = encode_batch(CODECS[codec], [CODECS[codec].encode(m) for m in messages], compression, 64)
+    _, _, flags, _ = FRAME_HEADER.unpack_from(frame)
+    assert bool(flags & (FLAG_ZLIB | FLAG_LZMA)) == (compression is not None)
+    assert node.decode_frame(flags, frame[FRAME_HEADER.size:], ('127.0.0.1', 1)) == messages
+
+
+def test_json_codec_roundtrip():
+    message = {"type": "message", "text": "привет", "message_id": "a-1", "extra": [1, None]}
+    encoded = CODECS['json'].encode(message)
+    assert json.loads(encoded) == message
+    assert CODECS['json'].decode(encoded) == message
@@ -0,0 +1,35 @@
+import json
+import logging
+import socket
+
+
+def test_reload_after_port_autoselect(make_node, caplog):
+    """Порт, выбранный вместо занятого, не считается изменением конфигурации"""
+    with socket.socket() as busy:
+        busy.bind(('127.0.0.1', 0))
+        busy.listen()
+        port = busy.getsockname()[1]
+        node = make_node(port=port)
+        assert node.config['port'] != port
+
+        with caplog.at_level(logging.WARNING, logger='network_messenger'):
+            assert node.reload_config() == set()
+        assert "перезапуска" not in caplog.text
+        assert node.config['port'] != port
+
+        # Настоящее изменение по-прежнему применяется, а порт остается фактическим
+        with open(node.config_file, encoding='utf-8') as f:
+            config = json.load(f)
+        config['gossip_fanout'] = 7
+        with open(node.config_file, 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+        assert node.reload_config() == {'gossip_fanout'}
+        assert node.config['gossip_fanout'] == 7
+        assert node.config['port'] == node.tcp_socket.getsockname()[1]
+
+        config['port'] = port + 1
+        with open(node.config_file, 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+        with caplog.at_level(logging.WARNING, logger='network_messenger'):
+            assert node.reload_config() == set()
+        assert "перезапуска (не применены): port" in caplog.text
@@ -0,0 +1,44 @@
+import socket
+import time
+
+from conftest import wait_for
+from network_messenger import JSON_CODEC, DedupCache, OutgoingMessage
+
+
+def test_duplicates_detected_within_window():
+    cache = DedupCache(window=60.0)
+    assert cache.check_and_add("a") is False
+    assert cache.check_and_add("b") is False
+    assert cache.check_and_add("a") is True
+    assert cache.hits == 1
+
+
+def test_entries_expire_after_window():
+    cache = DedupCache(window=0.05)
+    cache.check_and_add("old")
+    time.sleep(0.1)
+    # Устаревшие записи вытесняются при следующем добавлении
+    assert cache.check_and_add("new") is False
+    assert len(cache) == 1
+    assert cache.check_and_add("old") is False
+
+
+def test_size_limit_evicts_oldest():
+    cache = DedupCache(window=60.0, max_entries=3)
+    for message_id in "abcd":
+        cache.check_and_add(message_id)
+    assert len(cache) == 3
+    assert cache.check_and_add("d") is True
+    assert cache.check_and_add("a") is False
+
+
+def test_node_delivers_repeated_message_once(make_node):
+    node = make_node()
+    received = []
+    node.on_message(lambda message_data, address: received.append(message_data['text']))
+    frame = OutgoingMessage({"type": "message", "text": "once", "sender": "127.0.0.1:1",
+                             "message_id": "dup-1"}).frame(JSON_CODEC)
+    with socket.create_connection(('127.0.0.1', node.config['port'])) as sock:
+        sock.sendall(frame * 3)
+        assert wait_for(lambda: node.metrics.total('duplicates_total') == 2)
+    assert received == ["once"]
@@ -0,0 +1,71 @@
+import json
+import socket
+
+from conftest import free_port, seed_peers
+from network_messenger import PeerTable
+
+
+def probe_replies(sock, timeout=0.5):
+    """Все датаграммы, пришедшие на сокет за timeout секунд"""
+    replies = []
+    sock.settimeout(timeout)
+    try:
+        while True:
+            replies.append(sock.recv(65536))
+    except socket.timeout:
+        return replies
+
+
+def test_probe_reply_limited(make_node):
+    """Ответы на probe ограничены по частоте и по размеру относительно запроса"""
+    node = make_node(discovery_enabled=True, discovery_port=free_port(), discovery_broadcast=False,
+                     discovery_interval_min=60.0, discovery_interval_max=60.0,
+                     probe_reply_rate=1.0, probe_reply_burst=3)
+    seed_peers(node, *[('10.0.0.1', 20000 + i) for i in range(500)])
+
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        probe = json.dumps({"type": "discovery", "host": "127.0.0.1", "port": 1,
+                            "node_id": "probe", "probe": True}).encode('utf-8')
+        for _ in range(20):
+            sock.sendto(probe, ('127.0.0.1', node.config['discovery_port']))
+        replies = probe_replies(sock)
+
+        assert len(replies) == 3
+        assert all(len(reply) <= len(probe) * 3 for reply in replies)
+        assert node.metrics.total('probe_replies_limited_total') == 17
+
+        # Дополненный probe (как шлет сам узел) получает список пропорционально длиннее
+        node.probe_limiter.buckets.clear()
+        padded = json.loads(node.build_discovery_message(probe=True))
+        padded.update(node_id="probe", port=1)
+        padded = json.dumps(padded).encode('utf-8')
+        sock.sendto(padded, ('127.0.0.1', node.config['discovery_port']))
+        reply, = probe_replies(sock)
+        assert len(reply) <= len(padded) * 3
+        assert len(json.loads(reply)['peers']) > 10
+
+
+def test_peer_list_does_not_revive_peers(make_node):
+    """Узлы из чужого списка не становятся активными и не продлевают жизнь выбывшим"""
+    node = make_node()
+    stale = ('10.0.0.1', 9000)
+    seed_peers(node, stale)
+    node.peer_table.mark_failed(stale)
+    last_seen = node.peer_table.get(stale).last_seen
+
+    reply = {"type": "discovery", "host": "127.0.0.1", "port": 1, "node_id": "other", "proto": "x",
+             "peers": [[stale[0], stale[1], 1, ['json'], []], ['10.0.0.2', 9000, "bad", ['json'], []]]}
+    node.process_discovery(json.dumps(reply).encode('utf-8'), ('127.0.0.1', 5000))
+
+    assert node.peer_table.get(('127.0.0.1', 1)).protocol == 0
+    assert node.peer_table.get(stale).state == PeerTable.STALE
+    assert node.peer_table.get(stale).last_seen == last_seen
+    learned = node.peer_table.get(('10.0.0.2', 9000))
+    assert learned.state == PeerTable.IDLE and learned.protocol == 0
+    assert set(node.peers()) == {('127.0.0.1', 1)}
+
+    # Собственный beacon узла делает его активным
+    beacon = {"type": "discovery", "host": "10.0.0.2", "port": 9000, "node_id": "learned", "proto": 1}
+    node.process_discovery(json.dumps(beacon).encode('utf-8'), ('10.0.0.2', 5000))
+    assert node.peer_table.get(('10.0.0.2', 9000)).state == PeerTable.ACTIVE
@@ -0,0 +1,59 @@
+import pytest
+
+from network_messenger import FRAME_HEADER, FrameDecoder, FrameError, encode_frame
+
+
+def feed(decoder, data, chunk):
+    """Подача потока порциями по chunk байт, возвращает копии полезной нагрузки кадров"""
+    payloads = []
+    pos = 0
+    while pos < len(data):
+        buffer = decoder.get_buffer()
+        n = min(chunk, len(buffer), len(data) - pos)
+        buffer[:n] = data[pos:pos + n]
+        pos += n
+        # Кадр - memoryview на буфер декодера: копируем до следующего get_buffer
+        payloads += [(flags, bytes(payload)) for flags, payload in decoder.buffer_updated(n)]
+    return payloads
+
+
+@pytest.mark.parametrize('chunk', [1, 7, 4096])
+def test_frames_reassembled_from_partial_reads(chunk):
+    messages = [b'', b'a', b'x' * 300, bytes(range(256))]
+    stream = b''.join(encode_frame(m, flags=i) for i, m in enumerate(messages))
+    assert feed(FrameDecoder(buffer_size=64), stream, chunk) == list(enumerate(messages))
+
+
+def test_buffer_grows_for_large_frame():
+    decoder = FrameDecoder(buffer_size=64)
+    payload = bytes(range(256)) * 40
+    assert feed(decoder, encode_frame(payload) + encode_frame(b'tail'), 1000) == [(0, payload), (0, b'tail')]
+    assert len(decoder.buffer) >= len(payload) + FRAME_HEADER.size
+
+
+def test_tail_compacted_without_growth():
+    """Недочитанный хвост сдвигается в начало буфера, буфер не растет"""
+    decoder = FrameDecoder(buffer_size=64)
+    messages = [bytes([i]) * 20 for i in range(50)]
+    stream = b''.join(encode_frame(m) for m in messages)
+    assert [p for _, p in feed(decoder, stream, 13)] == messages
+    assert len(decoder.buffer) == 64
+
+
+def test_oversized_frame_rejected():
+    decoder = FrameDecoder(buffer_size=64, max_frame_size=100)
+    with pytest.raises(FrameError):
+        feed(decoder, encode_frame(b'x' * 101), 4096)
+
+
+def test_bad_magic_after_frame_rejected():
+    decoder = FrameDecoder()
+    with pytest.raises(FrameError):
+        feed(decoder, encode_frame(b'ok') + b'\x00X' + b'\x00' * 10, 4096)
+
+
+def test_legacy_stream_returned_on_finish():
+    decoder = FrameDecoder(buffer_size=16)
+    data = b'{"type": "message", "text": "old client"}'
+    assert feed(decoder, data, 5) == []
+    assert bytes(decoder.finish()) == data
@@ -0,0 +1,28 @@
+import threading
+
+from conftest import seed_peers
+
+
+def test_relayed_origin_not_added_as_peer(make_node):
+    """Узел, получивший сообщение через посредника, не считает источник соседом"""
+    origin = make_node(dissemination='gossip')
+    relay = make_node()
+    target = make_node()
+    addr = {node: ('127.0.0.1', node.config['port']) for node in (origin, relay, target)}
+
+    # Цепочка origin - relay - target: target знает только relay
+    seed_peers(origin, relay)
+    seed_peers(relay, origin, target)
+    seed_peers(target, relay)
+
+    received = []
+    done = threading.Event()
+    target.on_message(lambda message_data, address: (received.append(message_data), done.set()))
+    origin.send("через посредника")
+
+    assert done.wait(5.0)
+    message_data, = received
+    assert message_data['sender'] == origin.node_address()
+    assert message_data['via'] == relay.node_address()
+    assert target.peer_table.get(addr[origin]) is None
+    assert target.peer_table.get(addr[relay]) is not None
@@ -0,0 +1,82 @@
+import os
+
+import pytest
+
+from network_messenger import MessageLog
+
+
+def record(i):
+    return {"id": f"m-{i}", "sender": "127.0.0.1:1", "text": f"text {i}", "ts": 1000.0 + i,
+            "rx": 1000.0 + i, "out": False}
+
+
+@pytest.fixture
+def open_log(tmp_path):
+    logs = []
+
+    def open_log(**options):
+        log = MessageLog(str(tmp_path / "log"), fsync_interval=60.0, **options)
+        logs.append(log)
+        return log
+
+    yield open_log
+    for log in logs:
+        log.close()
+
+
+def test_read_seq_time_and_find(open_log):
+    log = open_log(index_interval=8, segment_bytes=2000)
+    for i in range(200):
+        assert log.append(record(i)) == i
+    assert len(log.segments) > 3  # чтение идет через несколько сегментов
+
+    assert [r['seq'] for r in log.read_seq(37, 45)] == list(range(37, 45))
+    assert [r['seq'] for r in log.read_seq(195)] == list(range(195, 200))
+    assert [r['seq'] for r in log.read_time(1050.0, 1052.5)] == [50, 51, 52]
+    assert list(log.read_time(2000.0, 3000.0)) == []
+    assert log.find("m-123")['text'] == "text 123"
+    assert log.find("m-1")['seq'] == 1
+    assert log.find("missing") is None
+    assert [r['seq'] for r in log.tail(3)] == [197, 198, 199]
+
+
+def test_reopen_continues_sequence(open_log):
+    log = open_log()
+    for i in range(10):
+        log.append(record(i))
+    log.close()
+    log = open_log()
+    assert log.append(record(10)) == 10
+    assert [r['seq'] for r in log.read_seq(0)] == list(range(11))
+
+
+def test_torn_tail_recovered(open_log, tmp_path):
+    """Недописанная при сбое строка отбрасывается, запись продолжается с верного номера"""
+    log = open_log(index_interval=1)
+    for i in range(5):
+        log.append(record(i))
+    log.close()
+    path = os.path.join(log.directory, f"{0:020d}.log")
+    with open(path, 'ab') as f:
+        f.write(b'{"seq":5,"id":"m-5","sen')
+    # Индекс после сбоя ссылается за конец данных
+    with open(os.path.join(log.directory, f"{0:020d}.idx"), 'ab') as f:
+        f.write(MessageLog.INDEX_ENTRY.pack(5, 1005.0, os.path.getsize(path) + 100))
+
+    log = open_log(index_interval=1)
+    assert [r['seq'] for r in log.read_seq(0)] == list(range(5))
+    assert log.append(record(5)) == 5
+    assert [r['text'] for r in log.read_seq(4)] == ["text 4", "text 5"]
+    assert all(entry[2] < os.path.getsize(path) for entry in log.indexes[0])
+
+
+def test_rotation_and_retention(open_log):
+    log = open_log(segment_bytes=500, retention_segments=2)
+    for i in range(100):
+        log.append(record(i))
+    assert len(log.segments) == 2
+    files = sorted(os.listdir(log.directory))
+    assert len([name for name in files if name.endswith('.log')]) == 2
+    first = log.segments[0]
+    assert [r['seq'] for r in log.read_seq(0)] == list(range(first, 100))
+    assert log.find("m-0") is None
@@ -0,0 +1,25 @@
+from conftest import seed_peers, wait_for
+from network_messenger import Metrics
+
+
+def test_prometheus_label_escaping():
+    """Значения меток экранируются по формату Prometheus"""
+    metrics = Metrics()
+    metrics.describe('errors_total', "Ошибки\\nпо типу\nвторая строка")
+    metrics.inc('errors_total', labels=(('reason', 'path "C:\\tmp"\nline'),))
+    text = metrics.render_prometheus()
+    assert '# HELP messenger_errors_total Ошибки\\\\nпо типу\\nвторая строка' in text
+    assert 'messenger_errors_total{reason="path \\"C:\\\\tmp\\"\\nline"} 1' in text
+
+
+def test_pending_sends_gauge(make_node):
+    """Ожидающие отправки считаются без обращения к внутренностям пула потоков"""
+    sender = make_node()
+    receiver = make_node()
+    seed_peers(sender, receiver)
+    for i in range(20):
+        sender.send(f"message {i}")
+    assert wait_for(lambda: sender.pending_sends == 0)
+    depth = {item['labels']['queue']: item['value']
+             for item in sender.metrics.snapshot()['gauges']['queue_depth']}
+    assert depth['send'] == 0
@@ -0,0 +1,76 @@
+import time
+
+from network_messenger import PeerTable
+
+A, B = ('10.0.0.1', 8888), ('10.0.0.2', 8888)
+
+
+def table():
+    return PeerTable(active_timeout=30.0, idle_timeout=60.0, expire_timeout=300.0)
+
+
+def test_states_follow_last_activity():
+    peers = table()
+    now = time.time()
+    assert peers.touch(A, now=now) is True
+    assert peers.touch(A, now=now) is False
+    assert peers.get(A).state == PeerTable.ACTIVE
+    assert peers.active_peers() == (A,)
+
+    peers.expire(now + 31)
+    assert peers.get(A).state == PeerTable.IDLE
+    assert peers.active_peers() == ()
+    assert [info.addr for info in peers.visible_peers()] == [A]
+
+    peers.expire(now + 61)
+    assert peers.get(A).state == PeerTable.STALE
+    assert peers.stale_peers() == [A]
+
+    assert peers.expire(now + 301) == 1
+    assert A not in peers
+    assert len(peers) == 0
+
+
+def test_activity_postpones_transition():
+    """Повторная активность переносит проверку, лишние записи кучи пропускаются"""
+    peers = table()
+    now = time.time()
+    peers.touch(A, now=now)
+    for step in range(1, 10):
+        peers.touch(A, now=now + step * 20)
+    peers.expire(now + 9 * 20 + 29)
+    assert peers.get(A).state == PeerTable.ACTIVE
+    peers.expire(now + 9 * 20 + 31)
+    assert peers.get(A).state == PeerTable.IDLE
+    assert len(peers.heap) <= 2
+
+
+def test_counts_and_failure():
+    peers = table()
+    now = time.time()
+    peers.touch(A, protocol=1, capabilities={'codecs': ['bin1']}, now=now)
+    peers.touch(B, now=now)
+    assert peers.count(PeerTable.ACTIVE) == 2
+
+    peers.mark_failed(B)
+    assert peers.get(B).state == PeerTable.STALE
+    assert peers.count(PeerTable.ACTIVE) == 1
+    assert peers.count(PeerTable.STALE) == 1
+    assert peers.active_peers() == (A,)
+    assert peers.protocol(A) == 1 and peers.protocol(B) == 0
+    assert peers.get(A).capabilities == {'codecs': ['bin1']}
+
+    # Узел снова на связи - возвращается в активные
+    peers.touch(B, now=now + 1)
+    assert peers.get(B).state == PeerTable.ACTIVE
+    assert peers.get(B).failures == 0
+    assert sorted(peers.active_peers()) == [A, B]
+
+
+def test_active_snapshot_reused_until_change():
+    peers = table()
+    peers.touch(A)
+    first = peers.active_peers()
+    assert peers.active_peers() is first
+    peers.touch(B)
+    assert sorted(peers.active_peers()) == [A, B]
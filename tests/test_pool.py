@@ -0,0 +1,144 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from conftest import free_port, wait_for
+from network_messenger import ConnectionPool, PeerBackoffError, PeerConnection
+
+
+class Server:
+    """TCP сервер на loopback: считает подключения и принятые байты"""
+
+    def __init__(self):
+        self.sock = socket.create_server(('127.0.0.1', 0))
+        self.addr = self.sock.getsockname()
+        self.connections = []
+        self.received = bytearray()
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while True:
+            try:
+                conn, _ = self.sock.accept()
+            except OSError:
+                return
+            self.connections.append(conn)
+            threading.Thread(target=self.read, args=(conn,), daemon=True).start()
+
+    def read(self, conn):
+        while True:
+            try:
+                data = conn.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            self.received += data
+
+    def close(self):
+        self.sock.close()
+        for conn in self.connections:
+            conn.close()
+
+
+@pytest.fixture
+def server():
+    server = Server()
+    yield server
+    server.close()
+
+
+def test_connection_reused(server):
+    pool = ConnectionPool()
+    try:
+        for i in range(5):
+            pool.send(server.addr, b'message %d;' % i)
+        assert wait_for(lambda: len(server.received) == 5 * len(b'message 0;'))
+        assert len(server.connections) == 1
+        assert len(pool) == 1
+        assert pool.acquire(server.addr)[1] is True
+    finally:
+        pool.close_all()
+
+
+def test_reconnect_after_remote_close(server):
+    pool = ConnectionPool()
+    try:
+        pool.send(server.addr, b'first;')
+        assert wait_for(lambda: server.connections)
+        server.connections[0].shutdown(socket.SHUT_RDWR)
+        time.sleep(0.05)
+        # Закрытое той стороной соединение заменяется новым без ошибки для отправителя
+        pool.send(server.addr, b'second;')
+        assert wait_for(lambda: bytes(server.received) == b'first;second;')
+        assert len(server.connections) == 2
+    finally:
+        pool.close_all()
+
+
+def test_idle_connections_evicted(server):
+    pool = ConnectionPool(idle_timeout=0.1)
+    try:
+        pool.send(server.addr, b'x')
+        time.sleep(0.15)
+        pool.maybe_evict_idle()
+        assert len(pool) == 0
+    finally:
+        pool.close_all()
+
+
+def test_lru_eviction_over_max_size():
+    servers = [Server(), Server()]
+    pool = ConnectionPool(max_size=1)
+    try:
+        for server in servers:
+            pool.send(server.addr, b'x')
+        assert len(pool) == 1
+        assert pool.acquire(servers[1].addr)[1] is True
+    finally:
+        pool.close_all()
+        for server in servers:
+            server.close()
+
+
+def test_backoff_after_failures():
+    addr = ('127.0.0.1', free_port())
+    pool = ConnectionPool(backoff_base=0.1, backoff_max=1.0)
+    with pytest.raises(ConnectionRefusedError):
+        pool.send(addr, b'x')
+    # Повтор сразу же не подключается, а отклоняется до истечения паузы
+    with pytest.raises(PeerBackoffError):
+        pool.send(addr, b'x')
+    assert pool.backoff[addr][0] == 1
+
+    time.sleep(0.12)
+    with pytest.raises(ConnectionRefusedError):
+        pool.send(addr, b'x')
+    failures, next_attempt = pool.backoff[addr]
+    assert failures == 2
+    assert next_attempt - time.monotonic() > 0.1  # пауза удвоилась
+
+    # Успешная отправка сбрасывает счетчик ошибок
+    server = socket.create_server(addr)
+    try:
+        time.sleep(0.2)
+        pool.send(addr, b'x')
+        assert addr not in pool.backoff
+    finally:
+        pool.close_all()
+        server.close()
+
+
+def test_busy_connection_not_probed():
+    """Соединение, занятое отправкой, не читается проверкой и считается живым"""
+    local, remote = socket.socketpair()
+    conn = PeerConnection(local)
+    try:
+        remote.close()
+        with conn.lock:
+            assert conn.is_alive()
+        assert not conn.is_alive()
+    finally:
+        conn.close()
@@ -0,0 +1,60 @@
+import os
+
+import pytest
+
+from network_messenger import LocalRegistry
+
+
+def registry(directory, port):
+    node = LocalRegistry(str(directory), f"{port}-node")
+    node.register({"host": "127.0.0.1", "port": port, "udp_port": port + 1})
+    return node
+
+
+def test_nodes_see_each_other(tmp_path):
+    directory = tmp_path / "registry"
+    first, second = registry(directory, 9000), registry(directory, 9100)
+    assert [entry['port'] for entry in first.entries()] == [9100]
+    assert [entry['port'] for entry in second.entries()] == [9000]
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+    assert os.stat(first.path).st_mode & 0o777 == 0o600
+    second.unregister()
+    assert first.entries() == []
+
+
+def test_directory_open_to_others_rejected(tmp_path):
+    directory = tmp_path / "shared"
+    directory.mkdir(mode=0o777)
+    os.chmod(directory, 0o777)
+    with pytest.raises(PermissionError):
+        LocalRegistry(str(directory), "node")
+
+
+def test_symlinked_directory_rejected(tmp_path):
+    target = tmp_path / "target"
+    target.mkdir(mode=0o700)
+    link = tmp_path / "link"
+    link.symlink_to(target)
+    with pytest.raises(PermissionError):
+        LocalRegistry(str(link), "node")
+
+
+def test_symlinks_in_directory_not_followed(tmp_path):
+    """Подставленные ссылки не читаются, не удаляются по цели и не перезаписываются"""
+    directory = tmp_path / "registry"
+    node = registry(directory, 9000)
+    victim = tmp_path / "victim.json"
+    victim.write_text('{"host": "10.0.0.1", "port": 1, "udp_port": 2}')
+    (directory / "fake.json").symlink_to(victim)
+    (directory / f"9000-node.json.{os.getpid()}.tmp").symlink_to(victim)
+
+    assert node.entries() == []
+    node.register({"host": "127.0.0.1", "port": 9000, "udp_port": 9001})
+    assert victim.read_text() == '{"host": "10.0.0.1", "port": 1, "udp_port": 2}'
+
+
+def test_default_directory_per_user(tmp_path, monkeypatch):
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmp_path))
+    assert LocalRegistry.default_directory(8889) == str(tmp_path / "p2p-messenger-8889")
+    monkeypatch.delenv('XDG_RUNTIME_DIR')
+    assert str(os.getuid()) in os.path.basename(LocalRegistry.default_directory(8889))
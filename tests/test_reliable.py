@@ -0,0 +1,67 @@
+import threading
+import time
+
+from conftest import free_port, seed_peers, wait_for
+from network_messenger import ReliableSender
+
+
+def test_outbox_delivered_when_peer_returns(make_node):
+    """Сообщения для недоступного узла доставляются, когда он снова на связи"""
+    sender = make_node(reliable_delivery=True, ack_timeout=0.2)
+    # Узел известен отправителю, но его порт пока никто не слушает
+    addr = ('127.0.0.1', free_port())
+    seed_peers(sender, addr)
+
+    # Первая отправка не удается (пауза переподключения), вторая - сразу в outbox
+    assert addr in sender.send("first").failed
+    sender.send("second")
+    assert wait_for(lambda: sender.reliable.counts()[1] == 2)
+
+    receiver = make_node(port=addr[1], reliable_delivery=True)
+    received = []
+    done = threading.Event()
+    receiver.on_message(lambda message_data, address: (
+        received.append(message_data['text']), len(received) == 2 and done.set()))
+    # Узел сам напоминает о себе - отправитель видит его до истечения паузы переподключения
+    seed_peers(receiver, sender)
+    receiver.send("back")
+
+    assert done.wait(5.0), received
+    assert sorted(received) == ["first", "second"]
+    assert wait_for(lambda: sender.reliable.counts() == (0, 0))
+
+
+def test_unacknowledged_messages_stop_at_max_retries():
+    """Узел на связи, но без ACK: повторов не больше max_retries, затем outbox"""
+    peer = ('127.0.0.1', 1)
+    resent = []
+    reliable = ReliableSender(lambda peer, message: resent.append(message), lambda peer: True,
+                              ack_timeout=0.02, backoff_max=0.1, max_retries=3)
+    try:
+        for i in range(100):
+            reliable.track(peer, f"m-{i}", i)
+        # Каждый beacon узла не должен сбрасывать попытки и паузу повтора
+        deadline = time.monotonic() + 1.0
+        while time.monotonic() < deadline:
+            reliable.peer_online(peer)
+            time.sleep(0.01)
+        assert wait_for(lambda: reliable.counts() == (0, 100))
+        assert len(resent) == 300
+        assert not reliable.has_backlog(peer)
+    finally:
+        reliable.close()
+
+
+def test_pending_limited_per_peer():
+    """Сообщений без ACK на узел не больше лимита - старые вытесняются"""
+    dropped = []
+    reliable = ReliableSender(lambda peer, message: None, lambda peer: True, ack_timeout=60.0,
+                              pending_per_peer=10, on_drop=lambda peer, message_id: dropped.append(message_id))
+    try:
+        for i in range(25):
+            reliable.track(('127.0.0.1', 1), f"m-{i}", i)
+        reliable.track(('127.0.0.1', 2), "other", 0)
+        assert reliable.counts() == (11, 0)
+        assert dropped == [f"m-{i}" for i in range(15)]
+    finally:
+        reliable.close()
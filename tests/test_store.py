@@ -0,0 +1,40 @@
+from network_messenger import MessageStore
+
+
+def filled(count, capacity):
+    store = MessageStore(capacity=capacity)
+    for i in range(count):
+        store.add(f"peer-{i % 3}", f"text {i}", message_id=f"m-{i}", received_at=1000.0 + i)
+    return store
+
+
+def test_between_bisects_time_range():
+    store = filled(100, 100)
+    assert [r.text for r in store.between(1010.0, 1013.0)] == [f"text {i}" for i in range(10, 14)]
+    assert [r.text for r in store.between(1010.5, 1012.5)] == ["text 11", "text 12"]
+    assert store.between(900.0, 999.0) == []
+    assert len(store.between(0.0, 2000.0)) == 100
+
+
+def test_between_after_wraparound():
+    """Поиск по кольцу после вытеснения самых старых записей"""
+    store = filled(250, 100)
+    assert len(store) == 100
+    assert [r.seq for r in store.between(0.0, 1152.0)] == list(range(150, 153))
+    assert [r.seq for r in store.between(1248.0, 1e9)] == [248, 249]
+
+
+def test_equal_timestamps_included_at_both_ends():
+    store = MessageStore(capacity=10)
+    for i, moment in enumerate([1.0, 2.0, 2.0, 2.0, 3.0]):
+        store.add("peer", str(i), received_at=moment)
+    assert [r.text for r in store.between(2.0, 2.0)] == ["1", "2", "3"]
+
+
+def test_indexes_follow_eviction():
+    store = filled(250, 100)
+    assert store.get("m-149") is None
+    assert store.get("m-150").text == "text 150"
+    assert [r.seq for r in store.from_sender("peer-0")][:2] == [150, 153]
+    assert [r.seq for r in store.from_sender("peer-0", limit=2)] == [246, 249]
+    assert [r.seq for r in store.recent(3)] == [247, 248, 249]
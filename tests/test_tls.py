@@ -0,0 +1,83 @@
+"""TLS между узлами: взаимная проверка сертификатов и возобновление сессий
+
+Сертификаты в tests/certs выпущены заранее (EC P-256, срок 100 лет):
+ca.pem - CA кластера, node-a и node-b подписаны им, intruder - самоподписанный.
+"""
+import os
+import socket
+import ssl
+import threading
+
+import pytest
+
+from conftest import seed_peers, wait_for
+
+CERTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'certs')
+CA = os.path.join(CERTS, 'ca.pem')
+
+
+def tls_config(name):
+    return {"tls": True, "tls_cert": os.path.join(CERTS, f'{name}.pem'),
+            "tls_key": os.path.join(CERTS, f'{name}.key'), "tls_ca": CA}
+
+
+def connect(node, sender):
+    addr = ('127.0.0.1', node.config['port'])
+    seed_peers(sender, addr)
+    received = []
+    event = threading.Event()
+    node.on_message(lambda message_data, address: (received.append(message_data['text']), event.set()))
+    return addr, received, event
+
+
+@pytest.mark.parametrize('mode', ['threads', 'asyncio'])
+def test_mutual_tls_delivery(make_node, mode):
+    """Узлы с сертификатами CA кластера обмениваются сообщениями по TLS"""
+    receiver = make_node(server_mode=mode, **tls_config('node-b'))
+    sender = make_node(server_mode=mode, **tls_config('node-a'))
+    addr, received, event = connect(receiver, sender)
+
+    assert addr in sender.send("secret").delivered
+    assert event.wait(5.0)
+    assert received == ["secret"]
+    assert sender.pool.handshakes == 1
+    assert wait_for(lambda: receiver.metrics.total('tls_handshakes_total') == 1)
+
+
+@pytest.mark.parametrize('mode', ['threads', 'asyncio'])
+def test_unknown_client_certificate_rejected(make_node, mode):
+    """Соединение с сертификатом не от CA кластера отклоняется"""
+    receiver = make_node(server_mode=mode, **tls_config('node-b'))
+    intruder = make_node(**{**tls_config('intruder'), "tls_ca": CA})
+    _, received, event = connect(receiver, intruder)
+
+    intruder.send("intrusion")
+    assert not event.wait(1.0)
+    assert received == []
+
+    # Прямое подключение: в TLS 1.3 отказ сервера приходит при первом чтении
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.load_cert_chain(os.path.join(CERTS, 'intruder.pem'), os.path.join(CERTS, 'intruder.key'))
+    context.load_verify_locations(CA)
+    context.check_hostname = False
+    with pytest.raises((ssl.SSLError, ConnectionError)):
+        with context.wrap_socket(socket.create_connection(('127.0.0.1', receiver.config['port']),
+                                                          timeout=2.0)) as sock:
+            assert sock.recv(1) == b''
+            raise ConnectionError("соединение закрыто сервером")
+
+
+def test_session_resumed_after_reconnect(make_node):
+    """Соединение, оборванное после первой отправки, восстанавливается с возобновлением сессии"""
+    receiver = make_node(**tls_config('node-b'))
+    sender = make_node(**tls_config('node-a'))
+    addr, received, _ = connect(receiver, sender)
+
+    sender.send("first")
+    for i in range(4):
+        sender.pool.discard(addr)
+        assert addr in sender.send(f"again {i}").delivered
+
+    assert wait_for(lambda: len(received) == 5)
+    assert sender.pool.handshakes == 5
+    assert sender.pool.resumed == 4
@@ -0,0 +1,57 @@
+from conftest import seed_peers, wait_for
+from network_messenger import DeliveryResult, TopicIndex
+
+
+def test_topic_index_replaces_peer_topics():
+    """Каждое объявление заменяет прежний набор тем узла"""
+    index = TopicIndex()
+    a, b = ('127.0.0.1', 1), ('127.0.0.1', 2)
+    assert index.update(a, ['news', 'chat'])
+    assert index.update(b, ['news', 'bad topic', '', 42])
+    assert not index.update(b, ['news'])
+    assert index.subscribers('news') == {a, b}
+    assert index.topics() == {'news': 2, 'chat': 1}
+
+    assert index.update(a, ['chat'])
+    assert index.subscribers('news') == {b}
+    index.remove(b)
+    assert index.subscribers('news') == frozenset()
+    assert index.topics() == {'chat': 1}
+    assert b not in index.by_peer
+
+
+def test_subscription_announced_in_beacon(make_node):
+    """Подписка попадает в beacon, и получатель обновляет индекс"""
+    node = make_node()
+    peer = make_node()
+    peer.subscribe('news')
+    peer_addr = ('127.0.0.1', peer.config['port'])
+
+    node.process_discovery(peer.build_discovery_message(), peer_addr)
+    assert node.topic_index.subscribers('news') == {peer_addr}
+
+    peer.unsubscribe('news')
+    node.process_discovery(peer.build_discovery_message(), peer_addr)
+    assert node.topic_index.subscribers('news') == frozenset()
+
+
+def test_publish_reaches_only_subscribers(make_node):
+    """Сообщение темы получают только подписчики"""
+    node = make_node()
+    subscriber, other = make_node(), make_node()
+    received = {subscriber: [], other: []}
+    for peer in received:
+        peer.on_message(lambda message_data, address, got=received[peer]: got.append(message_data))
+    seed_peers(node, subscriber, other)
+    subscriber.subscribe('news')
+    node.process_discovery(subscriber.build_discovery_message(), ('127.0.0.1', subscriber.config['port']))
+
+    report = node.publish('news', "hello")
+    assert report.counts() == {DeliveryResult.OK: 1}
+    assert wait_for(lambda: received[subscriber])
+    assert received[subscriber][0]['topic'] == 'news'
+    assert received[subscriber][0]['text'] == "hello"
+    assert received[other] == []
+
+    # Тема без подписчиков никуда не отправляется
+    assert node.publish('empty', "nobody").counts() == {}
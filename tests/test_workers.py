@@ -0,0 +1,44 @@
+import socket
+import time
+from collections import Counter
+
+from conftest import seed_peers, wait_for
+from network_messenger import JSON_CODEC, OutgoingMessage
+
+
+def test_worker_fan_out_without_duplicates(make_node):
+    """Рассылка делится между процессами: каждый узел получает каждое сообщение один раз"""
+    sender = make_node(workers=3)
+    assert len(sender.workers) == 2
+    receivers = [make_node() for _ in range(6)]
+    received = Counter()
+    for receiver in receivers:
+        receiver.on_message(lambda message_data, address, port=receiver.config['port']:
+                            received.update([(port, message_data['text'])]))
+    seed_peers(sender, *receivers)
+
+    for i in range(20):
+        sender.send(f"message {i}")
+
+    assert wait_for(lambda: sum(received.values()) >= 120, timeout=10.0)
+    assert received == Counter({(receiver.config['port'], f"message {i}"): 1
+                                for receiver in receivers for i in range(20)})
+
+
+def test_worker_inbound_deduplicated(make_node):
+    """Сообщения, принятые разными процессами, проходят общую проверку повторов"""
+    node = make_node(workers=3)
+    received = []
+    node.on_message(lambda message_data, address: received.append(message_data['message_id']))
+    sockets = [socket.create_connection(('127.0.0.1', node.config['port'])) for _ in range(12)]
+    try:
+        for i in range(600):
+            message = OutgoingMessage({"type": "message", "text": "x", "sender": "127.0.0.1:1",
+                                       "message_id": f"w-{i % 300}"})
+            sockets[i % 12].sendall(message.frame(JSON_CODEC))
+        assert wait_for(lambda: len(received) >= 300, timeout=10.0)
+        time.sleep(0.3)  # запоздавшие копии не должны дойти до обработчика
+    finally:
+        for sock in sockets:
+            sock.close()
+    assert sorted(received) == sorted(f"w-{i}" for i in range(300))